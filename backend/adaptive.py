@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+
+from . import deadlines
+from .metrics import UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_LIMIT_DECREASES, UPSTREAM_QUEUE_DEPTH
+from .models import AdapterOverloaded
+
+UPSTREAM_BUSY = "The model is busy. Please try again shortly."
+
+
+class Call:
+    """What one upstream call reports back to the limiter when it ends.
+
+    ``kind`` names the latency baseline the call is compared with: streams report
+    time to first chunk, other calls total time, so they are kept apart. A call
+    that is neither ``succeeded`` nor ``failed`` (cancelled, or an error that says
+    nothing about upstream load) leaves the limit as it is.
+    """
+
+    __slots__ = ("failed", "kind", "latency", "overloaded", "succeeded")
+
+    def __init__(self, kind: str = "call"):
+        self.kind = kind
+        self.latency: float | None = None
+        self.overloaded = False
+        self.failed = False
+        self.succeeded = False
+
+
+class AdaptiveLimiter:
+    """Limits concurrent upstream calls, adapting the limit with AIMD.
+
+    Every call that succeeds at normal latency raises the limit by ``1 / limit``
+    (about one per limit's worth of calls). A call rejected for quota, or one
+    slower than ``latency_factor`` times the usual latency of its kind, or one
+    that failed upstream (5xx) cuts the limit by ``backoff``; cuts are at most one
+    per ``decrease_interval_s``, so a burst of 429s from calls already in flight
+    counts once. Cancelled calls and other errors leave the limit unchanged. The limit stays between
+    ``min_limit`` and ``max_limit``; with both equal it is a fixed limit.
+
+    Calls over the limit wait in a FIFO queue for up to ``max_wait_s`` (``None``
+    waits as long as the request deadline allows), then fail with
+    ``AdapterOverloaded``.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        max_wait_s: float | None = None,
+        backoff: float = 0.5,
+        latency_factor: float = 2.0,
+        smoothing: float = 0.05,
+        min_samples: int = 20,
+        decrease_interval_s: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.max_wait_s = max_wait_s
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.decrease_interval_s = decrease_interval_s
+        self.in_flight = 0
+        self._limit = float(self.max_limit)
+        self._clock = clock
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._latency: dict[str, float] = {}
+        self._samples: dict[str, int] = {}
+        self._last_decrease = -math.inf
+        UPSTREAM_CONCURRENCY_LIMIT.set(self.limit)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, kind: str = "call") -> AsyncIterator[Call]:
+        """Hold one slot for an upstream call; fill in the yielded ``Call``."""
+        await self.acquire()
+        call = Call(kind)
+        try:
+            yield call
+        finally:
+            self.release(call)
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        timeout = self.max_wait_s
+        budget = deadlines.remaining()
+        if budget is not None:
+            timeout = budget if timeout is None else min(timeout, budget)
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        UPSTREAM_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as err:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as this caller gave up.
+                self._return()
+            if isinstance(err, TimeoutError):
+                raise AdapterOverloaded(UPSTREAM_BUSY) from None
+            raise
+        finally:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(future)
+            UPSTREAM_QUEUE_DEPTH.dec()
+
+    def release(self, call: Call) -> None:
+        if call.overloaded:
+            self._decrease("rate_limited")
+        elif call.failed:
+            self._decrease("error")
+        elif call.succeeded:
+            if call.latency is not None and self._is_spike(call.kind, call.latency):
+                self._decrease("latency")
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+            if call.latency is not None:
+                self._observe(call.kind, call.latency)
+        UPSTREAM_CONCURRENCY_LIMIT.set(self.limit)
+        self._return()
+
+    def _is_spike(self, kind: str, latency: float) -> bool:
+        usual = self._latency.get(kind)
+        return (
+            usual is not None
+            and self._samples.get(kind, 0) >= self.min_samples
+            and latency > self.latency_factor * usual
+        )
+
+    def _observe(self, kind: str, latency: float) -> None:
+        self._samples[kind] = self._samples.get(kind, 0) + 1
+        usual = self._latency.get(kind)
+        self._latency[kind] = (
+            latency if usual is None else usual + self.smoothing * (latency - usual)
+        )
+
+    def _decrease(self, reason: str) -> None:
+        now = self._clock()
+        if now - self._last_decrease < self.decrease_interval_s:
+            return
+        lowered = max(float(self.min_limit), self._limit * self.backoff)
+        if lowered < self._limit:
+            self._limit = lowered
+            self._last_decrease = now
+            UPSTREAM_LIMIT_DECREASES.labels(reason=reason).inc()
+
+    def _return(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections.abc import Awaitable, Callable
+
+from . import deadlines
+from .metrics import BATCH_SIZE, BATCH_WAIT
+
+BatchRunner = Callable[[list[str], str], Awaitable[list[str]]]
+
+
+class _Item:
+    __slots__ = ("text", "future", "queued_at", "budget")
+
+    def __init__(self, text: str, future: asyncio.Future[str]):
+        self.text = text
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.budget = deadlines.remaining()
+
+
+class _Batch:
+    def __init__(self, run: BatchRunner):
+        self.run = run
+        self.items: list[_Item] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MicroBatcher:
+    """Collects short texts for a few milliseconds and corrects them in one call.
+
+    Texts of the same language queue up until ``max_size`` are waiting or the first
+    has waited ``max_wait_s``; the batch is then handed to the ``run`` callable given
+    by the first caller, which returns one correction per text. Only texts up to
+    ``max_text_chars`` are batched (see ``accepts``), so a batch stays small.
+    """
+
+    def __init__(self, max_size: int = 8, max_wait_s: float = 0.005, max_text_chars: int = 300):
+        self.max_size = max(1, max_size)
+        self.max_wait_s = max_wait_s
+        self.max_text_chars = max_text_chars
+        self._pending: dict[str, _Batch] = {}
+        self._running: set[asyncio.Task[None]] = set()
+
+    def accepts(self, text: str) -> bool:
+        return len(text) <= self.max_text_chars
+
+    async def submit(self, text: str, lang: str, run: BatchRunner) -> str:
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(lang)
+        if batch is None:
+            batch = self._pending[lang] = _Batch(run)
+            batch.timer = loop.call_later(self.max_wait_s, self._dispatch, lang, batch)
+        future: asyncio.Future[str] = loop.create_future()
+        batch.items.append(_Item(text, future))
+        if len(batch.items) >= self.max_size:
+            self._dispatch(lang, batch)
+        return await future
+
+    def _dispatch(self, lang: str, batch: _Batch) -> None:
+        if self._pending.get(lang) is batch:
+            del self._pending[lang]
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        # A fresh context: the batch must not inherit the deadline of whichever
+        # caller happened to fill it; it gets the loosest deadline of its items.
+        task = asyncio.create_task(self._run(lang, batch), context=contextvars.Context())
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, lang: str, batch: _Batch) -> None:
+        # Callers that already gave up (timed out, disconnected) are left out.
+        items = [item for item in batch.items if not item.future.done()]
+        if not items:
+            return
+        now = time.monotonic()
+        BATCH_SIZE.observe(len(items))
+        for item in items:
+            BATCH_WAIT.observe(now - item.queued_at)
+        budgets = [item.budget for item in items if item.budget is not None]
+        try:
+            with contextlib.ExitStack() as stack:
+                if len(budgets) == len(items):
+                    stack.enter_context(deadlines.bind(max(budgets)))
+                results = await batch.run([item.text for item in items], lang)
+        except BaseException as err:
+            for item in items:
+                if item.future.done():
+                    continue
+                if isinstance(err, asyncio.CancelledError):
+                    item.future.cancel()
+                else:
+                    item.future.set_exception(err)
+            if not isinstance(err, Exception):
+                raise
+            return
+        for item, result in zip(items, results, strict=True):
+            if not item.future.done():
+                item.future.set_result(result)
@@ -0,0 +1,208 @@
+import asyncio
+import random
+import time
+from collections.abc import AsyncGenerator, Callable
+from typing import Any
+
+from . import deadlines
+from .metrics import CIRCUIT_REJECTED, CIRCUIT_STATE, UPSTREAM_RETRIES
+from .models import AdapterOverloaded, AdapterUnavailable, ModelAdapter
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Fails fast while a dependency is down instead of letting every call time out.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and rejects
+    calls for ``reset_timeout_s``. It then turns half-open and lets up to
+    ``half_open_calls`` trial calls through: a success closes it again, a failure
+    re-opens it. Calls that end without a verdict (cancelled, or refused for quota)
+    must still be reported with ``abandoned`` so their trial slot is returned.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_calls = max(1, half_open_calls)
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._clock = clock
+        CIRCUIT_STATE.labels(breaker=name).set(0)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout_s:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    def ready(self) -> bool:
+        """Whether ``allow`` would let a call through, without taking a trial slot."""
+        state = self.state
+        if state == OPEN:
+            return False
+        return state == CLOSED or self._trials < self.half_open_calls
+
+    def allow(self) -> bool:
+        if not self.ready():
+            CIRCUIT_REJECTED.labels(breaker=self.name).inc()
+            return False
+        if self._state == HALF_OPEN:
+            self._trials += 1
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a trial call through."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout_s - self._clock())
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        if self._state == HALF_OPEN:
+            self._trials = 0
+            self._set_state(CLOSED)
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self._state == HALF_OPEN or (
+            self._state == CLOSED and self.failures >= self.failure_threshold
+        ):
+            self._trials = 0
+            self._opened_at = self._clock()
+            self._set_state(OPEN)
+
+    def abandoned(self) -> None:
+        if self._state == HALF_OPEN:
+            self._trials = max(0, self._trials - 1)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after_s": round(self.retry_after(), 3),
+        }
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        CIRCUIT_STATE.labels(breaker=self.name).set(_STATE_VALUES[state])
+
+
+class RetryBudget:
+    """Decides whether a failed upstream call may be retried, and after how long.
+
+    Every call earns ``ratio`` retry tokens and every retry spends one, so retries
+    stay under ``ratio`` of all calls (bursts up to ``max_tokens``) and cannot
+    multiply load during an outage. Delays use exponential backoff with full
+    jitter, so retries from many requests do not arrive in waves.
+    """
+
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        max_attempts: int = 2,
+        base_delay_s: float = 0.1,
+        max_delay_s: float = 2.0,
+        max_tokens: float = 10.0,
+        rng: random.Random | None = None,
+    ):
+        self.ratio = ratio
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._rng = rng or random.Random()
+
+    def earn(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def next_delay(self, attempt: int, time_left: float | None = None) -> float | None:
+        """Backoff before retry number ``attempt`` (from 0), or ``None`` to give up."""
+        if attempt >= self.max_attempts:
+            return None
+        delay = self._rng.uniform(0, min(self.max_delay_s, self.base_delay_s * 2**attempt))
+        if time_left is not None and delay >= time_left:
+            UPSTREAM_RETRIES.labels(outcome="no_time").inc()
+            return None
+        if self._tokens < 1.0:
+            UPSTREAM_RETRIES.labels(outcome="no_budget").inc()
+            return None
+        self._tokens -= 1.0
+        UPSTREAM_RETRIES.labels(outcome="retried").inc()
+        return delay
+
+
+class BreakerAdapter(ModelAdapter):
+    """Puts a circuit breaker in front of a whole model adapter.
+
+    Quota refusals (``AdapterOverloaded``) and timeouts once the request's own
+    deadline has run out say nothing about the upstream's health and are not
+    counted as failures.
+    """
+
+    def __init__(self, inner: ModelAdapter, breaker: CircuitBreaker):
+        self.inner = inner
+        self.name = inner.name
+        self.prefetch_first_delta = inner.prefetch_first_delta
+        self.breaker = breaker
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        self._enter()
+        try:
+            result = await self.inner.correct(text, lang, request_id)
+        except (asyncio.CancelledError, AdapterOverloaded):
+            self.breaker.abandoned()
+            raise
+        except Exception as err:
+            self._report(err)
+            raise
+        self.breaker.succeeded()
+        return result
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        self._enter()
+        try:
+            async for delta in self.inner.correct_stream(text, lang, request_id):
+                yield delta
+        except (GeneratorExit, asyncio.CancelledError, AdapterOverloaded):
+            self.breaker.abandoned()
+            raise
+        except Exception as err:
+            self._report(err)
+            raise
+        self.breaker.succeeded()
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return {self.breaker.name: self.breaker.snapshot(), **self.inner.circuit_breakers()}
+
+    def cache_ttl_ms(self, backend: str) -> int | None:
+        return self.inner.cache_ttl_ms(backend)
+
+    def _report(self, err: Exception) -> None:
+        if isinstance(err, TimeoutError) and deadlines.remaining() == 0:
+            self.breaker.abandoned()
+        else:
+            self.breaker.failed()
+
+    def _enter(self) -> None:
+        if not self.breaker.allow():
+            raise AdapterUnavailable(
+                f"{self.name} is unavailable. Please try again later.",
+                retry_after=self.breaker.retry_after(),
+            )
@@ -1,7 +1,68 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
 import time
+import weakref
+import zlib
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from .metrics import CACHE_BYTES, CACHE_ENTRIES, CACHE_EVICTIONS
+from .settings import Settings
+
+# Rough per-entry bookkeeping cost (slotted entry, dict slot, key and bytes headers).
+ENTRY_OVERHEAD_BYTES = 200
 
 
 class CacheEntry:
+    """Compact cache record.
+
+    The value is kept pre-encoded as a UTF-8 JSON string literal so a cache hit can
+    be spliced into the response body without re-serializing, and payloads of at
+    least ``compress_min_bytes`` are stored zlib-compressed.
+    """
+
+    __slots__ = ("_payload", "_compressed", "backend", "expires_at", "size")
+
+    def __init__(
+        self,
+        value,
+        backend: str,
+        expires_at: float,
+        size: int = 0,
+        compress_min_bytes: int = 0,
+    ):
+        payload = encode_value(value)
+        compressed = False
+        if compress_min_bytes and len(payload) >= compress_min_bytes:
+            packed = zlib.compress(payload, 6)
+            if len(packed) < len(payload):
+                payload, compressed = packed, True
+        self._payload = payload
+        self._compressed = compressed
+        self.backend = backend
+        self.expires_at = expires_at
+        self.size = size
+
+    @property
+    def payload_bytes(self) -> int:
+        return len(self._payload)
+
+    @property
+    def json_value(self) -> bytes:
+        if self._compressed:
+            return zlib.decompress(self._payload)
+        return self._payload
+
+    @property
+    def value(self) -> str:
+        return json.loads(self.json_value)
+
+
+class PlainCacheEntry:
     def __init__(self, value, backend: str, expires_at: float):
         self.value = value
         self.backend = backend
@@ -9,11 +70,13 @@ class CacheEntry:
 
 
 class SimpleCache:
+    """Unbounded reference cache; kept as the baseline for cache benchmarks."""
+
     def __init__(self, ttl_ms: int):
-        self.store: dict[str, CacheEntry] = {}
+        self.store: dict[str, PlainCacheEntry] = {}
         self.ttl_ms = ttl_ms
 
-    def get(self, key: str) -> CacheEntry | None:
+    def get(self, key: str) -> PlainCacheEntry | None:
         entry = self.store.get(key)
         if not entry:
             return None
@@ -22,5 +85,406 @@ class SimpleCache:
             return None
         return entry
 
-    def set(self, key: str, value, backend: str):
-        self.store[key] = CacheEntry(value, backend, time.time() * 1000 + self.ttl_ms)
+    def set(self, key: str, value, backend: str, ttl_ms: int | None = None):
+        expires_at = time.time() * 1000 + (self.ttl_ms if ttl_ms is None else ttl_ms)
+        self.store[key] = PlainCacheEntry(value, backend, expires_at)
+
+
+class FrequencySketch:
+    """Count-min sketch of recent key popularity used as a TinyLFU admission filter.
+
+    Counters saturate at 15 and are halved every ``sample_size`` increments so that
+    keys which were popular a long time ago gradually lose their advantage.
+    """
+
+    depth = 4
+    max_count = 15
+
+    def __init__(self, width: int = 4096, sample_size: int | None = None):
+        size = 1
+        while size < max(16, width):
+            size <<= 1
+        self._mask = size - 1
+        self._rows = [bytearray(size) for _ in range(self.depth)]
+        self._sample_size = sample_size or size * 10
+        self._additions = 0
+
+    def _indexes(self, key: str):
+        for seed in range(self.depth):
+            yield hash((seed, key)) & self._mask
+
+    def increment(self, key: str) -> None:
+        for row, index in zip(self._rows, self._indexes(key), strict=True):
+            if row[index] < self.max_count:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._age()
+
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key), strict=True))
+
+    def _age(self) -> None:
+        self._additions //= 2
+        for row in self._rows:
+            for index, count in enumerate(row):
+                if count:
+                    row[index] = count >> 1
+
+
+class BoundedCache:
+    """TTL cache with a hard byte budget, LRU eviction and TinyLFU admission.
+
+    Exposes the same ``get``/``set`` interface as ``SimpleCache``. When the budget is
+    exceeded, the least recently used entry is evicted only if the incoming key has
+    been requested at least as often; otherwise the new value is not admitted, so a
+    stream of one-off texts cannot flush popular corrections out of the cache.
+    """
+
+    def __init__(
+        self,
+        ttl_ms: int,
+        max_bytes: int,
+        sketch_width: int = 4096,
+        compress_min_bytes: int = 0,
+    ):
+        self.ttl_ms = ttl_ms
+        self.max_bytes = max_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self.used_bytes = 0
+        self.store: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._sketch = FrequencySketch(sketch_width)
+        self._lock = threading.Lock()
+        self._sweeper: threading.Thread | None = None
+        self._snapshotter: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            self._sketch.increment(key)
+            entry = self.store.get(key)
+            if entry is None:
+                return None
+            if time.time() * 1000 > entry.expires_at:
+                self._remove(key, "expired")
+                return None
+            self.store.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value, backend: str, ttl_ms: int | None = None):
+        """Store ``value``; ``ttl_ms`` overrides the cache's TTL for this entry."""
+        now_ms = time.time() * 1000
+        entry = self._entry(
+            key, value, backend, now_ms + (self.ttl_ms if ttl_ms is None else ttl_ms)
+        )
+        if entry.size > self.max_bytes:
+            CACHE_EVICTIONS.labels(reason="rejected").inc()
+            return
+        with self._lock:
+            # A key being replaced was already admitted: make room without asking
+            # again, or a rejection would turn the update into a delete.
+            replacing = key in self.store
+            if replacing:
+                self._remove(key, None)
+            if not self._make_room(key, entry.size, now_ms, admit=not replacing):
+                CACHE_EVICTIONS.labels(reason="rejected").inc()
+                return
+            self.store[key] = entry
+            self.used_bytes += entry.size
+            self._publish()
+
+    def sweep(self) -> int:
+        """Drop every expired entry and return how many were removed."""
+        now_ms = time.time() * 1000
+        with self._lock:
+            expired = [key for key, entry in self.store.items() if now_ms > entry.expires_at]
+            for key in expired:
+                self._remove(key, "expired")
+            self._publish()
+        return len(expired)
+
+    def start_sweeper(self, interval_s: float) -> None:
+        if self._sweeper is None:
+            self._sweeper = start_periodic(self, BoundedCache.sweep, interval_s, self._stop)
+
+    def start_snapshots(self, path: str, interval_s: float) -> None:
+        if self._snapshotter is None:
+            self._snapshotter = start_periodic(
+                self, lambda cache: cache.save_snapshot(path), interval_s, self._stop
+            )
+
+    def save_snapshot(self, path: str) -> int:
+        """Atomically write live entries to ``path`` (JSON lines, LRU order first).
+
+        Only references are taken under the lock; entries are never changed once
+        stored, so they are decompressed and serialized after it is released.
+        """
+        now_ms = time.time() * 1000
+        with self._lock:
+            live = [(key, entry) for key, entry in self.store.items() if now_ms <= entry.expires_at]
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            for key, entry in live:
+                record = {
+                    "key": key,
+                    "value": entry.value,
+                    "backend": entry.backend,
+                    "expires_at": entry.expires_at,
+                }
+                handle.write(json.dumps(record, ensure_ascii=False))
+                handle.write("\n")
+        os.replace(tmp_path, path)
+        return len(live)
+
+    def load_snapshot(self, path: str) -> int:
+        """Restore unexpired entries written by ``save_snapshot``; returns how many were loaded."""
+        if not os.path.exists(path):
+            return 0
+        now_ms = time.time() * 1000
+        loaded = 0
+        with open(path, encoding="utf-8") as handle, self._lock:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                    key = record["key"]
+                    value = record["value"]
+                    backend = record["backend"]
+                    expires_at = float(record["expires_at"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if now_ms > expires_at:
+                    continue
+                entry = self._entry(key, value, backend, expires_at)
+                if self.used_bytes + entry.size > self.max_bytes:
+                    continue
+                if key in self.store:
+                    self._remove(key, None)
+                self.store[key] = entry
+                self.used_bytes += entry.size
+                loaded += 1
+            self._publish()
+        return loaded
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _entry(self, key: str, value, backend: str, expires_at: float) -> CacheEntry:
+        entry = CacheEntry(value, backend, expires_at, compress_min_bytes=self.compress_min_bytes)
+        entry.size = len(key) + entry.payload_bytes + len(backend) + ENTRY_OVERHEAD_BYTES
+        return entry
+
+    def _make_room(self, key: str, size: int, now_ms: float, admit: bool = True) -> bool:
+        if self.used_bytes + size <= self.max_bytes:
+            return True
+        candidate_freq = self._sketch.estimate(key)
+        victims: list[str] = []
+        freed = 0
+        for victim_key, victim in self.store.items():
+            if self.used_bytes - freed + size <= self.max_bytes:
+                break
+            if (
+                admit
+                and now_ms <= victim.expires_at
+                and self._sketch.estimate(victim_key) > candidate_freq
+            ):
+                return False
+            victims.append(victim_key)
+            freed += victim.size
+        for victim_key in victims:
+            victim = self.store[victim_key]
+            self._remove(victim_key, "expired" if now_ms > victim.expires_at else "size")
+        return True
+
+    def _remove(self, key: str, reason: str | None) -> None:
+        entry = self.store.pop(key, None)
+        if entry is None:
+            return
+        self.used_bytes -= entry.size
+        if reason:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+
+    def _publish(self) -> None:
+        CACHE_BYTES.set(self.used_bytes)
+        CACHE_ENTRIES.set(len(self.store))
+
+
+class SqliteCache:
+    """Result cache stored in a SQLite database in WAL mode.
+
+    Every gunicorn worker on the host opens the same file, so a correction cached
+    by one worker is a hit in all of them. Exposes the same ``get``/``set``
+    interface as ``SimpleCache``; the byte budget is enforced by evicting the
+    least recently read rows.
+    """
+
+    def __init__(self, path: str, ttl_ms: int, max_bytes: int):
+        self.path = path
+        self.ttl_ms = ttl_ms
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(
+            path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._sweeper: threading.Thread | None = None
+        self._stop = threading.Event()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return int(row[0])
+
+    @property
+    def used_bytes(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT used_bytes FROM cache_meta WHERE id = 0").fetchone()
+        return int(row[0])
+
+    def get(self, key: str) -> CacheEntry | None:
+        now_ms = time.time() * 1000
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, backend, expires_at, size FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, backend, expires_at, size = row
+            if now_ms > expires_at:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                CACHE_EVICTIONS.labels(reason="expired").inc()
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now_ms, key))
+        return CacheEntry(value, backend, expires_at, size)
+
+    def set(self, key: str, value, backend: str, ttl_ms: int | None = None):
+        size = entry_size(key, value, backend)
+        if size > self.max_bytes:
+            CACHE_EVICTIONS.labels(reason="rejected").inc()
+            return
+        now_ms = time.time() * 1000
+        expires_at = now_ms + (self.ttl_ms if ttl_ms is None else ttl_ms)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.execute(
+                    "INSERT INTO cache (key, value, backend, expires_at, accessed_at, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, str(value), backend, expires_at, now_ms, size),
+                )
+                self._trim(now_ms)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def sweep(self) -> int:
+        now_ms = time.time() * 1000
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now_ms,))
+        if removed.rowcount > 0:
+            CACHE_EVICTIONS.labels(reason="expired").inc(removed.rowcount)
+        return max(removed.rowcount, 0)
+
+    def start_sweeper(self, interval_s: float) -> None:
+        if self._sweeper is None:
+            self._sweeper = start_periodic(self, SqliteCache.sweep, interval_s, self._stop)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+    def _trim(self, now_ms: float) -> None:
+        row = self._conn.execute("SELECT used_bytes FROM cache_meta WHERE id = 0").fetchone()
+        overflow = int(row[0]) - self.max_bytes
+        if overflow <= 0:
+            return
+        expired = self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now_ms,))
+        if expired.rowcount > 0:
+            CACHE_EVICTIONS.labels(reason="expired").inc(expired.rowcount)
+        while True:
+            row = self._conn.execute("SELECT used_bytes FROM cache_meta WHERE id = 0").fetchone()
+            if int(row[0]) <= self.max_bytes:
+                return
+            evicted = self._conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed_at LIMIT 16)"
+            )
+            if evicted.rowcount <= 0:
+                return
+            CACHE_EVICTIONS.labels(reason="size").inc(evicted.rowcount)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at);
+CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY, used_bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO cache_meta (id, used_bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_meta SET used_bytes = used_bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_meta SET used_bytes = used_bytes - OLD.size WHERE id = 0;
+END;
+"""
+
+
+def build_cache(settings: Settings) -> BoundedCache | SqliteCache:
+    backend = settings.cache_backend.strip().lower()
+    if backend == "sqlite":
+        return SqliteCache(settings.cache_path, settings.cache_ttl_ms, settings.cache_max_bytes)
+    return BoundedCache(
+        settings.cache_ttl_ms,
+        settings.cache_max_bytes,
+        compress_min_bytes=settings.cache_compress_min_bytes,
+    )
+
+
+def start_periodic(
+    cache, action: Callable[[Any], object], interval_s: float, stop: threading.Event
+) -> threading.Thread | None:
+    """Call ``action(cache)`` every ``interval_s`` until ``stop`` is set.
+
+    The thread only holds a weak reference, so a discarded cache is not kept alive.
+    """
+    if interval_s <= 0:
+        return None
+    cache_ref = weakref.ref(cache)
+
+    def run():
+        while not stop.wait(interval_s):
+            target = cache_ref()
+            if target is None:
+                return
+            try:
+                action(target)
+            except Exception:  # noqa: BLE001
+                logging.getLogger("backend").exception("Periodic cache task failed")
+            del target
+
+    thread = threading.Thread(target=run, name="cache-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+def encode_value(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def entry_size(key: str, value, backend: str) -> int:
+    """Bytes charged against the budget for an uncompressed entry."""
+    return len(key) + len(encode_value(value)) + len(backend) + ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,39 @@
+import contextlib
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
+
+_EXPIRES_AT: ContextVar[float | None] = ContextVar("deadline_expires_at", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the upstream model answered."""
+
+
+class UpstreamStalled(TimeoutError):
+    """A stream produced no output for longer than the stall timeout."""
+
+
+@contextlib.contextmanager
+def bind(seconds: float) -> Iterator[float]:
+    """Give the current context (and tasks started from it) ``seconds`` to finish.
+
+    Yields the absolute ``time.monotonic()`` expiry. A tighter enclosing deadline wins.
+    """
+    expires_at = time.monotonic() + seconds
+    current = _EXPIRES_AT.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _EXPIRES_AT.set(expires_at)
+    try:
+        yield expires_at
+    finally:
+        _EXPIRES_AT.reset(token)
+
+
+def remaining() -> float | None:
+    """Seconds left before the current deadline, or ``None`` without one."""
+    expires_at = _EXPIRES_AT.get()
+    if expires_at is None:
+        return None
+    return max(0.0, expires_at - time.monotonic())
@@ -0,0 +1,88 @@
+import json
+import re
+from typing import NamedTuple
+
+# A JSON answer may come wrapped in a Markdown code fence despite the instructions.
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+# How far from its stated offset an edit may be moved when ``original`` is not there.
+RELOCATE_WINDOW = 32
+
+
+class Edit(NamedTuple):
+    """Replace ``original``, found at character offset ``start``, with ``replacement``."""
+
+    start: int
+    original: str
+    replacement: str
+
+
+def parse_edits(output: str) -> list[Edit] | None:
+    """Read ``{"edits": [{"start", "original", "replacement"}, ...]}``.
+
+    Returns ``None`` if the output is not exactly that shape. ``original`` must not
+    be empty, so every edit can be checked against the text it claims to change.
+    """
+    fenced = _CODE_FENCE.match(output.strip())
+    try:
+        data = json.loads(fenced.group(1) if fenced else output)
+    except ValueError:
+        return None
+    items = data.get("edits") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return None
+    edits: list[Edit] = []
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        start, original, replacement = (
+            item.get("start"),
+            item.get("original"),
+            item.get("replacement"),
+        )
+        if type(start) is not int or start < 0:
+            return None
+        if not isinstance(original, str) or not original or not isinstance(replacement, str):
+            return None
+        edits.append(Edit(start, original, replacement))
+    return edits
+
+
+def apply_edits(text: str, edits: list[Edit]) -> str | None:
+    """Apply ``edits`` to ``text``, or return ``None`` if they do not fit it.
+
+    Models miscount offsets, so an edit whose ``original`` is not at ``start`` is
+    moved to where it does occur, but only if that place is unambiguous: the only
+    occurrence in the text, or the only one within ``RELOCATE_WINDOW`` characters
+    of ``start``. Edits that cannot be placed, or overlap once placed, make the
+    whole list invalid.
+    """
+    placed: list[tuple[int, int, str]] = []
+    for edit in edits:
+        start = _locate(text, edit.original, edit.start)
+        if start is None:
+            return None
+        placed.append((start, start + len(edit.original), edit.replacement))
+    placed.sort()
+    pieces: list[str] = []
+    cursor = 0
+    for start, end, replacement in placed:
+        if start < cursor:
+            return None
+        pieces.append(text[cursor:start])
+        pieces.append(replacement)
+        cursor = end
+    pieces.append(text[cursor:])
+    return "".join(pieces)
+
+
+def _locate(text: str, original: str, hint: int) -> int | None:
+    if text.startswith(original, hint):
+        return hint
+    found: list[int] = []
+    index = text.find(original)
+    while index != -1:
+        found.append(index)
+        index = text.find(original, index + 1)
+    if len(found) > 1:
+        found = [index for index in found if abs(index - hint) <= RELOCATE_WINDOW]
+    return found[0] if len(found) == 1 else None
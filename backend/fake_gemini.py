@@ -0,0 +1,208 @@
+"""Local stand-in for the Gemini API, for load and failure tests without real quota.
+
+Speaks enough of ``GenerativeService`` (``GenerateContent`` and
+``StreamGenerateContent`` over plaintext gRPC) for the real ``GeminiAdapter`` to
+talk to it with ``GEMINI_ENDPOINT=127.0.0.1:<port>``. Every model "corrects" a text
+by echoing it back, so batch framing and chunk extraction are exercised too.
+
+    python -m backend.fake_gemini --port 50051 --rpm 60 --latency-ms 300
+
+Any API key is accepted; quotas are counted per key.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import Counter, deque
+from collections.abc import AsyncGenerator, Callable
+from dataclasses import dataclass
+
+import google.ai.generativelanguage as glm
+import grpc
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+# Rough output size of one token, used to pace the simulated generation.
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class FakeGeminiConfig:
+    # Requests per minute per API key before RESOURCE_EXHAUSTED (0 = unlimited).
+    # Benchmarks can shrink the "minute" with ``window_s``.
+    rpm: int = 0
+    window_s: float = 60.0
+    # Time to first token: log-normal with this median and spread (sigma).
+    latency_ms: float = 200.0
+    latency_sigma: float = 0.0
+    # Output speed after the first token (0 = all at once).
+    tokens_per_s: float = 0.0
+    # Characters per streamed chunk.
+    chunk_chars: int = 40
+    # Share of calls answered with no text, failed with UNAVAILABLE before any
+    # output, or (streams only) failed with UNAVAILABLE after the first chunk.
+    empty_rate: float = 0.0
+    unavailable_rate: float = 0.0
+    stream_failure_rate: float = 0.0
+    seed: int | None = None
+
+
+class FakeGemini:
+    """Request handlers and per-key quota state of the fake server.
+
+    ``stats`` counts calls by outcome (``ok``, ``rate_limited``, ``unavailable``,
+    ``empty``, ``stream_failed``) for benchmarks to compare with what clients saw.
+    """
+
+    def __init__(
+        self, config: FakeGeminiConfig | None = None, clock: Callable[[], float] = time.monotonic
+    ):
+        self.config = config or FakeGeminiConfig()
+        self.stats: Counter[str] = Counter()
+        self._sent: dict[str, deque[float]] = {}
+        self._rng = random.Random(self.config.seed)
+        self._clock = clock
+
+    async def generate_content(
+        self, request: glm.GenerateContentRequest, context: grpc.aio.ServicerContext
+    ) -> glm.GenerateContentResponse:
+        text = await self._start(request, context)
+        if text is None:
+            return glm.GenerateContentResponse()
+        await asyncio.sleep(self._generation_time(text))
+        self.stats["ok"] += 1
+        return _response(text, final=True)
+
+    async def stream_generate_content(
+        self, request: glm.GenerateContentRequest, context: grpc.aio.ServicerContext
+    ) -> AsyncGenerator[glm.GenerateContentResponse, None]:
+        text = await self._start(request, context)
+        if text is None:
+            yield glm.GenerateContentResponse()
+            return
+        fail = self._rng.random() < self.config.stream_failure_rate
+        size = max(1, self.config.chunk_chars)
+        chunks = [text[start : start + size] for start in range(0, len(text), size)]
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(self._generation_time(chunk))
+            yield _response(chunk, final=index == len(chunks) - 1)
+            if fail and index < len(chunks) - 1:
+                self.stats["stream_failed"] += 1
+                await context.abort(grpc.StatusCode.UNAVAILABLE, "The stream broke off.")
+        self.stats["ok"] += 1
+
+    async def _start(
+        self, request: glm.GenerateContentRequest, context: grpc.aio.ServicerContext
+    ) -> str | None:
+        """Check quota, wait out the time to first token and pick the answer.
+
+        Returns ``None`` when the call should get an empty response.
+        """
+        key = dict(context.invocation_metadata() or ()).get("x-goog-api-key")
+        if not key:
+            await context.abort(grpc.StatusCode.UNAUTHENTICATED, "API key not valid.")
+        retry_in = self._admit(str(key))
+        if retry_in is not None:
+            self.stats["rate_limited"] += 1
+            await context.abort(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                f"Quota exceeded for requests per minute. Please retry in {retry_in:.3f}s.",
+            )
+        await asyncio.sleep(self._first_token_delay())
+        if self._rng.random() < self.config.unavailable_rate:
+            self.stats["unavailable"] += 1
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "The model is overloaded.")
+        if self._rng.random() < self.config.empty_rate:
+            self.stats["empty"] += 1
+            return None
+        return _user_text(request)
+
+    def _admit(self, key: str) -> float | None:
+        """Count a request against ``key``; seconds until it may retry if over quota."""
+        if self.config.rpm <= 0:
+            return None
+        now = self._clock()
+        sent = self._sent.setdefault(key, deque())
+        while sent and sent[0] <= now - self.config.window_s:
+            sent.popleft()
+        if len(sent) >= self.config.rpm:
+            return sent[0] + self.config.window_s - now
+        sent.append(now)
+        return None
+
+    def _first_token_delay(self) -> float:
+        median = self.config.latency_ms / 1000
+        if median <= 0:
+            return 0.0
+        if self.config.latency_sigma <= 0:
+            return median
+        return self._rng.lognormvariate(math.log(median), self.config.latency_sigma)
+
+    def _generation_time(self, text: str) -> float:
+        if self.config.tokens_per_s <= 0:
+            return 0.0
+        return len(text) / CHARS_PER_TOKEN / self.config.tokens_per_s
+
+
+def _user_text(request: glm.GenerateContentRequest) -> str:
+    for content in reversed(request.contents):
+        if content.role in ("", "user"):
+            return "".join(part.text for part in content.parts)
+    return ""
+
+
+def _response(text: str, final: bool) -> glm.GenerateContentResponse:
+    candidate = glm.Candidate(
+        index=0,
+        content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+        finish_reason=glm.Candidate.FinishReason.STOP if final else None,
+    )
+    return glm.GenerateContentResponse(candidates=[candidate])
+
+
+async def serve(
+    fake: FakeGemini, host: str = "127.0.0.1", port: int = 0
+) -> tuple[grpc.aio.Server, int]:
+    """Start a plaintext gRPC server for ``fake``; returns it and the bound port."""
+    handlers = {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            fake.generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            fake.stream_generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+    }
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(SERVICE, handlers)])
+    bound = server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    return server, bound
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    defaults = FakeGeminiConfig()
+    for name, value in vars(defaults).items():
+        kind = int if name in ("rpm", "chunk_chars", "seed") else float
+        parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=value)
+    args = vars(parser.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+
+    async def run() -> None:
+        server, bound = await serve(FakeGemini(FakeGeminiConfig(**args)), host, port)
+        print(f"Fake Gemini listening on {host}:{bound}", flush=True)
+        await server.wait_for_termination()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
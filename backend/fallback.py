@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+from collections.abc import AsyncGenerator, Iterator
+from typing import Any
+
+from . import deadlines
+from .metrics import FALLBACKS
+from .models import (
+    AdapterOverloaded,
+    AdapterUnavailable,
+    Correction,
+    ModelAdapter,
+    backend_of,
+)
+
+# Errors after which a request moves on to the next backend.
+FAILOVER_ERRORS = (AdapterOverloaded, AdapterUnavailable, TimeoutError)
+
+
+def failover_reason(err: BaseException) -> str:
+    if isinstance(err, AdapterOverloaded):
+        return "overloaded"
+    if isinstance(err, AdapterUnavailable):
+        return "unavailable"
+    return "deadline"
+
+
+class FallbackAdapter(ModelAdapter):
+    """Try backends in order and serve each request from the first that can take it.
+
+    A request moves on when a backend is out of quota (``AdapterOverloaded``), its
+    circuit breaker is open (``AdapterUnavailable``), or it would eat into the last
+    ``reserve_s`` of the request deadline that the next backend needs. Streams only
+    move on before their first delta. Results are ``Correction`` values naming the
+    backend that produced them; anything but the first backend is cached for
+    ``fallback_ttl_ms`` only, so the primary takes over again soon after it recovers.
+    """
+
+    prefetch_first_delta = True
+
+    def __init__(self, adapters: list[ModelAdapter], fallback_ttl_ms: int, reserve_s: float):
+        if not adapters:
+            raise ValueError("FallbackAdapter needs at least one adapter")
+        self.adapters = adapters
+        self.name = ",".join(adapter.name for adapter in adapters)
+        self.fallback_ttl_ms = fallback_ttl_ms
+        self.reserve_s = reserve_s
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        for adapter, budget, last in self._tiers():
+            if budget is not None and budget <= 0:
+                FALLBACKS.labels(backend=adapter.name, reason="deadline").inc()
+                continue
+            try:
+                with contextlib.ExitStack() as stack:
+                    if budget is not None:
+                        stack.enter_context(deadlines.bind(budget))
+                    async with asyncio.timeout(budget):
+                        result = await adapter.correct(text, lang, request_id)
+            except FAILOVER_ERRORS as err:
+                if last or deadlines.remaining() == 0:
+                    raise
+                FALLBACKS.labels(backend=adapter.name, reason=failover_reason(err)).inc()
+                continue
+            return Correction(result, backend_of(result, adapter.name))
+        raise AssertionError("unreachable: the last adapter always runs")
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        for adapter, budget, last in self._tiers():
+            if budget is not None and budget <= 0:
+                FALLBACKS.labels(backend=adapter.name, reason="deadline").inc()
+                continue
+            stream = adapter.correct_stream(text, lang, request_id)
+            async with contextlib.aclosing(stream):
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), budget)
+                except StopAsyncIteration:
+                    return
+                except FAILOVER_ERRORS as err:
+                    if last or deadlines.remaining() == 0:
+                        raise
+                    FALLBACKS.labels(backend=adapter.name, reason=failover_reason(err)).inc()
+                    continue
+                yield Correction(first, backend_of(first, adapter.name))
+                async for delta in stream:
+                    yield Correction(delta, backend_of(delta, adapter.name))
+            return
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        breakers: dict[str, dict[str, Any]] = {}
+        for adapter in self.adapters:
+            breakers.update(adapter.circuit_breakers())
+        return breakers
+
+    def cache_ttl_ms(self, backend: str) -> int | None:
+        if backend == self.adapters[0].name:
+            return self.adapters[0].cache_ttl_ms(backend)
+        return self.fallback_ttl_ms
+
+    def _tiers(self) -> Iterator[tuple[ModelAdapter, float | None, bool]]:
+        """Yield ``(adapter, time budget or None, is last)``; read lazily per tier."""
+        for index, adapter in enumerate(self.adapters):
+            last = index == len(self.adapters) - 1
+            remaining = deadlines.remaining()
+            if last or remaining is None:
+                yield adapter, None, last
+            else:
+                yield adapter, remaining - self.reserve_s, last
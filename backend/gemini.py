@@ -1,224 +1,841 @@
 import asyncio
-import threading
-from collections.abc import AsyncGenerator, Awaitable, Callable
-
+import contextlib
+import math
+import re
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable, Collection
+from typing import Any, NamedTuple
+
+import google.ai.generativelanguage as glm
 import google.generativeai as genai
+import grpc
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcAsyncIOTransport,
+)
 from google.api_core import exceptions as google_exceptions
+from google.api_core import gapic_v1
+from google.api_core.client_options import ClientOptions
+from google.generativeai.types.generation_types import AsyncGenerateContentResponse
+
+from . import deadlines
+from .adaptive import AdaptiveLimiter, Call
+from .batching import MicroBatcher
+from .breaker import OPEN, CircuitBreaker, RetryBudget
+from .deadlines import DeadlineExceeded
+from .edits import apply_edits, parse_edits
+from .hedging import HedgePolicy
+from .metrics import (
+    BATCH_SPLIT_FAILURES,
+    EDIT_MODE_OUTCOMES,
+    GEMINI_KEY_COOLDOWNS,
+    GEMINI_KEY_IN_FLIGHT,
+    HEDGES_FIRED,
+    HEDGES_SKIPPED,
+    HEDGES_WON,
+    UPSTREAM_CHUNKS_AVOIDED,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_STREAMS_CANCELLED,
+)
+from .models import AdapterOverloaded, AdapterUnavailable, ModelAdapter
+
+USER_AGENT = f"tatar-gec genai-py/{genai.__version__}"
+ALL_KEYS_EXHAUSTED = "Gemini quota is exhausted for all keys. Please try again later."
+ALL_KEYS_FAILING = "Gemini is failing for all keys. Please try again later."
+RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+# Errors worth retrying after a backoff; they also count against a key's breaker.
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    DeadlineExceeded,
+)
+_RETRY_IN = re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+# System instructions by PROMPT_VERSION. They are sent byte-for-byte the same on every
+# call, ahead of the user text, so that requests share a prefix that Gemini's implicit
+# caching can reuse. Change the wording only under a new version.
+SYSTEM_INSTRUCTIONS = {
+    "v1": (
+        "You are a grammar and spelling correction assistant for Tatar text.\n"
+        "Return only the corrected text. Do not add explanations or extra formatting.\n"
+        "Preserve punctuation, line breaks, and the original meaning.\n"
+        "Preserve the original casing unless a correction requires changing it."
+    ),
+}
+BATCH_INSTRUCTION = (
+    'The message holds several separate texts, each inside <text id="N"> and </text>.\n'
+    "Correct each text on its own. Return every text inside the same tags with the same\n"
+    "id, in the same order, and nothing outside the tags."
+)
+EDIT_INSTRUCTION = (
+    "Instead of the corrected text, return only a JSON object listing the edits, like\n"
+    '{"edits": [{"start": 12, "original": "...", "replacement": "..."}]}\n'
+    "start is the 0-based character offset of original in the message. original is the\n"
+    "exact text being replaced and is never empty: to insert or delete, include a\n"
+    'neighbouring word. Return {"edits": []} if the text needs no changes.'
+)
+# One text of a micro-batch prompt; the model is asked to answer in the same frame.
+_BATCH_ITEM = re.compile(r'<text id="(\d+)">\n?(.*?)\n?</text>', re.DOTALL)
+# Input size that a non-streaming call's latency is scaled to before it is compared.
+LATENCY_UNIT_CHARS = 500
+# Typical size of one streamed Gemini chunk, used before any chunk has arrived.
+DEFAULT_CHUNK_CHARS = 64
+
+
+class GeminiKeyExhausted(AdapterOverloaded):
+    pass
 
-from .models import ModelAdapter
 
+class Prompt(NamedTuple):
+    system: str
+    text: str
+    # Ask for a JSON response (edit-list mode).
+    json: bool = False
 
-class GeminiKeyExhausted(Exception):
-    pass
+
+class _KeySlot:
+    """Scheduling state for one API key."""
+
+    __slots__ = (
+        "index",
+        "key",
+        "in_flight",
+        "sent",
+        "cooldown_until",
+        "probation",
+        "strikes",
+        "breaker",
+    )
+
+    def __init__(self, index: int, key: str, breaker: CircuitBreaker | None = None):
+        self.index = index
+        self.key = key
+        self.in_flight = 0
+        self.sent: deque[float] = deque()
+        self.cooldown_until = 0.0
+        self.probation = False
+        self.strikes = 0
+        self.breaker = breaker
 
 
 class GeminiKeyPool:
-    def __init__(self, keys: list[str]):
-        self._keys = [key.strip() for key in keys if key.strip()]
-        self._exhausted: set[int] = set()
-        self._current_index: int | None = None
-        self._lock = asyncio.Lock()
+    """Schedules upstream calls across API keys by load, within per-key limits.
+
+    Each call goes to the available key with the fewest calls in flight. A key is
+    available while it is under ``concurrency`` calls in flight and ``rpm`` calls per
+    ``window_s``, and is not cooling down (0 disables a limit). A key that gets a 429
+    cools down for the delay the server asked for, or ``cooldown_s`` doubling on
+    repeated 429s, then takes a single probe call before it gets normal traffic again.
+    Each key also has a circuit breaker (unless ``failure_threshold`` is 0) that
+    takes it out of rotation after repeated transient errors such as 503s.
+    When keys are merely busy, callers wait up to ``max_wait_s`` for one to free up.
+    """
+
+    def __init__(
+        self,
+        keys: list[str],
+        rpm: int = 0,
+        concurrency: int = 0,
+        cooldown_s: float = 60.0,
+        max_wait_s: float = 5.0,
+        window_s: float = 60.0,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        unique = dict.fromkeys(key.strip() for key in keys if key.strip())
+        self._slots = [
+            _KeySlot(
+                index,
+                key,
+                CircuitBreaker(
+                    f"gemini_key_{index}", failure_threshold, reset_timeout_s, clock=clock
+                )
+                if failure_threshold > 0
+                else None,
+            )
+            for index, key in enumerate(unique)
+        ]
+        self._by_key = {slot.key: slot for slot in self._slots}
+        self.rpm = rpm
+        self.concurrency = concurrency
+        self.cooldown_s = cooldown_s
+        self.max_wait_s = max_wait_s
+        self.window_s = window_s
+        self._clock = clock
+        self._changed = asyncio.Event()
 
     def has_keys(self) -> bool:
-        return bool(self._keys)
+        return bool(self._slots)
 
     def key_count(self) -> int:
-        return len(self._keys)
-
-    async def pick_key(self) -> str:
-        async with self._lock:
-            if not self._keys:
-                raise GeminiKeyExhausted("No Gemini API keys configured.")
-
-            index: int | None = self._current_index if self._current_index is not None else 0
-            if index in self._exhausted:
-                index = self._next_available_index(start=index + 1)
-
-            if index is None:
-                self._exhausted.clear()
-                self._current_index = 0
-                raise GeminiKeyExhausted(
-                    "Gemini quota is exhausted for all keys. Please try again later."
-                )
+        return len(self._slots)
 
-            self._current_index = index
-            return self._keys[index]
+    async def acquire(self, avoid: Collection[str] = ()) -> str:
+        """Reserve the least-loaded available key, waiting briefly if all are busy.
 
-    async def mark_exhausted(self, key: str) -> bool:
-        async with self._lock:
-            try:
-                index = self._keys.index(key)
-            except ValueError:
-                return False
-            self._exhausted.add(index)
-            if len(self._exhausted) >= len(self._keys):
-                self._exhausted.clear()
-                self._current_index = 0
-                return True
-            if self._current_index == index:
-                self._current_index = self._next_available_index(start=index + 1)
+        Keys in ``avoid`` are taken only when no other key is available.
+        """
+        if not self._slots:
+            raise GeminiKeyExhausted("No Gemini API keys configured.")
+        budget = deadlines.remaining()
+        deadline = self._clock() + min(self.max_wait_s, math.inf if budget is None else budget)
+        while True:
+            now = self._clock()
+            slot = self._pick(now, avoid)
+            if slot is None and avoid:
+                slot = self._pick(now)
+            if slot is not None:
+                return self._reserve(slot, now)
+            if all(self._resting(slot, now) for slot in self._slots):
+                if all(slot.cooldown_until > now for slot in self._slots):
+                    raise GeminiKeyExhausted(ALL_KEYS_EXHAUSTED)
+                raise AdapterUnavailable(ALL_KEYS_FAILING, self._next_opening(now) - now)
+            if now >= deadline:
+                raise GeminiKeyExhausted("All Gemini keys are busy. Please try again later.")
+            changed = self._changed
+            wait = min(deadline, self._next_opening(now)) - now
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(changed.wait(), max(wait, 0.001))
+
+    def try_acquire(self, exclude: Collection[str] = ()) -> str | None:
+        """Reserve an available key other than ``exclude`` without waiting."""
+        now = self._clock()
+        slot = self._pick(now, exclude)
+        return self._reserve(slot, now) if slot is not None else None
+
+    def release(self, key: str) -> None:
+        """Return a key after a successful call."""
+        slot = self._by_key[key]
+        self._finish(slot)
+        if slot.breaker is not None:
+            slot.breaker.succeeded()
+        if slot.probation and slot.cooldown_until <= self._clock():
+            slot.probation = False
+            slot.strikes = 0
+        self._notify()
+
+    def fail(self, key: str) -> None:
+        """Return a key after a transient upstream error."""
+        slot = self._by_key[key]
+        self._finish(slot)
+        if slot.breaker is not None:
+            slot.breaker.failed()
+        self._notify()
+
+    def abandon(self, key: str) -> None:
+        """Return a key after a call that says nothing about its health (cancelled)."""
+        slot = self._by_key[key]
+        self._finish(slot)
+        if slot.breaker is not None:
+            slot.breaker.abandoned()
+        self._notify()
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return {
+            slot.breaker.name: slot.breaker.snapshot()
+            for slot in self._slots
+            if slot.breaker is not None
+        }
+
+    def cooldown(self, key: str, retry_after: float | None = None) -> bool:
+        """Return a key that got a 429 and rest it; ``True`` if every key is resting."""
+        slot = self._by_key[key]
+        self._finish(slot)
+        if slot.breaker is not None:
+            slot.breaker.abandoned()
+        now = self._clock()
+        if slot.cooldown_until <= now:
+            # Calls already in flight when the quota ran out get 429s too; they are
+            # one quota event, so only the first starts (and escalates) a cooldown.
+            slot.strikes += 1
+            GEMINI_KEY_COOLDOWNS.labels(key=str(slot.index)).inc()
+        if retry_after is None:
+            retry_after = self.cooldown_s * 2 ** min(slot.strikes - 1, 4)
+        slot.cooldown_until = max(slot.cooldown_until, now + retry_after)
+        slot.probation = True
+        self._notify()
+        return all(other.cooldown_until > now for other in self._slots)
+
+    def _reserve(self, slot: _KeySlot, now: float) -> str:
+        if slot.breaker is not None:
+            slot.breaker.allow()
+        slot.in_flight += 1
+        slot.sent.append(now)
+        GEMINI_KEY_IN_FLIGHT.labels(key=str(slot.index)).inc()
+        return slot.key
+
+    def _pick(self, now: float, exclude: Collection[str] = ()) -> _KeySlot | None:
+        best: _KeySlot | None = None
+        for slot in self._slots:
+            if slot.key in exclude or not self._available(slot, now):
+                continue
+            if best is None or (slot.in_flight, len(slot.sent)) < (best.in_flight, len(best.sent)):
+                best = slot
+        return best
+
+    def _available(self, slot: _KeySlot, now: float) -> bool:
+        if slot.cooldown_until > now:
             return False
+        if slot.breaker is not None and not slot.breaker.ready():
+            return False
+        if slot.probation and slot.in_flight:
+            # One probe at a time until the key proves it has quota again.
+            return False
+        if self.concurrency and slot.in_flight >= self.concurrency:
+            return False
+        while slot.sent and slot.sent[0] <= now - self.window_s:
+            slot.sent.popleft()
+        return not (self.rpm and len(slot.sent) >= self.rpm)
 
-    def _next_available_index(self, start: int) -> int | None:
-        if not self._keys:
-            return None
-        for offset in range(len(self._keys)):
-            index = (start + offset) % len(self._keys)
-            if index not in self._exhausted:
-                return index
-        return None
+    def _resting(self, slot: _KeySlot, now: float) -> bool:
+        """Out of rotation for a while: cooling down, or its breaker is open."""
+        open_breaker = slot.breaker is not None and slot.breaker.state == OPEN
+        return slot.cooldown_until > now or open_breaker
+
+    def _next_opening(self, now: float) -> float:
+        """Earliest time a key frees up without a call finishing."""
+        opening = math.inf
+        for slot in self._slots:
+            if slot.breaker is not None and slot.breaker.state == OPEN:
+                opening = min(opening, now + slot.breaker.retry_after())
+            elif slot.cooldown_until > now:
+                opening = min(opening, slot.cooldown_until)
+            elif self.rpm and len(slot.sent) >= self.rpm:
+                opening = min(opening, slot.sent[0] + self.window_s)
+        return opening
+
+    def _finish(self, slot: _KeySlot) -> None:
+        slot.in_flight = max(0, slot.in_flight - 1)
+        GEMINI_KEY_IN_FLIGHT.labels(key=str(slot.index)).dec()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+def _with_api_key(details: grpc.aio.ClientCallDetails, key: str) -> grpc.aio.ClientCallDetails:
+    metadata = grpc.aio.Metadata(*(details.metadata or ()))
+    metadata.add("x-goog-api-key", key)
+    return details._replace(metadata=metadata)
+
+
+# A plaintext channel carries no call credentials, so the API key is sent as
+# metadata by interceptors (gRPC takes one interceptor per call type).
+class _UnaryApiKey(grpc.aio.UnaryUnaryClientInterceptor):
+    def __init__(self, key: str):
+        self._key = key
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        return await continuation(_with_api_key(client_call_details, self._key), request)
+
+
+class _StreamApiKey(grpc.aio.UnaryStreamClientInterceptor):
+    def __init__(self, key: str):
+        self._key = key
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        return await continuation(_with_api_key(client_call_details, self._key), request)
+
+
+class GeminiClient(NamedTuple):
+    """An async client bound to one API key, and the full name of the model it calls."""
+
+    service: Any  # glm.GenerativeServiceAsyncClient
+    model: str
+
+
+class GeminiClientPool:
+    """One async gapic client per API key, each with its own channel.
+
+    A key's client is built on first use and reused for every later call, so call
+    setup takes no lock and never touches the global ``genai.configure`` state.
+    gRPC asyncio channels belong to the event loop that created them, so a client
+    is rebuilt if it is requested from a different running loop.
+
+    ``endpoint`` (``host:port``) points the clients at a plaintext gRPC server such
+    as ``backend.fake_gemini`` instead of Google.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        factory: Callable[[str], Any] | None = None,
+        endpoint: str | None = None,
+    ):
+        # Fully qualified, as GenerativeModel would name it.
+        self._model = model if "/" in model else f"models/{model}"
+        self._endpoint = endpoint
+        self._factory = factory or self._build
+        self._clients: dict[str, tuple[asyncio.AbstractEventLoop, GeminiClient]] = {}
+
+    def get(self, key: str) -> GeminiClient:
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(key)
+        if entry is None or entry[0] is not loop:
+            entry = (loop, GeminiClient(self._factory(key), self._model))
+            self._clients[key] = entry
+        return entry[1]
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _build(self, key: str) -> glm.GenerativeServiceAsyncClient:
+        client_info = gapic_v1.client_info.ClientInfo(user_agent=USER_AGENT)
+        if self._endpoint:
+            channel = grpc.aio.insecure_channel(
+                self._endpoint, interceptors=[_UnaryApiKey(key), _StreamApiKey(key)]
+            )
+            return glm.GenerativeServiceAsyncClient(
+                transport=GenerativeServiceGrpcAsyncIOTransport(channel=channel),
+                client_info=client_info,
+            )
+        return glm.GenerativeServiceAsyncClient(
+            client_options=ClientOptions(api_key=key), client_info=client_info
+        )
 
 
 class GeminiAdapter(ModelAdapter):
     name = "gemini"
-
-    def __init__(self, keys: list[str], model: str):
-        self._pool = GeminiKeyPool(keys)
+    prefetch_first_delta = True
+
+    def __init__(
+        self,
+        keys: list[str],
+        model: str,
+        max_concurrency: int = 32,
+        pool: GeminiKeyPool | None = None,
+        hedging: HedgePolicy | None = None,
+        batcher: MicroBatcher | None = None,
+        prompt_version: str = "v1",
+        limiter: AdaptiveLimiter | None = None,
+        retries: RetryBudget | None = None,
+        endpoint: str | None = None,
+        edit_min_chars: int | None = None,
+    ):
+        if prompt_version not in SYSTEM_INSTRUCTIONS:
+            raise ValueError(f"Unknown PROMPT_VERSION for Gemini: {prompt_version!r}")
+        self._pool = pool or GeminiKeyPool(keys)
         self._model = model
-        self._configure_lock = threading.Lock()
+        self._clients = GeminiClientPool(model, endpoint=endpoint)
+        # Without an adaptive limiter, a fixed limit of max_concurrency.
+        self._limiter = limiter or AdaptiveLimiter(max_concurrency, min_limit=max_concurrency)
+        self._hedging = hedging
+        self._batcher = batcher
+        self._prompt_version = prompt_version
+        self._retries = retries or RetryBudget()
+        # Texts this long ask for an edit list instead of the full corrected text.
+        self._edit_min_chars = edit_min_chars
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+        if self._batcher is not None and self._batcher.accepts(text) and batchable(text):
+            return await self._batcher.submit(text, lang, self.correct_batch)
+        if self._wants_edits(text):
+            corrected = await self._correct_edits(text, lang)
+            if corrected is not None:
+                return corrected
+        return await self._correct_prompt(build_prompt(text, lang, self._prompt_version))
+
+    async def correct_batch(self, texts: list[str], lang: str) -> list[str]:
+        """Correct several texts with one upstream call.
+
+        Falls back to one call per text when the output cannot be split back.
+        """
+        version = self._prompt_version
+        if len(texts) > 1:
+            output = await self._correct_prompt(build_batch_prompt(texts, lang, version))
+            corrected = split_batch(output, len(texts))
+            if corrected is not None:
+                return corrected
+            BATCH_SPLIT_FAILURES.inc()
+        return list(
+            await asyncio.gather(
+                *(self._correct_prompt(build_prompt(text, lang, version)) for text in texts)
+            )
+        )
+
+    def _wants_edits(self, text: str) -> bool:
+        return self._edit_min_chars is not None and len(text) >= self._edit_min_chars
+
+    async def _correct_edits(self, text: str, lang: str) -> str | None:
+        """Ask for an edit list and apply it; ``None`` if it is malformed or does not fit.
+
+        The output is a few tokens per correction instead of the whole text again.
+        """
+        output = await self._correct_prompt(build_edit_prompt(text, lang, self._prompt_version))
+        edits = parse_edits(output)
+        if edits is None:
+            EDIT_MODE_OUTCOMES.labels(outcome="malformed").inc()
+            return None
+        corrected = apply_edits(text, edits)
+        if corrected is None:
+            EDIT_MODE_OUTCOMES.labels(outcome="mismatch").inc()
+            return None
+        EDIT_MODE_OUTCOMES.labels(outcome="applied").inc()
+        return corrected
 
-    async def correct(self, text: str, lang: str, request_id: str) -> str:
-        prompt = build_prompt(text, lang, request_id)
+    async def _correct_prompt(self, prompt: Prompt) -> str:
+        if self._hedging is not None:
+            return await self._hedged(prompt, self._hedging)
 
         async def call(key: str) -> str:
-            return await asyncio.to_thread(self._generate_text, key, prompt)
+            return await self._generate_once(key, prompt)
 
         return await self._with_key(call)
 
-    def correct_stream(self, text: str, lang: str, request_id: str) -> AsyncGenerator[str, None]:
-        prompt = build_prompt(text, lang, request_id)
-        return self._stream_with_key(prompt)
+    async def _hedged(self, prompt: Prompt, policy: HedgePolicy) -> str:
+        """Race a duplicate call on another key against a call that runs slow."""
+        keys_used: list[str] = []
+
+        async def call(key: str) -> str:
+            keys_used.append(key)
+            return await self._generate_once(key, prompt)
+
+        policy.earn()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._with_key(call))
+        pending: set[asyncio.Future[str]] = {primary}
+
+        async def unhedged() -> str:
+            # Slow calls that are not hedged are sampled too, or the percentile
+            # would drift down to the fast calls and hedge outside the tail.
+            result = await primary
+            policy.record(time.monotonic() - started)
+            return result
+
+        try:
+            delay = policy.delay()
+            if delay is not None:
+                await asyncio.wait(pending, timeout=delay)
+            if primary.done() or delay is None:
+                return await unhedged()
+            if not policy.try_spend():
+                HEDGES_SKIPPED.labels(reason="budget").inc()
+                return await unhedged()
+            hedge_key = self._pool.try_acquire(exclude=keys_used)
+            if hedge_key is None:
+                HEDGES_SKIPPED.labels(reason="no_key").inc()
+                return await unhedged()
+            HEDGES_FIRED.inc()
+            hedge = asyncio.ensure_future(self._call_key(hedge_key, prompt))
+            pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not _failed(task)), None)
+                if winner is not None:
+                    if winner is hedge:
+                        HEDGES_WON.inc()
+                    # The primary's true latency is unknown when it loses; what the
+                    # caller waited is a lower bound, which is good enough here.
+                    policy.record(time.monotonic() - started)
+                    return winner.result()
+            # Both failed: report the primary's error, as without hedging.
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _call_key(self, key: str, prompt: Prompt) -> str:
+        """One call on an already reserved key, returning the key afterwards."""
+        try:
+            result = await self._generate_once(key, prompt)
+        except RATE_LIMIT_ERRORS as err:
+            self._pool.cooldown(key, retry_delay(err))
+            raise
+        except TRANSIENT_ERRORS:
+            self._pool.fail(key)
+            raise
+        except BaseException:
+            self._pool.abandon(key)
+            raise
+        self._pool.release(key)
+        return result
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return self._pool.circuit_breakers()
+
+    def correct_stream(self, text: str, lang: str, request_id: str) -> AsyncGenerator[str, None]:  # noqa: ARG002
+        if self._wants_edits(text):
+            return self._stream_edits(text, lang)
+        prompt = build_prompt(text, lang, self._prompt_version)
+        return self._stream_with_key(prompt, expected_chars=len(text))
+
+    async def _stream_edits(self, text: str, lang: str) -> AsyncGenerator[str, None]:
+        """Yield the edited text as one delta, or stream the full text if the edits fail.
+
+        An edit list is only usable once complete, so it is not streamed; its short
+        output usually finishes before a full-text stream would have.
+        """
+        corrected = await self._correct_edits(text, lang)
+        if corrected is not None:
+            if corrected:
+                yield corrected
+            return
+        prompt = build_prompt(text, lang, self._prompt_version)
+        async for delta in self._stream_with_key(prompt, expected_chars=len(text)):
+            yield delta
 
     async def _with_key(self, func: Callable[[str], Awaitable[str]]) -> str:
         if not self._pool.has_keys():
             raise GeminiKeyExhausted("No Gemini API keys configured.")
-        tried = 0
-        while tried < self._pool.key_count():
-            key = await self._pool.pick_key()
+        self._retries.earn()
+        rate_limited = retries = 0
+        tried: list[str] = []
+        while True:
+            key = await self._pool.acquire(avoid=tried)
+            tried.append(key)
             try:
-                return await func(key)
-            except google_exceptions.ResourceExhausted as err:
-                if await self._pool.mark_exhausted(key):
-                    raise GeminiKeyExhausted(
-                        "Gemini quota is exhausted for all keys. Please try again later."
-                    ) from err
-                tried += 1
-            except google_exceptions.TooManyRequests as err:
-                if await self._pool.mark_exhausted(key):
-                    raise GeminiKeyExhausted(
-                        "Gemini quota is exhausted for all keys. Please try again later."
-                    ) from err
-                tried += 1
-        raise GeminiKeyExhausted("Gemini quota is exhausted for all keys. Please try again later.")
-
-    async def _stream_with_key(self, prompt: str) -> AsyncGenerator[str, None]:
+                result = await func(key)
+            except RATE_LIMIT_ERRORS as err:
+                rate_limited += 1
+                if self._pool.cooldown(key, retry_delay(err)) or (
+                    rate_limited >= self._pool.key_count()
+                ):
+                    raise GeminiKeyExhausted(ALL_KEYS_EXHAUSTED) from err
+                continue
+            except TRANSIENT_ERRORS:
+                delay = self._after_transient(key, retries)
+                if delay is None:
+                    raise
+                retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._pool.abandon(key)
+                raise
+            self._pool.release(key)
+            return result
+
+    async def _stream_with_key(
+        self, prompt: Prompt, expected_chars: int = 0
+    ) -> AsyncGenerator[str, None]:
         if not self._pool.has_keys():
             raise GeminiKeyExhausted("No Gemini API keys configured.")
-        tried = 0
+        self._retries.earn()
         yielded_any = False
-        while tried < self._pool.key_count():
-            key = await self._pool.pick_key()
+        chunks = 0
+        emitted_chars = 0
+        rate_limited = retries = 0
+        tried: list[str] = []
+        while True:
+            key = await self._pool.acquire(avoid=tried)
+            tried.append(key)
+            returned = False
             try:
-                async for chunk in self._stream_once(key, prompt):
-                    yielded_any = True
-                    yield chunk
+                async with contextlib.aclosing(self._stream_once(key, prompt)) as stream:
+                    async for chunk in stream:
+                        yielded_any = True
+                        chunks += 1
+                        emitted_chars += len(chunk)
+                        yield chunk
+                returned = True
+                self._pool.release(key)
                 return
-            except google_exceptions.ResourceExhausted as err:
-                exhausted_all = await self._pool.mark_exhausted(key)
+            except (GeneratorExit, asyncio.CancelledError):
+                UPSTREAM_STREAMS_CANCELLED.inc()
+                UPSTREAM_CHUNKS_AVOIDED.inc(avoided_chunks(expected_chars, emitted_chars, chunks))
+                raise
+            except RATE_LIMIT_ERRORS as err:
+                returned = True
+                rate_limited += 1
+                if self._pool.cooldown(key, retry_delay(err)) or (
+                    rate_limited >= self._pool.key_count()
+                ):
+                    raise GeminiKeyExhausted(ALL_KEYS_EXHAUSTED) from err
                 if yielded_any:
-                    if exhausted_all:
-                        raise GeminiKeyExhausted(
-                            "Gemini quota is exhausted for all keys. Please try again later."
-                        ) from err
                     raise
-                if exhausted_all:
-                    raise GeminiKeyExhausted(
-                        "Gemini quota is exhausted for all keys. Please try again later."
-                    ) from err
-                tried += 1
-            except google_exceptions.TooManyRequests as err:
-                exhausted_all = await self._pool.mark_exhausted(key)
+            except TRANSIENT_ERRORS:
+                returned = True
                 if yielded_any:
-                    if exhausted_all:
-                        raise GeminiKeyExhausted(
-                            "Gemini quota is exhausted for all keys. Please try again later."
-                        ) from err
+                    # Part of the answer is already out; a retry would repeat it.
+                    self._pool.fail(key)
                     raise
-                if exhausted_all:
-                    raise GeminiKeyExhausted(
-                        "Gemini quota is exhausted for all keys. Please try again later."
-                    ) from err
-                tried += 1
-        raise GeminiKeyExhausted("Gemini quota is exhausted for all keys. Please try again later.")
-
-    async def _stream_once(self, key: str, prompt: str) -> AsyncGenerator[str, None]:
-        queue: asyncio.Queue[object] = asyncio.Queue()
-        loop = asyncio.get_running_loop()
-
-        def run():
+                delay = self._after_transient(key, retries)
+                if delay is None:
+                    raise
+                retries += 1
+                await asyncio.sleep(delay)
+            finally:
+                if not returned:
+                    self._pool.abandon(key)
+
+    def _after_transient(self, key: str, attempt: int) -> float | None:
+        """Return ``key`` after a transient error; the backoff before a retry, if any."""
+        time_left = deadlines.remaining()
+        if time_left == 0:
+            # The request's own deadline ran out; that says nothing about the key.
+            self._pool.abandon(key)
+            return None
+        self._pool.fail(key)
+        return self._retries.next_delay(attempt, time_left)
+
+    async def _stream_once(self, key: str, prompt: Prompt) -> AsyncGenerator[str, None]:
+        client = self._clients.get(key)
+        async with self._upstream_slot("stream") as slot:
+            started = time.monotonic()
+            # The RPC is kept as a handle so that it can be cancelled: closing this
+            # generator early (the client went away) must stop generation instead of
+            # leaving gRPC streaming tokens.
+            call = await client.service.stream_generate_content(
+                build_request(client.model, prompt), **call_options()
+            )
             try:
-                model = self._build_model(key)
-                pieces: list[str] = []
+                response = await AsyncGenerateContentResponse.from_aiterator(call)
+                emitted = False
                 last_chunk = None
-                for chunk in model.generate_content(prompt, stream=True):
+                async for chunk in response:
                     last_chunk = chunk
                     text = _extract_text(chunk)
                     if text:
-                        pieces.append(text)
-                        loop.call_soon_threadsafe(queue.put_nowait, text)
-                if not pieces:
+                        if not emitted:
+                            slot.latency = time.monotonic() - started
+                        emitted = True
+                        yield text
+                if not emitted:
                     fallback = _extract_text(last_chunk) if last_chunk is not None else None
-                    if fallback:
-                        loop.call_soon_threadsafe(queue.put_nowait, fallback)
-                    else:
-                        loop.call_soon_threadsafe(
-                            queue.put_nowait, RuntimeError("Gemini returned empty response.")
-                        )
-                loop.call_soon_threadsafe(queue.put_nowait, None)
-            except Exception as err:  # noqa: BLE001
-                loop.call_soon_threadsafe(queue.put_nowait, err)
-
-        thread = threading.Thread(target=run, daemon=True)
-        thread.start()
+                    if not fallback:
+                        raise RuntimeError("Gemini returned empty response.")
+                    yield fallback
+            finally:
+                call.cancel()
+
+    async def _generate_once(self, key: str, prompt: Prompt) -> str:
+        client = self._clients.get(key)
+        async with self._upstream_slot("generate") as slot:
+            started = time.monotonic()
+            response = await client.service.generate_content(
+                build_request(client.model, prompt), **call_options()
+            )
+            slot.latency = per_unit_latency(time.monotonic() - started, len(prompt.text))
+            text = _extract_text(response)
+            if not text:
+                raise RuntimeError("Gemini returned empty response.")
+        return text
 
-        while True:
-            item = await queue.get()
-            if item is None:
-                break
-            if isinstance(item, Exception):
-                raise item
-            if not isinstance(item, str):
-                raise RuntimeError("Unexpected stream item type.")
-            yield item
-
-    def _generate_text(self, key: str, prompt: str) -> str:
-        model = self._build_model(key)
-        response = model.generate_content(prompt)
-        text = _extract_text(response)
-        if text:
-            return text
-        raise RuntimeError("Gemini returned empty response.")
-
-    def _build_model(self, key: str):
-        with self._configure_lock:
-            genai.configure(api_key=key)
-            return genai.GenerativeModel(self._model)
-
-
-def build_prompt(text: str, lang: str, request_id: str) -> str:
-    return (
-        "You are a grammar and spelling correction assistant for Tatar text.\n"
-        "Return only the corrected text. Do not add explanations or extra formatting.\n"
-        "Preserve punctuation, line breaks, and the original meaning.\n"
-        "Preserve the original casing unless a correction requires changing it.\n"
-        f"Language: {lang}\n"
-        f"Request-ID: {request_id}\n\n"
-        f"Text:\n{text}"
+    @contextlib.asynccontextmanager
+    async def _upstream_slot(self, kind: str) -> AsyncIterator[Call]:
+        """Hold a slot of the upstream concurrency limit and track the call.
+
+        Streams report their time to first chunk as latency; other calls report
+        ``per_unit_latency``. Each kind has its own latency baseline. Quota and
+        server errors are reported so the limit backs off.
+        """
+        async with self._limiter.slot(kind) as call:
+            UPSTREAM_IN_FLIGHT.inc()
+            try:
+                yield call
+            except RATE_LIMIT_ERRORS:
+                call.overloaded = True
+                raise
+            except (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError):
+                call.failed = True
+                raise
+            except google_exceptions.DeadlineExceeded as err:
+                raise DeadlineExceeded("Gemini did not answer before the deadline.") from err
+            else:
+                call.succeeded = True
+            finally:
+                UPSTREAM_IN_FLIGHT.dec()
+
+
+def _failed(task: asyncio.Future[str]) -> bool:
+    return task.cancelled() or task.exception() is not None
+
+
+def retry_delay(err: Exception) -> float | None:
+    """Seconds the server asked us to wait before retrying, if it said."""
+    for detail in getattr(err, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    match = _RETRY_IN.search(str(err))
+    return float(match.group(1)) if match else None
+
+
+def call_options() -> dict[str, Any]:
+    """gRPC call options carrying the request deadline, so Gemini stops work too.
+
+    The SDK's own retries are turned off: they would retry 503s for minutes, out of
+    sight of the key breakers and the retry budget.
+    """
+    budget = deadlines.remaining()
+    if budget is None:
+        return {"retry": None}
+    if budget <= 0:
+        raise DeadlineExceeded("Request deadline passed before calling Gemini.")
+    return {"retry": None, "timeout": budget}
+
+
+def per_unit_latency(seconds: float, chars: int) -> float:
+    """Latency per ``LATENCY_UNIT_CHARS`` of input, so long texts are not "slow"."""
+    return seconds * LATENCY_UNIT_CHARS / max(LATENCY_UNIT_CHARS, chars)
+
+
+def build_request(model_name: str, prompt: Prompt) -> glm.GenerateContentRequest:
+    """The instructions go in ``system_instruction``, so user content is the text alone."""
+    return glm.GenerateContentRequest(
+        model=model_name,
+        system_instruction=glm.Content(parts=[glm.Part(text=prompt.system)]),
+        contents=[glm.Content(role="user", parts=[glm.Part(text=prompt.text)])],
+        generation_config=glm.GenerationConfig(response_mime_type="application/json")
+        if prompt.json
+        else None,
     )
 
 
+def avoided_chunks(expected_chars: int, emitted_chars: int, chunks: int) -> int:
+    """Estimate output chunks a cancelled stream did not generate.
+
+    A correction is about as long as its input, and the rest of the output is
+    assumed to arrive in chunks the size of those already received.
+    """
+    remaining = expected_chars - emitted_chars
+    if remaining <= 0:
+        return 0
+    chunk_chars = emitted_chars / chunks if chunks else DEFAULT_CHUNK_CHARS
+    return math.ceil(remaining / max(chunk_chars, 1.0))
+
+
+def build_prompt(text: str, lang: str, prompt_version: str = "v1") -> Prompt:
+    # The language goes last so that the shared prefix is as long as possible.
+    return Prompt(f"{SYSTEM_INSTRUCTIONS[prompt_version]}\nLanguage: {lang}", text)
+
+
+def build_edit_prompt(text: str, lang: str, prompt_version: str = "v1") -> Prompt:
+    system = f"{SYSTEM_INSTRUCTIONS[prompt_version]}\n{EDIT_INSTRUCTION}\nLanguage: {lang}"
+    return Prompt(system, text, json=True)
+
+
+def build_batch_prompt(texts: list[str], lang: str, prompt_version: str = "v1") -> Prompt:
+    system = f"{SYSTEM_INSTRUCTIONS[prompt_version]}\n{BATCH_INSTRUCTION}\nLanguage: {lang}"
+    framed = "\n".join(f'<text id="{i}">\n{text}\n</text>' for i, text in enumerate(texts, 1))
+    return Prompt(system, framed)
+
+
+def batchable(text: str) -> bool:
+    """Whether ``text`` can be framed in a batch prompt without confusing the split."""
+    return "<text" not in text and "</text" not in text
+
+
+def split_batch(output: str, count: int) -> list[str] | None:
+    """Split a batch answer into ``count`` corrections, or ``None`` if it is malformed."""
+    items = _BATCH_ITEM.findall(output)
+    if [int(index) for index, _ in items] != list(range(1, count + 1)):
+        return None
+    corrected = [text for _, text in items]
+    if not all(text.strip() for text in corrected):
+        return None
+    return corrected
+
+
 def _extract_text(response) -> str | None:
-    text = getattr(response, "text", None)
+    try:
+        text = getattr(response, "text", None)
+    except ValueError:
+        # The SDK's ``text`` accessor raises on a response without candidates
+        # (empty or blocked); the fields below tell the same story without raising.
+        text = None
     if text:
         return text
     candidates = getattr(response, "candidates", None)
@@ -0,0 +1,54 @@
+import math
+from collections import deque
+
+
+class HedgePolicy:
+    """Decides when a slow upstream call deserves a duplicate ("hedge") request.
+
+    The hedge delay is a percentile of recent call latencies, so only calls slower
+    than, say, 95% of their peers are hedged. A token budget bounds the extra load:
+    every call earns ``budget`` tokens and every hedge spends one, so hedges stay
+    under ``budget`` of all calls over time (with bursts up to ``max_tokens``).
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        window: int = 512,
+        min_samples: int = 20,
+        max_tokens: float = 10.0,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self._samples: deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+        self._delay: float | None = None
+        self._stale = 0
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._stale += 1
+
+    def delay(self) -> float | None:
+        """Seconds to wait before hedging, or ``None`` until enough calls are seen."""
+        if len(self._samples) < self.min_samples:
+            return None
+        # Re-sorting on every call is wasteful; the percentile moves slowly.
+        if self._delay is None or self._stale >= 32:
+            ordered = sorted(self._samples)
+            index = max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+            self._delay = ordered[index]
+            self._stale = 0
+        return self._delay
+
+    def earn(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.budget)
+
+    def try_spend(self) -> bool:
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
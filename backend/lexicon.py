@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import gzip
+import re
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any
+
+from .metrics import LEXICON_SENTENCES
+from .models import Correction, ModelAdapter, merge_backends, relabel
+from .segments import repad, split_padding, split_segments
+
+# A word: letters, optionally joined by hyphens or apostrophes ("кара-каршы").
+_WORD = re.compile(r"[^\W\d_]+(?:[-'’ʼ][^\W\d_]+)*")
+_WORD_PARTS = re.compile(r"[-'’ʼ]")
+_LATIN = re.compile(r"[A-Za-z]")
+_NON_LATIN = re.compile(r"[^\W\d_A-Za-z]")
+# Space before punctuation, doubled spaces, or a comma glued to the next word.
+_BAD_SPACING = re.compile(r"\s[,.;:!?…]|  |[,;:][^\W\d_]")
+_LEADING_LETTER = re.compile(r"[\"'«“(\[—–-]*\s*([^\W\d_])")
+_TERMINAL = re.compile(r"[.!?…][\"'»”)\]]*$")
+
+
+@functools.cache
+def load_lexicon(path: str) -> frozenset[str]:
+    """Read a word list once per process: one word form per line, ``#`` comments.
+
+    Words are lowercased. A ``.gz`` file is decompressed on the fly. ``backend.main``
+    loads ``LEXICON_PATH`` at import, so under ``gunicorn --preload`` the set is built
+    once in the master and forked workers share its memory.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(Path(path), "rt", encoding="utf-8") as lines:
+        return frozenset(
+            word.lower()
+            for word in (line.strip() for line in lines)
+            if word and not word.startswith("#")
+        )
+
+
+def is_clean(sentence: str, lexicon: frozenset[str]) -> bool:
+    """Whether ``sentence`` looks correct enough to skip the model.
+
+    Every word must be in ``lexicon`` (or all parts of a hyphenated word), written
+    in one script and in lower, title or upper case, and not doubled. The sentence
+    must start with a capital letter, end with terminal punctuation and have no
+    stray spacing. Anything else is suspicious; real-word errors (a known word in
+    the wrong place) are not caught.
+    """
+    core = sentence.strip()
+    if not _TERMINAL.search(core) or _BAD_SPACING.search(core):
+        return False
+    leading = _LEADING_LETTER.match(core)
+    if leading and not leading.group(1).isupper():
+        return False
+    previous = ""
+    words = 0
+    for match in _WORD.finditer(core):
+        word = match.group()
+        lower = word.lower()
+        if lower == previous or not _well_formed(word) or not _known(lower, lexicon):
+            return False
+        previous = lower
+        words += 1
+    return words > 0
+
+
+def _well_formed(word: str) -> bool:
+    if _LATIN.search(word) and _NON_LATIN.search(word):
+        return False
+    return word.islower() or word.isupper() or (word[0].isupper() and word[1:].islower())
+
+
+def _known(word: str, lexicon: frozenset[str]) -> bool:
+    return word in lexicon or all(part in lexicon for part in _WORD_PARTS.split(word))
+
+
+class LexiconFilterAdapter(ModelAdapter):
+    """Send only sentences the lexicon finds suspicious to the model.
+
+    Clean sentences are returned as they are. Consecutive suspicious sentences are
+    corrected together, so they keep each other's context, and up to
+    ``concurrency`` such runs of one text are corrected at once. A text with no
+    suspicious sentence never reaches the model and is reported as backend
+    ``lexicon``.
+    """
+
+    backend = "lexicon"
+
+    def __init__(self, inner: ModelAdapter, lexicon: frozenset[str], concurrency: int = 4):
+        self.inner = inner
+        self.name = inner.name
+        self.prefetch_first_delta = inner.prefetch_first_delta
+        self.lexicon = lexicon
+        self._concurrency = max(1, concurrency)
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        runs = self._runs(text)
+        if not any(suspicious for _, suspicious in runs):
+            return Correction(text, self.backend)
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def correct_one(run: str, suspicious: bool) -> str:
+            lead, core, trail = split_padding(run)
+            if not suspicious or not core:
+                return run
+            async with semaphore:
+                corrected = await self.inner.correct(core, lang, request_id)
+            return relabel(lead + corrected.strip() + trail, corrected)
+
+        results = await asyncio.gather(*(correct_one(*run) for run in runs))
+        return Correction("".join(results), merge_backends(results, self.name))
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        runs = self._runs(text)
+        if not any(suspicious for _, suspicious in runs):
+            yield Correction(text, self.backend)
+            return
+        for run, suspicious in runs:
+            lead, core, trail = split_padding(run)
+            if not suspicious or not core:
+                yield run
+                continue
+            async for delta in repad(
+                self.inner.correct_stream(core, lang, request_id), lead, trail
+            ):
+                yield delta
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return self.inner.circuit_breakers()
+
+    def cache_ttl_ms(self, backend: str) -> int | None:
+        if backend == self.backend:
+            return None
+        return self.inner.cache_ttl_ms(backend)
+
+    def _runs(self, text: str) -> list[tuple[str, bool]]:
+        """Split ``text`` into ``(run, suspicious)`` of consecutive sentences."""
+        runs: list[tuple[str, bool]] = []
+        clean = suspicious = 0
+        for segment in split_segments(text):
+            if not segment.strip():
+                flagged = runs[-1][1] if runs else False
+            else:
+                flagged = not is_clean(segment, self.lexicon)
+                suspicious += flagged
+                clean += not flagged
+            if runs and runs[-1][1] == flagged:
+                runs[-1] = (runs[-1][0] + segment, flagged)
+            else:
+                runs.append((segment, flagged))
+        LEXICON_SENTENCES.labels(verdict="clean").inc(clean)
+        LEXICON_SENTENCES.labels(verdict="suspicious").inc(suspicious)
+        return runs
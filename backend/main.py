@@ -1,8 +1,11 @@
 import asyncio
+import contextlib
 import json
 import logging
+import math
 import time
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
 from typing import Any
 
 from dotenv import load_dotenv
@@ -10,8 +13,9 @@ from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, StreamingResponse
 
-from .cache import SimpleCache
-from .gemini import GeminiAdapter, GeminiKeyExhausted
+from . import deadlines
+from .cache import BoundedCache, CacheEntry, build_cache
+from .lexicon import LexiconFilterAdapter, load_lexicon
 from .metrics import (
     CACHE_HITS,
     METRICS_CONTENT_TYPE,
@@ -20,14 +24,39 @@ from .metrics import (
     STREAM_DURATION,
     STREAMS_ACTIVE,
     STREAMS_TOTAL,
+    TIMEOUTS_TOTAL,
     render_metrics,
 )
-from .models import ModelAdapter, build_adapter, cache_key, request_id
-from .rate_limit import SlidingLimiter
+from .models import (
+    AdapterOverloaded,
+    AdapterUnavailable,
+    Correction,
+    ModelAdapter,
+    backend_of,
+    build_adapter,
+    cache_key,
+    chunk_text,
+    request_id,
+)
+from .rate_limit import RateDecision, build_cost_budget, build_limiter, build_stream_slots
+from .segments import ParallelChunkAdapter, SegmentCacheAdapter
 from .settings import Settings, get_settings
+from .singleflight import SingleFlight
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    state = getattr(app.state, "app_state", None)
+    if state is not None:
+        state.close()
 
-app = FastAPI(title="Tatar GEC")
+
+app = FastAPI(title="Tatar GEC", lifespan=lifespan)
 load_dotenv()
+if get_settings().lexicon_path:
+    # Loaded before gunicorn forks its workers (--preload), so they share one copy.
+    load_lexicon(get_settings().lexicon_path)
 
 
 class AppState:
@@ -36,22 +65,93 @@ class AppState:
         self.adapter: ModelAdapter = build_adapter(settings)
         logger = logging.getLogger("backend")
         logger.info("Model adapter: %s", self.adapter.name)
-        if hasattr(self.adapter, "_model"):
-            logger.info("Gemini model: %s", self.adapter._model)
-        self.cache = SimpleCache(settings.cache_ttl_ms)
-        self.rates = SlidingLimiter(settings.rate_limit_per_minute, settings.rate_limit_per_day)
+        if "gemini" in self.adapter.name.split(","):
+            logger.info("Gemini model: %s", settings.gemini_model)
+        self.cache = build_cache(settings)
+        self.cache.start_sweeper(settings.cache_sweep_interval_ms / 1000)
+        if settings.cache_snapshot_path and isinstance(self.cache, BoundedCache):
+            restored = self.cache.load_snapshot(settings.cache_snapshot_path)
+            logger.info("Restored %d cache entries from snapshot", restored)
+            self.cache.start_snapshots(
+                settings.cache_snapshot_path, settings.cache_snapshot_interval_ms / 1000
+            )
+        if settings.segment_cache:
+            self.adapter = SegmentCacheAdapter(
+                self.adapter, self.cache, self.cache_key, settings.segment_concurrency
+            )
+        if settings.parallel_chunk_chars > 0:
+            self.adapter = ParallelChunkAdapter(
+                self.adapter, settings.parallel_chunk_chars, settings.parallel_chunk_concurrency
+            )
+        if settings.lexicon_path:
+            self.adapter = LexiconFilterAdapter(
+                self.adapter, load_lexicon(settings.lexicon_path), settings.lexicon_concurrency
+            )
+        self.flights = SingleFlight()
+        self.rates = build_limiter(settings)
+        self.char_budget = build_cost_budget(settings)
         self.streams: dict[str, int] = {}
+        self.shared_streams = build_stream_slots(settings)
         self.started_at = time.time()
         self.total_requests = 0
         self.total_invalid = 0
         self.total_rate_limited = 0
         self.total_errors = 0
+        self.total_timeouts = 0
         self.total_cache_hits = 0
         self.total_streams_started = 0
         self.total_streams_done = 0
         self.total_streams_cancelled = 0
         self.total_streams_error = 0
 
+    def cache_key(self, text: str, lang: str) -> str:
+        return cache_key(
+            text,
+            lang,
+            self.adapter.name,
+            self.settings.gemini_model,
+            self.settings.prompt_version,
+        )
+
+    def charge_chars(self, ip: str, text: str) -> tuple[RateDecision | None, int]:
+        """Charge an estimated cost for ``text``; ``(None, 0)`` when budgets are off."""
+        if self.char_budget is None:
+            return None, 0
+        return self.char_budget.charge(ip, text)
+
+    def settle_chars(self, ip: str, charged: int, text: str, output: str) -> None:
+        if self.char_budget is not None:
+            self.char_budget.settle(ip, charged, len(text) + len(output))
+
+    def acquire_stream(self, ip: str) -> bool:
+        limit = self.settings.max_concurrent_streams
+        if self.streams.get(ip, 0) >= limit:
+            return False
+        if self.shared_streams is not None and not self.shared_streams.acquire(ip, limit):
+            return False
+        self.streams[ip] = self.streams.get(ip, 0) + 1
+        return True
+
+    def release_stream(self, ip: str) -> None:
+        self.streams[ip] = max(0, self.streams.get(ip, 1) - 1)
+        if self.shared_streams is not None:
+            self.shared_streams.release(ip)
+
+    def active_streams(self) -> int:
+        if self.shared_streams is not None:
+            return self.shared_streams.total()
+        return sum(self.streams.values())
+
+    def close(self) -> None:
+        if self.settings.cache_snapshot_path and isinstance(self.cache, BoundedCache):
+            self.cache.save_snapshot(self.settings.cache_snapshot_path)
+        self.cache.close()
+        self.rates.close()
+        if self.char_budget is not None:
+            self.char_budget.close()
+        if self.shared_streams is not None:
+            self.shared_streams.close()
+
 
 async def get_state() -> AppState:
     if not hasattr(app.state, "app_state"):
@@ -79,11 +179,12 @@ async def status(state: AppState = Depends(get_state)):
     return {
         "status": "ok",
         "uptime_seconds": uptime,
-        "active_streams": sum(state.streams.values()),
+        "active_streams": state.active_streams(),
         "requests_total": state.total_requests,
         "invalid_requests_total": state.total_invalid,
         "rate_limited_total": state.total_rate_limited,
         "errors_total": state.total_errors,
+        "timeouts_total": state.total_timeouts,
         "cache_hits_total": state.total_cache_hits,
         "streams": {
             "started": state.total_streams_started,
@@ -95,7 +196,12 @@ async def status(state: AppState = Depends(get_state)):
             "max_concurrent_streams": state.settings.max_concurrent_streams,
             "rate_limit_per_minute": state.settings.rate_limit_per_minute,
             "rate_limit_per_day": state.settings.rate_limit_per_day,
+            "rate_limit_chars_per_minute": state.settings.rate_limit_chars_per_minute,
+            "rate_limit_chars_per_day": state.settings.rate_limit_chars_per_day,
+            "request_timeout_ms": state.settings.request_timeout_ms,
+            "stream_stall_ms": state.settings.stream_stall_ms,
         },
+        "circuit_breakers": state.adapter.circuit_breakers(),
     }
 
 
@@ -105,7 +211,7 @@ async def metrics():
 
 
 @app.post("/v1/correct")
-async def correct(request: Request, state: AppState = Depends(get_state)):
+async def correct(request: Request, response: Response, state: AppState = Depends(get_state)):
     state.total_requests += 1
     started = time.time()
     try:
@@ -115,34 +221,66 @@ async def correct(request: Request, state: AppState = Depends(get_state)):
         text = str(body.get("text", ""))
         lang = body.get("lang") or "tt"
         validate_text(text, state.settings.max_chars)
+        timeout_s = request_timeout(body, state.settings.request_timeout_ms)
     except HTTPException:
         state.total_invalid += 1
         REQUESTS_TOTAL.labels(endpoint="correct", outcome="invalid_input").inc()
         REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
         raise
     ip = client_ip(request)
-    if not state.rates.allow(ip):
+    decision = state.rates.check(ip)
+    if not decision.allowed:
         state.total_rate_limited += 1
         REQUESTS_TOTAL.labels(endpoint="correct", outcome="rate_limited").inc()
         REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
-        raise HTTPException(status_code=429, detail={"error": "rate_limited"})
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "rate_limited"},
+            headers=rate_limit_headers(decision),
+        )
+    response.headers.update(rate_limit_headers(decision))
 
     rid = request_id()
-    cached = state.cache.get(cache_key(text, lang))
+    key = state.cache_key(text, lang)
+    cached = state.cache.get(key)
     if cached:
         state.total_cache_hits += 1
         CACHE_HITS.inc()
         REQUESTS_TOTAL.labels(endpoint="correct", outcome="cache").inc()
         REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
-        return {
-            "request_id": rid,
-            "corrected_text": cached.value,
-            "meta": {"model_backend": cached.backend, "latency_ms": 0},
-        }
+        return Response(
+            cached_response_body(rid, cached),
+            media_type="application/json",
+            headers=rate_limit_headers(decision),
+        )
 
+    budget, charged = state.charge_chars(ip, text)
+    if budget is not None and not budget.allowed:
+        state.total_rate_limited += 1
+        REQUESTS_TOTAL.labels(endpoint="correct", outcome="rate_limited").inc()
+        REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "rate_limited", "message": "char_budget_exceeded"},
+            headers=rate_limit_headers(budget),
+        )
+
+    corrected = ""
     try:
-        corrected = await state.adapter.correct(text, lang, rid)
-    except GeminiKeyExhausted as err:
+        remaining_s = timeout_s - (time.time() - started)
+        async with asyncio.timeout(remaining_s):
+            corrected = await state.flights.do(
+                key, lambda: state.adapter.correct(text, lang, rid), remaining_s
+            )
+    except TimeoutError as err:
+        state.total_timeouts += 1
+        TIMEOUTS_TOTAL.labels(endpoint="correct", kind="deadline").inc()
+        REQUESTS_TOTAL.labels(endpoint="correct", outcome="timeout").inc()
+        REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
+        raise HTTPException(
+            status_code=504, detail={"error": "timeout", "request_id": rid}
+        ) from err
+    except AdapterOverloaded as err:
         state.total_rate_limited += 1
         REQUESTS_TOTAL.labels(endpoint="correct", outcome="rate_limited").inc()
         REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
@@ -150,6 +288,15 @@ async def correct(request: Request, state: AppState = Depends(get_state)):
             status_code=429,
             detail={"error": "rate_limited", "message": str(err)},
         ) from err
+    except AdapterUnavailable as err:
+        state.total_errors += 1
+        REQUESTS_TOTAL.labels(endpoint="correct", outcome="unavailable").inc()
+        REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "unavailable", "message": str(err)},
+            headers=unavailable_headers(err),
+        ) from err
     except Exception as err:  # noqa: BLE001
         state.total_errors += 1
         REQUESTS_TOTAL.labels(endpoint="correct", outcome="error").inc()
@@ -157,15 +304,18 @@ async def correct(request: Request, state: AppState = Depends(get_state)):
         raise HTTPException(
             status_code=500, detail={"error": "server_error", "request_id": rid}
         ) from err
+    finally:
+        state.settle_chars(ip, charged, text, corrected)
 
-    state.cache.set(cache_key(text, lang), corrected, state.adapter.name)
+    backend = backend_of(corrected, state.adapter.name)
+    state.cache.set(key, str(corrected), backend, state.adapter.cache_ttl_ms(backend))
     latency = int((time.time() - started) * 1000)
     REQUESTS_TOTAL.labels(endpoint="correct", outcome="ok").inc()
     REQUEST_LATENCY.labels(endpoint="correct").observe(time.time() - started)
     return {
         "request_id": rid,
         "corrected_text": corrected,
-        "meta": {"model_backend": state.adapter.name, "latency_ms": latency},
+        "meta": {"model_backend": backend, "latency_ms": latency},
     }
 
 
@@ -179,25 +329,53 @@ async def correct_stream(request: Request, state: AppState = Depends(get_state))
         text = str(body.get("text", ""))
         lang = body.get("lang") or "tt"
         validate_text(text, state.settings.max_chars)
+        timeout_s = request_timeout(body, state.settings.request_timeout_ms)
     except HTTPException:
         state.total_invalid += 1
         REQUESTS_TOTAL.labels(endpoint="stream", outcome="invalid_input").inc()
         raise
     ip = client_ip(request)
-    if not state.rates.allow(ip):
+    decision = state.rates.check(ip)
+    if not decision.allowed:
+        state.total_rate_limited += 1
+        REQUESTS_TOTAL.labels(endpoint="stream", outcome="rate_limited").inc()
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "rate_limited"},
+            headers=rate_limit_headers(decision),
+        )
+    headers = {**SSE_HEADERS, **rate_limit_headers(decision)}
+
+    key = state.cache_key(text, lang)
+    cached = state.cache.get(key)
+    if cached:
+        state.total_cache_hits += 1
+        CACHE_HITS.inc()
+        REQUESTS_TOTAL.labels(endpoint="stream", outcome="cache").inc()
+        return StreamingResponse(
+            cached_event_stream(request_id(), cached.value, cached.backend),
+            media_type="text/event-stream",
+            headers=headers,
+        )
+
+    budget, charged = state.charge_chars(ip, text)
+    if budget is not None and not budget.allowed:
         state.total_rate_limited += 1
         REQUESTS_TOTAL.labels(endpoint="stream", outcome="rate_limited").inc()
-        raise HTTPException(status_code=429, detail={"error": "rate_limited"})
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "rate_limited", "message": "char_budget_exceeded"},
+            headers=rate_limit_headers(budget),
+        )
 
     # concurrency guard
-    count = state.streams.get(ip, 0)
-    if count >= state.settings.max_concurrent_streams:
+    if not state.acquire_stream(ip):
+        state.settle_chars(ip, charged, "", "")
         state.total_rate_limited += 1
         REQUESTS_TOTAL.labels(endpoint="stream", outcome="rate_limited").inc()
         raise HTTPException(
             status_code=429, detail={"error": "rate_limited", "message": "too_many_streams"}
         )
-    state.streams[ip] = count + 1
 
     rid = request_id()
     started = time.time()
@@ -214,31 +392,75 @@ async def correct_stream(request: Request, state: AppState = Depends(get_state))
         STREAMS_TOTAL.labels(outcome=outcome).inc()
         STREAM_DURATION.observe(time.time() - started)
 
-    stream_iter = state.adapter.correct_stream(text, lang, rid)
+    stall_s = state.settings.stream_stall_ms / 1000
+    expires_at = time.monotonic() + timeout_s
+    stream_iter = state.flights.stream(
+        key, lambda: state.adapter.correct_stream(text, lang, rid), timeout_s
+    )
+
+    async def end_stream(corrected: str, pending: asyncio.Future[str] | None = None) -> None:
+        # Close the subscription now rather than on garbage collection, so the
+        # upstream generation is cancelled as soon as the client is gone. Shielded
+        # because the surrounding task may still be under cancellation.
+        with contextlib.suppress(asyncio.CancelledError):
+            await asyncio.shield(close_stream(stream_iter, pending))
+        state.settle_chars(ip, charged, text, corrected)
+        state.release_stream(ip)
+        STREAMS_ACTIVE.dec()
+
     first_delta: str | None = None
+    first_error: Exception | None = None
     stream_finished = False
-    if isinstance(state.adapter, GeminiAdapter):
+    if state.adapter.prefetch_first_delta:
         try:
-            first_delta = await stream_iter.__anext__()
+            first_delta = await first_delta_within(stream_iter, stall_s, expires_at)
         except StopAsyncIteration:
             stream_finished = True
-        except GeminiKeyExhausted as err:
+        except (AdapterOverloaded, AdapterUnavailable, TimeoutError) as err:
+            await end_stream("")
+            if isinstance(err, TimeoutError):
+                state.total_timeouts += 1
+                TIMEOUTS_TOTAL.labels(endpoint="stream", kind=timeout_kind(err)).inc()
+                record_stream_outcome("timeout")
+                raise HTTPException(
+                    status_code=504, detail={"error": "timeout", "request_id": rid}
+                ) from err
+            if isinstance(err, AdapterUnavailable):
+                state.total_errors += 1
+                record_stream_outcome("unavailable")
+                raise HTTPException(
+                    status_code=503,
+                    detail={"error": "unavailable", "message": str(err)},
+                    headers=unavailable_headers(err),
+                ) from err
             state.total_rate_limited += 1
             REQUESTS_TOTAL.labels(endpoint="stream", outcome="rate_limited").inc()
             record_stream_outcome("rate_limited")
-            state.streams[ip] = max(0, state.streams.get(ip, 1) - 1)
-            STREAMS_ACTIVE.dec()
             raise HTTPException(
                 status_code=429,
                 detail={"error": "rate_limited", "message": str(err)},
             ) from err
+        except Exception as err:  # noqa: BLE001
+            # Reported by event_stream as a server_error event, which also releases
+            # the stream slot.
+            first_error = err
+        except BaseException:
+            await end_stream("")
+            raise
 
     async def event_stream() -> AsyncGenerator[str, None]:
         interval = state.settings.heartbeat_ms / 1000
         corrected = ""
         pending_delta = first_delta
+        next_delta: asyncio.Future[str] | None = None
+        last_delta_at = time.monotonic()
+        # Backends that produced the deltas; a fallback chain reports the one it used.
+        backends: dict[str, None] = {}
+        meta_backend = backend_of(first_delta or "", state.adapter.name)
         try:
-            yield sse_event("meta", {"request_id": rid, "model_backend": state.adapter.name})
+            yield sse_event("meta", {"request_id": rid, "model_backend": meta_backend})
+            if first_error is not None:
+                raise first_error
             if stream_finished:
                 latency = int((time.time() - started) * 1000)
                 yield sse_event("done", {"request_id": rid, "latency_ms": latency})
@@ -251,20 +473,45 @@ async def correct_stream(request: Request, state: AppState = Depends(get_state))
                         delta = pending_delta
                         pending_delta = None
                     else:
-                        delta = await asyncio.wait_for(stream_iter.__anext__(), timeout=interval)
+                        # Keep the same pending read across heartbeats; cancelling it on
+                        # timeout would close the upstream generator mid-stream.
+                        if next_delta is None:
+                            next_delta = asyncio.ensure_future(stream_iter.__anext__())
+                        now = time.monotonic()
+                        wait = min(interval, last_delta_at + stall_s - now, expires_at - now)
+                        await asyncio.wait({next_delta}, timeout=max(wait, 0.0))
+                        if not next_delta.done():
+                            now = time.monotonic()
+                            if now >= expires_at:
+                                raise deadlines.DeadlineExceeded("deadline_exceeded")
+                            if now >= last_delta_at + stall_s:
+                                raise deadlines.UpstreamStalled("upstream_stalled")
+                            yield ": ping\n\n"
+                            continue
+                        done_delta, next_delta = next_delta, None
+                        delta = done_delta.result()
+                    last_delta_at = time.monotonic()
+                    if isinstance(delta, Correction):
+                        backends[delta.backend] = None
                     corrected += delta
                     yield sse_event("delta", {"request_id": rid, "text": delta})
-                except TimeoutError:
-                    yield ": ping\n\n"
                 except StopAsyncIteration:
                     latency = int((time.time() - started) * 1000)
                     yield sse_event("done", {"request_id": rid, "latency_ms": latency})
                     if corrected:
-                        state.cache.set(cache_key(text, lang), corrected, state.adapter.name)
+                        backend = "+".join(backends) or state.adapter.name
+                        ttl_ms = state.adapter.cache_ttl_ms(backend)
+                        state.cache.set(key, corrected, backend, ttl_ms)
                     state.total_streams_done += 1
                     record_stream_outcome("ok")
                     break
-        except GeminiKeyExhausted as err:
+        except TimeoutError as err:
+            yield sse_event("error", {"request_id": rid, "type": "timeout", "message": str(err)})
+            state.total_timeouts += 1
+            TIMEOUTS_TOTAL.labels(endpoint="stream", kind=timeout_kind(err)).inc()
+            record_stream_outcome("timeout")
+            state.total_streams_error += 1
+        except AdapterOverloaded as err:
             yield sse_event(
                 "error",
                 {"request_id": rid, "type": "rate_limited", "message": str(err)},
@@ -272,12 +519,20 @@ async def correct_stream(request: Request, state: AppState = Depends(get_state))
             state.total_rate_limited += 1
             record_stream_outcome("rate_limited")
             state.total_streams_error += 1
-        except asyncio.CancelledError:
+        except AdapterUnavailable as err:
             yield sse_event(
-                "error", {"request_id": rid, "type": "cancelled", "message": "client_disconnected"}
+                "error",
+                {"request_id": rid, "type": "unavailable", "message": str(err)},
             )
+            state.total_errors += 1
+            record_stream_outcome("unavailable")
+            state.total_streams_error += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client is gone: the server either cancelled this task or stopped
+            # iterating after a failed send. Nothing more can be delivered.
             state.total_streams_cancelled += 1
             record_stream_outcome("cancelled")
+            raise
         except Exception as err:  # noqa: BLE001
             yield sse_event(
                 "error", {"request_id": rid, "type": "server_error", "message": str(err)}
@@ -286,17 +541,102 @@ async def correct_stream(request: Request, state: AppState = Depends(get_state))
             state.total_errors += 1
             record_stream_outcome("error")
         finally:
-            state.streams[ip] = max(0, state.streams.get(ip, 1) - 1)
-            STREAMS_ACTIVE.dec()
+            await end_stream(corrected, next_delta)
 
-    headers = {
-        "Cache-Control": "no-cache",
-        "X-Accel-Buffering": "no",
-        "Connection": "keep-alive",
-    }
     return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
 
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+}
+CACHED_DELTA_CHARS = 512
+
+
+async def cached_event_stream(rid: str, value: str, backend: str) -> AsyncGenerator[str, None]:
+    yield sse_event("meta", {"request_id": rid, "model_backend": backend, "cached": True})
+    for chunk in chunk_text(value, CACHED_DELTA_CHARS):
+        yield sse_event("delta", {"request_id": rid, "text": chunk})
+    yield sse_event("done", {"request_id": rid, "latency_ms": 0})
+
+
+async def first_delta_within(
+    stream: AsyncGenerator[str, None], stall_s: float, expires_at: float
+) -> str:
+    """Read the first delta, bounded by the stall timeout and the request deadline.
+
+    Raises ``UpstreamStalled`` or ``DeadlineExceeded`` for whichever bound expired.
+    """
+    left = expires_at - time.monotonic()
+    scope = asyncio.timeout(min(stall_s, left))
+    try:
+        async with scope:
+            return await stream.__anext__()
+    except TimeoutError:
+        if not scope.expired():
+            raise
+    if stall_s < left:
+        raise deadlines.UpstreamStalled("upstream_stalled")
+    raise deadlines.DeadlineExceeded("deadline_exceeded")
+
+
+async def close_stream(
+    stream: AsyncGenerator[str, None], pending: asyncio.Future[str] | None
+) -> None:
+    """Cancel a pending read of ``stream``, then close it."""
+    if pending is not None:
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+    await stream.aclose()
+
+
+def request_timeout(body: dict[str, Any], server_timeout_ms: int) -> float:
+    """Seconds allowed for this request: the server limit, or less if the client asks."""
+    timeout_ms = server_timeout_ms
+    requested = body.get("deadline_ms")
+    if requested is not None:
+        if isinstance(requested, bool) or not isinstance(requested, int) or requested <= 0:
+            raise HTTPException(
+                status_code=400, detail={"error": "invalid_input", "message": "invalid_deadline"}
+            )
+        timeout_ms = min(timeout_ms, requested)
+    return timeout_ms / 1000
+
+
+def timeout_kind(err: TimeoutError) -> str:
+    return "stall" if isinstance(err, deadlines.UpstreamStalled) else "deadline"
+
+
+def rate_limit_headers(decision: RateDecision) -> dict[str, str]:
+    headers = {"X-RateLimit-Remaining": str(decision.remaining)}
+    if not decision.allowed:
+        headers["Retry-After"] = str(decision.retry_after)
+    return headers
+
+
+def unavailable_headers(err: AdapterUnavailable) -> dict[str, str]:
+    if err.retry_after is None:
+        return {}
+    return {"Retry-After": str(max(1, math.ceil(err.retry_after)))}
+
+
+def cached_response_body(rid: str, entry: CacheEntry) -> bytes:
+    """Splice the entry's pre-encoded value into the usual ``/v1/correct`` response."""
+    meta = json.dumps({"model_backend": entry.backend, "latency_ms": 0}, ensure_ascii=False)
+    return b"".join(
+        (
+            b'{"request_id":',
+            json.dumps(rid).encode(),
+            b',"corrected_text":',
+            entry.json_value,
+            b',"meta":',
+            meta.encode("utf-8"),
+            b"}",
+        )
+    )
+
+
 def sse_event(event: str, data: dict[str, Any]) -> str:
     import json
 
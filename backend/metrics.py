@@ -1,3 +1,5 @@
+import threading
+
 from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 REQUESTS_TOTAL = Counter(
@@ -7,7 +9,110 @@ REQUESTS_TOTAL = Counter(
 )
 STREAMS_ACTIVE = Gauge("gec_streams_active", "Active streaming responses")
 STREAMS_TOTAL = Counter("gec_streams_total", "Completed streaming responses", ["outcome"])
+TIMEOUTS_TOTAL = Counter("gec_timeouts_total", "Requests ended by a timeout", ["endpoint", "kind"])
 CACHE_HITS = Counter("gec_cache_hits_total", "Cache hits")
+CACHE_BYTES = Gauge("gec_cache_bytes", "Approximate bytes held by the result cache")
+CACHE_ENTRIES = Gauge("gec_cache_entries", "Entries held by the result cache")
+CACHE_EVICTIONS = Counter(
+    "gec_cache_evictions_total", "Cache entries evicted or refused admission", ["reason"]
+)
+SINGLEFLIGHT_JOINED = Counter(
+    "gec_singleflight_joined_total",
+    "Requests served by joining an identical in-flight upstream call",
+    ["endpoint"],
+)
+SEGMENTS_TOTAL = Counter(
+    "gec_segments_total", "Sentence segments corrected in segment-cache mode", ["source"]
+)
+LEXICON_SENTENCES = Counter(
+    "gec_lexicon_sentences_total",
+    "Sentences checked by the lexicon filter, by verdict (clean ones skip the model)",
+    ["verdict"],
+)
+SEGMENT_CACHE_RATIO = Histogram(
+    "gec_segment_cache_hit_ratio",
+    "Fraction of a request's segments served from cache",
+    buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+)
+PARALLEL_CHUNKS = Histogram(
+    "gec_parallel_chunks",
+    "Chunks a long text was split into for parallel correction",
+    buckets=(2, 3, 4, 6, 8, 12, 16, 32),
+)
+RATE_LIMIT_DECISION = Histogram(
+    "gec_rate_limit_decision_seconds",
+    "Time taken to make one rate-limit decision",
+    ["backend"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+UPSTREAM_IN_FLIGHT = Gauge("gec_upstream_in_flight", "Upstream model calls in flight")
+UPSTREAM_CONCURRENCY_LIMIT = Gauge(
+    "gec_upstream_concurrency_limit", "Current adaptive limit on upstream model calls in flight"
+)
+UPSTREAM_QUEUE_DEPTH = Gauge(
+    "gec_upstream_queue_depth", "Upstream model calls waiting for a concurrency slot"
+)
+UPSTREAM_LIMIT_DECREASES = Counter(
+    "gec_upstream_limit_decreases_total",
+    "Times the adaptive upstream concurrency limit was cut",
+    ["reason"],
+)
+UPSTREAM_RETRIES = Counter(
+    "gec_upstream_retries_total",
+    "Retry decisions after transient upstream errors (retried, or why not)",
+    ["outcome"],
+)
+CIRCUIT_STATE = Gauge(
+    "gec_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["breaker"]
+)
+CIRCUIT_REJECTED = Counter(
+    "gec_circuit_rejected_total", "Calls refused because a circuit breaker was open", ["breaker"]
+)
+FALLBACKS = Counter(
+    "gec_fallbacks_total",
+    "Requests passed on to the next backend in MODEL_BACKEND, by skipped backend and reason",
+    ["backend", "reason"],
+)
+UPSTREAM_STREAMS_CANCELLED = Counter(
+    "gec_upstream_streams_cancelled_total", "Upstream streams cancelled before they finished"
+)
+UPSTREAM_CHUNKS_AVOIDED = Counter(
+    "gec_upstream_chunks_avoided_total",
+    "Estimated upstream output chunks not generated because a stream was cancelled",
+)
+GEMINI_KEY_IN_FLIGHT = Gauge(
+    "gec_gemini_key_in_flight", "Gemini calls in flight per API key (by key index)", ["key"]
+)
+GEMINI_KEY_COOLDOWNS = Counter(
+    "gec_gemini_key_cooldowns_total", "Times a Gemini API key was rested after a 429", ["key"]
+)
+HEDGES_FIRED = Counter("gec_hedges_fired_total", "Duplicate upstream calls sent for slow calls")
+HEDGES_WON = Counter("gec_hedges_won_total", "Hedged calls where the duplicate answered first")
+HEDGES_SKIPPED = Counter(
+    "gec_hedges_skipped_total", "Slow calls not hedged (budget spent or no free key)", ["reason"]
+)
+BATCH_SIZE = Histogram(
+    "gec_batch_size",
+    "Texts corrected together in one micro-batched upstream call",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32),
+)
+BATCH_WAIT = Histogram(
+    "gec_batch_wait_seconds",
+    "Time a text waited for its micro-batch to be sent",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+BATCH_SPLIT_FAILURES = Counter(
+    "gec_batch_split_failures_total",
+    "Micro-batch outputs that could not be split back per text (retried one by one)",
+)
+EDIT_MODE_OUTCOMES = Counter(
+    "gec_edit_mode_total",
+    "Edit-list answers by outcome (applied, malformed or mismatch; the last two fall "
+    "back to full text)",
+    ["outcome"],
+)
+PROCESS_THREADS = Gauge("gec_process_threads", "Live threads in this worker process")
+PROCESS_THREADS.set_function(threading.active_count)
 REQUEST_LATENCY = Histogram(
     "gec_request_latency_seconds", "Request latency in seconds", ["endpoint"]
 )
@@ -1,13 +1,59 @@
 import asyncio
 import hashlib
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Iterable
+from typing import Any
 
 from .settings import Settings
 
 
+class AdapterOverloaded(Exception):
+    """The model cannot take this request now (quota spent or too busy); retry later."""
+
+
+class AdapterUnavailable(Exception):
+    """The model is failing (its circuit breaker is open); retry after ``retry_after``."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Correction(str):
+    """Corrected text that remembers which backend produced it."""
+
+    backend: str
+
+    def __new__(cls, text: str, backend: str) -> "Correction":
+        value = super().__new__(cls, text)
+        value.backend = backend
+        return value
+
+    def __getnewargs__(self) -> tuple[str, str]:  # type: ignore[override]
+        return str(self), self.backend
+
+
+def backend_of(text: str, default: str) -> str:
+    """The backend behind ``text`` if it is a ``Correction``, else ``default``."""
+    return text.backend if isinstance(text, Correction) else default
+
+
+def relabel(text: str, source: str) -> str:
+    """Mark ``text`` (derived from ``source``) with the backend of ``source``."""
+    return Correction(text, source.backend) if isinstance(source, Correction) else text
+
+
+def merge_backends(texts: Iterable[str], default: str) -> str:
+    """Name the backends behind ``texts``: ``gemini``, or ``gemini+local`` when mixed."""
+    names = dict.fromkeys(text.backend for text in texts if isinstance(text, Correction))
+    return "+".join(names) or default
+
+
 class ModelAdapter:
     name = "base"
+    # Read the first delta before sending SSE headers so upstream quota errors can
+    # still be reported as a plain HTTP 429.
+    prefetch_first_delta = False
 
     async def correct(self, text: str, lang: str, request_id: str) -> str:
         raise NotImplementedError
@@ -15,6 +61,14 @@ class ModelAdapter:
     def correct_stream(self, text: str, lang: str, request_id: str) -> AsyncGenerator[str, None]:
         raise NotImplementedError
 
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        """State of this adapter's circuit breakers, by name, for ``/status``."""
+        return {}
+
+    def cache_ttl_ms(self, backend: str) -> int | None:  # noqa: ARG002
+        """Cache TTL for a correction from ``backend``; ``None`` keeps the default."""
+        return None
+
 
 class MockAdapter(ModelAdapter):
     name = "mock"
@@ -58,11 +112,86 @@ class LocalAdapter(ModelAdapter):
 
 
 def build_adapter(settings: Settings) -> ModelAdapter:
-    backend = settings.model_backend.strip().lower()
+    """Build the adapters named in ``MODEL_BACKEND``, in fallback order.
+
+    Each backend gets its own circuit breaker (unless ``CIRCUIT_FAILURE_THRESHOLD``
+    is 0); a list such as ``gemini,local`` becomes a ``FallbackAdapter`` chain.
+    """
+    from .breaker import BreakerAdapter, CircuitBreaker
+
+    names = [name.strip().lower() for name in settings.model_backend.split(",") if name.strip()]
+    adapters: list[ModelAdapter] = []
+    for name in names or ["mock"]:
+        adapter = _build_backend(name, settings)
+        if settings.circuit_failure_threshold > 0:
+            breaker = CircuitBreaker(
+                adapter.name,
+                settings.circuit_failure_threshold,
+                settings.circuit_reset_ms / 1000,
+                settings.circuit_half_open_calls,
+            )
+            adapter = BreakerAdapter(adapter, breaker)
+        adapters.append(adapter)
+    if len(adapters) == 1:
+        return adapters[0]
+    from .fallback import FallbackAdapter
+
+    return FallbackAdapter(
+        adapters, settings.fallback_cache_ttl_ms, settings.fallback_reserve_ms / 1000
+    )
+
+
+def _build_backend(backend: str, settings: Settings) -> ModelAdapter:
     if backend == "gemini":
-        from .gemini import GeminiAdapter
-
-        return GeminiAdapter(settings.gemini_api_keys, settings.gemini_model)
+        from .adaptive import AdaptiveLimiter
+        from .batching import MicroBatcher
+        from .breaker import RetryBudget
+        from .gemini import GeminiAdapter, GeminiKeyPool
+        from .hedging import HedgePolicy
+
+        pool = GeminiKeyPool(
+            settings.gemini_api_keys,
+            rpm=settings.gemini_key_rpm,
+            concurrency=settings.gemini_key_concurrency,
+            cooldown_s=settings.gemini_key_cooldown_ms / 1000,
+            max_wait_s=settings.gemini_key_wait_ms / 1000,
+            failure_threshold=settings.circuit_failure_threshold,
+            reset_timeout_s=settings.circuit_reset_ms / 1000,
+        )
+        return GeminiAdapter(
+            settings.gemini_api_keys,
+            settings.gemini_model,
+            settings.gemini_max_concurrency,
+            pool=pool,
+            hedging=HedgePolicy(
+                settings.gemini_hedge_percentile, settings.gemini_hedge_budget_pct / 100
+            )
+            if settings.gemini_hedge
+            else None,
+            batcher=MicroBatcher(
+                settings.gemini_batch_size,
+                settings.gemini_batch_wait_ms / 1000,
+                settings.gemini_batch_text_chars,
+            )
+            if settings.gemini_batch_size > 1
+            else None,
+            prompt_version=settings.prompt_version,
+            limiter=AdaptiveLimiter(
+                settings.gemini_max_concurrency,
+                min_limit=settings.gemini_min_concurrency,
+                max_wait_s=settings.gemini_queue_wait_ms / 1000,
+            )
+            if settings.gemini_adaptive_concurrency
+            else None,
+            retries=RetryBudget(
+                settings.retry_budget_pct / 100,
+                settings.retry_max_attempts,
+                settings.retry_backoff_ms / 1000,
+                settings.retry_backoff_max_ms / 1000,
+            ),
+            endpoint=settings.gemini_endpoint or None,
+            edit_min_chars=settings.gemini_edit_min_chars if settings.gemini_edit_mode else None,
+        )
     if backend == "prompt":
         return PromptAdapter(settings.prompt_version)
     if backend == "local":
@@ -82,8 +211,14 @@ def chunk_text(text: str, size: int):
         yield text[i : i + size]
 
 
-def cache_key(text: str, lang: str) -> str:
-    return hashlib.sha256(f"{text}{lang}".encode()).hexdigest()
+def cache_key(text: str, lang: str, adapter: str, model: str, prompt_version: str) -> str:
+    """Key a correction by its input and everything that shapes the output.
+
+    Including the adapter, upstream model and prompt version means entries restored
+    from an older snapshot can never be served after any of them change.
+    """
+    parts = (text, lang, adapter, model, prompt_version)
+    return hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()
 
 
 def request_id() -> str:
@@ -1,23 +1,423 @@
+import math
+import os
+import sqlite3
+import sys
+import threading
 import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .metrics import RATE_LIMIT_DECISION
+from .settings import Settings
+
+MINUTE = 60
+DAY = 86400
+
+
+class RateDecision(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: int
+
+
+class _KeyState:
+    """Sliding-window counters for one key: constant memory however busy it is."""
+
+    __slots__ = ("starts", "counts", "previous")
+
+    def __init__(self, windows: int):
+        self.starts = [0.0] * windows
+        self.counts = [0] * windows
+        self.previous = [0] * windows
 
 
 class SlidingLimiter:
-    def __init__(self, per_minute: int, per_day: int):
+    """Per-key minute and day limits using the sliding-window counter algorithm.
+
+    Each window keeps only the current and previous fixed-window counts; the
+    previous count is weighted by how much of it still overlaps the sliding window.
+    Keys whose windows have fully drained are garbage-collected periodically. Keys
+    are kept in order of last use, so collection only looks at the idle ones at the
+    front, at most ``gc_batch`` per decision; a backlog is worked off over the next
+    decisions instead of stalling one of them.
+    """
+
+    def __init__(
+        self, per_minute: int, per_day: int, gc_interval_s: float = 60.0, gc_batch: int = 1000
+    ):
         self.per_minute = per_minute
         self.per_day = per_day
-        self.minute: dict[str, list[float]] = {}
-        self.day: dict[str, list[float]] = {}
+        self.windows = ((MINUTE, per_minute), (DAY, per_day))
+        self.keys: OrderedDict[str, _KeyState] = OrderedDict()
+        self.gc_interval_s = gc_interval_s
+        self.gc_batch = gc_batch
+        self._next_gc = 0.0
 
     def allow(self, key: str) -> bool:
+        return self.check(key).allowed
+
+    def check(self, key: str, cost: int = 1) -> RateDecision:
+        started = time.perf_counter()
         now = time.time()
-        minute_window = now - 60
-        day_window = now - 86400
-        self.minute.setdefault(key, [])
-        self.day.setdefault(key, [])
-        self.minute[key] = [t for t in self.minute[key] if t >= minute_window]
-        self.day[key] = [t for t in self.day[key] if t >= day_window]
-        if len(self.minute[key]) >= self.per_minute or len(self.day[key]) >= self.per_day:
-            return False
-        self.minute[key].append(now)
-        self.day[key].append(now)
+        if now >= self._next_gc:
+            self.collect(now, self.gc_batch)
+        state = self.keys.get(key)
+        if state is None:
+            state = _KeyState(len(self.windows))
+            self.keys[key] = state
+        else:
+            self.keys.move_to_end(key)
+        decision = decide(state, self.windows, now, cost)
+        RATE_LIMIT_DECISION.labels(backend="memory").observe(time.perf_counter() - started)
+        return decision
+
+    def adjust(self, key: str, delta: int) -> None:
+        """Add ``delta`` (possibly negative) to the key's current windows."""
+        state = self.keys.get(key)
+        if state is not None:
+            self.keys.move_to_end(key)
+            adjust(state, self.windows, time.time(), delta)
+
+    def collect(self, now: float | None = None, limit: int | None = None) -> int:
+        """Drop keys with nothing left in any window; returns how many were removed.
+
+        Stops at the first key still in use, since every key after it was used
+        later. With ``limit``, removes at most that many and, if it had to stop
+        there, leaves the next collection due at once.
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        while self.keys:
+            if limit is not None and removed >= limit:
+                return removed
+            state = next(iter(self.keys.values()))
+            if any(
+                now < state.starts[index] + 2 * size for index, (size, _) in enumerate(self.windows)
+            ):
+                break
+            self.keys.popitem(last=False)
+            removed += 1
+        self._next_gc = now + self.gc_interval_s
+        return removed
+
+    def close(self) -> None:
+        pass
+
+
+def decide(
+    state: _KeyState, windows: tuple[tuple[int, int], ...], now: float, cost: int
+) -> RateDecision:
+    """Roll ``state`` forward to ``now`` and charge ``cost`` if every window allows it."""
+    estimates = []
+    for index, (size, _) in enumerate(windows):
+        _roll(state, index, size, now)
+        estimates.append(_estimate(state, index, size, now))
+    blocked = False
+    retry_after = 0.0
+    for index, (size, limit) in enumerate(windows):
+        if math.floor(estimates[index]) + cost > limit:
+            blocked = True
+            retry_after = max(retry_after, _wait(state, index, size, limit, cost, now))
+    if blocked:
+        return RateDecision(False, 0, max(1, math.ceil(retry_after)))
+    for index in range(len(windows)):
+        state.counts[index] += cost
+    remaining = min(
+        limit - math.floor(estimate) - cost
+        for estimate, (_, limit) in zip(estimates, windows, strict=True)
+    )
+    return RateDecision(True, max(0, remaining), 0)
+
+
+def adjust(state: _KeyState, windows: tuple[tuple[int, int], ...], now: float, delta: int) -> None:
+    """Correct a charge already made in the current windows of ``state``."""
+    for index, (size, _) in enumerate(windows):
+        _roll(state, index, size, now)
+        state.counts[index] = max(0, state.counts[index] + delta)
+
+
+def _roll(state: _KeyState, index: int, size: int, now: float) -> None:
+    start = now - now % size
+    if start == state.starts[index]:
+        return
+    adjacent = start - state.starts[index] == size
+    state.previous[index] = state.counts[index] if adjacent else 0
+    state.counts[index] = 0
+    state.starts[index] = start
+
+
+def _estimate(state: _KeyState, index: int, size: int, now: float) -> float:
+    overlap = 1 - (now - state.starts[index]) / size
+    return state.previous[index] * overlap + state.counts[index]
+
+
+def _wait(state: _KeyState, index: int, size: int, limit: int, cost: int, now: float) -> float:
+    """Seconds until the window estimate leaves room for ``cost`` more."""
+    target = limit - cost + 1
+    if target <= 0:
+        return float(size)
+    start = state.starts[index]
+    count = state.counts[index]
+    if count >= target:
+        # Wait for the next window, then for this window's weight to decay.
+        wait = start + size - now + size * (1 - target / count)
+    else:
+        wait = start + size * (1 - (target - count) / state.previous[index]) - now
+    # The estimate must drop strictly below the target, not just reach it.
+    return wait + 1e-3
+
+
+class SqliteLimiter:
+    """``SlidingLimiter`` whose counters live in a SQLite database in WAL mode.
+
+    All gunicorn workers on a host share the file, and each decision is a single
+    ``BEGIN IMMEDIATE`` read-modify-write, so limits hold exactly across workers.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        per_minute: int,
+        per_day: int,
+        gc_interval_s: float = 60.0,
+        namespace: str = "",
+    ):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.windows = ((MINUTE, per_minute), (DAY, per_day))
+        self.gc_interval_s = gc_interval_s
+        self.namespace = namespace
+        self._next_gc = 0.0
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        return self.check(key).allowed
+
+    def check(self, key: str, cost: int = 1) -> RateDecision:
+        started = time.perf_counter()
+        now = time.time()
+        if now >= self._next_gc:
+            self.collect(now)
+        with self._lock, transaction(self._conn):
+            state = self._load(key)
+            decision = decide(state, self.windows, now, cost)
+            self._store(key, state)
+        RATE_LIMIT_DECISION.labels(backend="sqlite").observe(time.perf_counter() - started)
+        return decision
+
+    def adjust(self, key: str, delta: int) -> None:
+        with self._lock, transaction(self._conn):
+            state = self._load(key)
+            adjust(state, self.windows, time.time(), delta)
+            self._store(key, state)
+
+    def _load(self, key: str) -> _KeyState:
+        state = _KeyState(len(self.windows))
+        rows = self._conn.execute(
+            "SELECT window, start, count, previous FROM rate_limits WHERE key = ?",
+            (self.namespace + key,),
+        )
+        for index, start, count, previous in rows:
+            if index < len(self.windows):
+                state.starts[index] = start
+                state.counts[index] = count
+                state.previous[index] = previous
+        return state
+
+    def _store(self, key: str, state: _KeyState) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rate_limits (key, window, start, count, previous) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    self.namespace + key,
+                    index,
+                    state.starts[index],
+                    state.counts[index],
+                    state.previous[index],
+                )
+                for index in range(len(self.windows))
+            ],
+        )
+
+    def collect(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        self._next_gc = now + self.gc_interval_s
+        with self._lock:
+            # A key is idle once its longest window and the one before it have passed.
+            removed = self._conn.execute(
+                "DELETE FROM rate_limits WHERE key IN (SELECT key FROM rate_limits "
+                "GROUP BY key HAVING MAX(start + 2 * CASE window WHEN 0 THEN ? ELSE ? END) <= ?)",
+                (self.windows[0][0], self.windows[-1][0], now),
+            )
+        return max(removed.rowcount, 0) // len(self.windows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SqliteStreamSlots:
+    """Concurrent-stream counters per IP shared by every worker process.
+
+    Slots are recorded per worker pid so that those held by a crashed worker can be
+    reclaimed instead of blocking the IP forever.
+    """
+
+    def __init__(self, path: str):
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.reap()
+
+    def acquire(self, ip: str, limit: int) -> bool:
+        with self._lock, transaction(self._conn):
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM stream_slots WHERE ip = ?", (ip,)
+            ).fetchone()
+            if int(row[0]) >= limit:
+                return False
+            self._conn.execute(
+                "INSERT INTO stream_slots (pid, ip, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (pid, ip) DO UPDATE SET count = count + 1",
+                (self._pid, ip),
+            )
         return True
+
+    def release(self, ip: str) -> None:
+        with self._lock, transaction(self._conn):
+            self._conn.execute(
+                "UPDATE stream_slots SET count = count - 1 WHERE pid = ? AND ip = ?",
+                (self._pid, ip),
+            )
+            self._conn.execute("DELETE FROM stream_slots WHERE count <= 0")
+
+    def total(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(count), 0) FROM stream_slots").fetchone()
+        return int(row[0])
+
+    def reap(self) -> int:
+        """Release slots held by worker processes that no longer exist."""
+        with self._lock:
+            pids = [row[0] for row in self._conn.execute("SELECT DISTINCT pid FROM stream_slots")]
+            dead = [pid for pid in pids if pid != self._pid and not _pid_alive(pid)]
+            for pid in dead:
+                self._conn.execute("DELETE FROM stream_slots WHERE pid = ?", (pid,))
+        return len(dead)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM stream_slots WHERE pid = ?", (self._pid,))
+            self._conn.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT NOT NULL,
+    window INTEGER NOT NULL,
+    start REAL NOT NULL,
+    count INTEGER NOT NULL,
+    previous INTEGER NOT NULL,
+    PRIMARY KEY (key, window)
+);
+CREATE TABLE IF NOT EXISTS stream_slots (
+    pid INTEGER NOT NULL,
+    ip TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (pid, ip)
+);
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SQLITE_SCHEMA)
+    return conn
+
+
+class transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT`` block that rolls back on error."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CostBudget:
+    """Per-key character budgets on top of a limiter whose counts are characters.
+
+    A request is charged its input plus an output of the same length up front, and
+    the charge is settled against the real input and output once the response is
+    known. Charges are capped at the smallest limit so that a single long text can
+    still get through an otherwise idle budget.
+    """
+
+    def __init__(self, limiter: SlidingLimiter | SqliteLimiter):
+        self.limiter = limiter
+        self.cap = max(1, min(limit for _, limit in limiter.windows))
+
+    def charge(self, key: str, text: str) -> tuple[RateDecision, int]:
+        cost = min(2 * len(text), self.cap)
+        decision = self.limiter.check(key, cost)
+        return decision, cost if decision.allowed else 0
+
+    def settle(self, key: str, charged: int, actual: int) -> None:
+        delta = min(actual, self.cap) - charged
+        if charged and delta:
+            self.limiter.adjust(key, delta)
+
+    def close(self) -> None:
+        self.limiter.close()
+
+
+def build_limiter(settings: Settings) -> SlidingLimiter | SqliteLimiter:
+    backend = settings.rate_limit_backend.strip().lower()
+    if backend == "sqlite":
+        return SqliteLimiter(
+            settings.rate_limit_path, settings.rate_limit_per_minute, settings.rate_limit_per_day
+        )
+    return SlidingLimiter(settings.rate_limit_per_minute, settings.rate_limit_per_day)
+
+
+def build_stream_slots(settings: Settings) -> SqliteStreamSlots | None:
+    """Shared stream slots for the sqlite backend; ``None`` means per-worker counting."""
+    if settings.rate_limit_backend.strip().lower() == "sqlite":
+        return SqliteStreamSlots(settings.rate_limit_path)
+    return None
+
+
+def build_cost_budget(settings: Settings) -> CostBudget | None:
+    """Character budgets per IP, or ``None`` when both limits are 0 (disabled)."""
+    per_minute = settings.rate_limit_chars_per_minute
+    per_day = settings.rate_limit_chars_per_day
+    if per_minute <= 0 and per_day <= 0:
+        return None
+    # A disabled window gets a limit no request can reach.
+    per_minute = per_minute if per_minute > 0 else sys.maxsize
+    per_day = per_day if per_day > 0 else sys.maxsize
+    limiter: SlidingLimiter | SqliteLimiter
+    if settings.rate_limit_backend.strip().lower() == "sqlite":
+        limiter = SqliteLimiter(settings.rate_limit_path, per_minute, per_day, namespace="chars:")
+    else:
+        limiter = SlidingLimiter(per_minute, per_day)
+    return CostBudget(limiter)
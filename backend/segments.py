@@ -0,0 +1,401 @@
+import asyncio
+import re
+from collections.abc import AsyncGenerator, AsyncIterator, Callable
+from typing import Any
+
+from .metrics import PARALLEL_CHUNKS, SEGMENT_CACHE_RATIO, SEGMENTS_TOTAL
+from .models import Correction, ModelAdapter, backend_of, merge_backends, relabel
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»”)\]]*\s+")
+_SENTENCE_START = re.compile(r"[\"'«“(\[—–-]*[0-9A-ZА-ЯЁӘӨҮҖҢҺ]")
+_TRAILING_WORD = re.compile(r"(\S+?)[.!?…]+[\"'»”)\]]*\s*$")
+
+# Abbreviations after which a period does not end a sentence ("һ.б." = and so on,
+# "т.б." = and others, "б.э." = AD, "ел" = year, plus common units and titles).
+ABBREVIATIONS = frozenset(
+    {
+        "һ.б",
+        "т.б",
+        "б.э",
+        "б.э.к",
+        "ел",
+        "еллар",
+        "гасыр",
+        "г",
+        "м",
+        "км",
+        "см",
+        "мм",
+        "кг",
+        "т",
+        "мәс",
+        "мәс.өч",
+        "проф",
+        "акад",
+        "доц",
+        "др",
+        "ст",
+        "ур",
+        "бит",
+        "№",
+    }
+)
+
+
+def split_segments(text: str) -> list[str]:
+    """Split text into paragraphs and sentences, keeping trailing whitespace.
+
+    ``"".join(split_segments(text)) == text`` always holds, so corrected segments can
+    be stitched back together without losing the original layout.
+    """
+    segments: list[str] = []
+    start = 0
+    for paragraph in _PARAGRAPH_BREAK.finditer(text):
+        segments.extend(_split_sentences(text[start : paragraph.end()]))
+        start = paragraph.end()
+    if start < len(text):
+        segments.extend(_split_sentences(text[start:]))
+    return segments
+
+
+def _split_sentences(paragraph: str) -> list[str]:
+    sentences: list[str] = []
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        end = match.end()
+        if end >= len(paragraph) or not _SENTENCE_START.match(paragraph, end):
+            continue
+        if _is_abbreviation(paragraph[start:end]):
+            continue
+        sentences.append(paragraph[start:end])
+        start = end
+    if start < len(paragraph):
+        sentences.append(paragraph[start:])
+    return sentences
+
+
+def _is_abbreviation(sentence: str) -> bool:
+    match = _TRAILING_WORD.search(sentence)
+    if not match or not sentence.rstrip().endswith("."):
+        return False
+    word = match.group(1).lstrip("\"'«“([")
+    # A lone capital letter is an initial ("Г. Тукай").
+    if len(word) == 1 and word.isupper():
+        return True
+    return word.lower() in ABBREVIATIONS
+
+
+def group_segments(segments: list[str], max_chars: int) -> list[str]:
+    """Pack consecutive segments into chunks of at most ``max_chars`` characters.
+
+    A chunk that is at least half full also ends at the next paragraph break, so
+    chunks follow paragraphs where they can. A single longer segment is its own
+    chunk. ``"".join`` of the chunks is the original text.
+    """
+    chunks: list[str] = []
+    current = ""
+    for segment in segments:
+        if current and len(current) + len(segment) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += segment
+        if len(current) * 2 >= max_chars and _PARAGRAPH_BREAK.search(segment):
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_padding(segment: str) -> tuple[str, str, str]:
+    """Return ``(leading whitespace, core, trailing whitespace)`` of a segment."""
+    core = segment.strip()
+    if not core:
+        return segment, "", ""
+    lead = segment[: len(segment) - len(segment.lstrip())]
+    trail = segment[len(segment.rstrip()) :]
+    return lead, core, trail
+
+
+class SegmentCacheAdapter(ModelAdapter):
+    """Cache corrections per sentence and only send uncached sentences upstream.
+
+    A resubmitted text with one edited sentence then costs a single short upstream
+    call instead of a full-text correction. Consecutive uncached sentences go up as
+    one call, so they keep each other's context and a cold text is a single call.
+    """
+
+    def __init__(
+        self,
+        inner: ModelAdapter,
+        cache,
+        key_fn: Callable[[str, str], str],
+        concurrency: int = 4,
+    ):
+        self.inner = inner
+        self.name = inner.name
+        self.prefetch_first_delta = inner.prefetch_first_delta
+        self._cache = cache
+        self._key_fn = key_fn
+        self._concurrency = max(1, concurrency)
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def correct_one(run: str, cached: str | None) -> str:
+            lead, core, trail = split_padding(run)
+            if cached is not None or not core:
+                return cached if cached is not None else run
+            async with semaphore:
+                result = await self.inner.correct(core, lang, request_id)
+            backend = backend_of(result, self.inner.name)
+            self._store_run(run, result, lang, backend)
+            return Correction(lead + result.strip() + trail, backend)
+
+        results = await asyncio.gather(*(correct_one(*run) for run in self._runs(text, lang)))
+        return Correction("".join(results), merge_backends(results, self.name))
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        for run, cached in self._runs(text, lang):
+            lead, core, trail = split_padding(run)
+            if cached is not None or not core:
+                yield cached if cached is not None else run
+                continue
+            pieces: list[str] = []
+            stream = self.inner.correct_stream(core, lang, request_id)
+            async for delta in repad(stream, lead, trail, pieces):
+                yield delta
+            backend = merge_backends(pieces, self.inner.name)
+            self._store_run(run, "".join(pieces), lang, backend)
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return self.inner.circuit_breakers()
+
+    def cache_ttl_ms(self, backend: str) -> int | None:
+        return self.inner.cache_ttl_ms(backend)
+
+    def _runs(self, text: str, lang: str) -> list[tuple[str, str | None]]:
+        """Split ``text`` into ``(run, cached correction or None)``.
+
+        A cached sentence is a run of its own; consecutive uncached ones are joined.
+        """
+        segments = split_segments(text)
+        parts = [split_padding(segment) for segment in segments]
+        runs: list[tuple[str, str | None]] = []
+        for segment, (lead, _, trail), value in zip(
+            segments, parts, self._lookup(parts, lang), strict=True
+        ):
+            if value is not None:
+                runs.append((segment, relabel(lead + value + trail, value)))
+            elif runs and runs[-1][1] is None:
+                runs[-1] = (runs[-1][0] + segment, None)
+            else:
+                runs.append((segment, None))
+        return runs
+
+    def _store_run(self, run: str, corrected: str, lang: str, backend: str) -> None:
+        """Cache each sentence of a corrected run.
+
+        Nothing is cached if the model merged or split sentences, since the
+        corrections can then not be matched to their sources.
+        """
+        sources = [core for _, core, _ in map(split_padding, split_segments(run)) if core]
+        if len(sources) == 1:
+            self._store(sources[0], lang, corrected.strip(), backend)
+            return
+        results = [core for _, core, _ in map(split_padding, split_segments(corrected)) if core]
+        if len(results) == len(sources):
+            for source, result in zip(sources, results, strict=True):
+                self._store(source, lang, result, backend)
+
+    def _store(self, core: str, lang: str, corrected: str, backend: str) -> None:
+        ttl_ms = self.inner.cache_ttl_ms(backend)
+        self._cache.set(self._key_fn(core, lang), corrected, backend, ttl_ms)
+
+    def _lookup(self, parts: list[tuple[str, str, str]], lang: str) -> list[str | None]:
+        values: list[str | None] = []
+        hits = 0
+        total = 0
+        for _, core, _ in parts:
+            if not core:
+                values.append(None)
+                continue
+            total += 1
+            entry = self._cache.get(self._key_fn(core, lang))
+            values.append(Correction(entry.value, entry.backend) if entry else None)
+            hits += entry is not None
+        if total:
+            SEGMENTS_TOTAL.labels(source="cache").inc(hits)
+            SEGMENTS_TOTAL.labels(source="model").inc(total - hits)
+            SEGMENT_CACHE_RATIO.observe(hits / total)
+        return values
+
+
+class ParallelChunkAdapter(ModelAdapter):
+    """Correct long texts as several chunks at once instead of one long generation.
+
+    Texts longer than ``chunk_chars`` are split at sentence and paragraph
+    boundaries and up to ``concurrency`` chunks are corrected concurrently. Each
+    chunk is an ordinary upstream call, so it also takes a key from the Gemini key
+    pool and counts against its per-key limits. Streams are merged in order: the
+    first chunk streams live while later chunks are buffered until their turn.
+    """
+
+    def __init__(self, inner: ModelAdapter, chunk_chars: int, concurrency: int = 4):
+        self.inner = inner
+        self.name = inner.name
+        self.prefetch_first_delta = inner.prefetch_first_delta
+        self._chunk_chars = chunk_chars
+        self._concurrency = max(1, concurrency)
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        parts = self._split(text)
+        if parts is None:
+            return await self.inner.correct(text, lang, request_id)
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def correct_one(lead: str, core: str, trail: str) -> str:
+            if not core:
+                return lead
+            async with semaphore:
+                corrected = await self.inner.correct(core, lang, request_id)
+            return relabel(lead + corrected.strip() + trail, corrected)
+
+        results = await asyncio.gather(*(correct_one(*part) for part in parts))
+        return Correction("".join(results), merge_backends(results, self.name))
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        parts = self._split(text)
+        if parts is None:
+            async for delta in self.inner.correct_stream(text, lang, request_id):
+                yield delta
+            return
+
+        def source(lead: str, core: str, trail: str) -> Callable[[], AsyncIterator[str]]:
+            if not core:
+                return lambda: _once(lead)
+            return lambda: repad(self.inner.correct_stream(core, lang, request_id), lead, trail)
+
+        merged = merge_ordered([source(*part) for part in parts], self._concurrency)
+        try:
+            async for delta in merged:
+                yield delta
+        finally:
+            await merged.aclose()
+
+    def circuit_breakers(self) -> dict[str, dict[str, Any]]:
+        return self.inner.circuit_breakers()
+
+    def cache_ttl_ms(self, backend: str) -> int | None:
+        return self.inner.cache_ttl_ms(backend)
+
+    def _split(self, text: str) -> list[tuple[str, str, str]] | None:
+        if len(text) <= self._chunk_chars:
+            return None
+        chunks = group_segments(split_segments(text), self._chunk_chars)
+        if len(chunks) < 2:
+            return None
+        PARALLEL_CHUNKS.observe(len(chunks))
+        return [split_padding(chunk) for chunk in chunks]
+
+
+async def repad(
+    deltas: AsyncIterator[str], lead: str, trail: str, pieces: list[str] | None = None
+) -> AsyncGenerator[str, None]:
+    """Stream a corrected segment with the original whitespace around it.
+
+    Whitespace around the model output is replaced by ``lead`` and ``trail``, so
+    trailing whitespace is held back until more text follows it. Raw deltas are
+    appended to ``pieces`` when it is given.
+    """
+    held = lead
+    emitted = False
+    async for delta in deltas:
+        if pieces is not None:
+            pieces.append(delta)
+        body = delta.rstrip() if emitted else delta.strip()
+        if not body:
+            if emitted:
+                held += delta
+            continue
+        yield relabel(held + body, delta)
+        held = delta[len(delta.rstrip()) :]
+        emitted = True
+    tail = trail if emitted else lead + trail
+    if tail:
+        yield tail
+
+
+async def _once(value: str) -> AsyncGenerator[str, None]:
+    if value:
+        yield value
+
+
+class _Buffer:
+    """Output of one source in ``merge_ordered``, kept until it is its turn."""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Exception | None = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def drain(self) -> AsyncGenerator[str, None]:
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                index += 1
+                yield self.chunks[index - 1]
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+async def merge_ordered(
+    sources: list[Callable[[], AsyncIterator[str]]], concurrency: int
+) -> AsyncGenerator[str, None]:
+    """Run up to ``concurrency`` of ``sources`` at once and yield their output in order.
+
+    Sources start in order, so the first one streams live while later ones fill
+    buffers. Closing the merged stream cancels every source still running.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    buffers = [_Buffer() for _ in sources]
+
+    async def pump(source: Callable[[], AsyncIterator[str]], buffer: _Buffer) -> None:
+        async with semaphore:
+            stream = source()
+            try:
+                async for chunk in stream:
+                    buffer.chunks.append(chunk)
+                    buffer.notify()
+            except Exception as err:  # noqa: BLE001
+                buffer.error = err
+            finally:
+                buffer.done = True
+                buffer.notify()
+                aclose = getattr(stream, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+    tasks = [asyncio.create_task(pump(src, buf)) for src, buf in zip(sources, buffers, strict=True)]
+    try:
+        for buffer in buffers:
+            async for chunk in buffer.drain():
+                yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
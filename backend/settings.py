@@ -13,6 +13,13 @@ def _get_int(name: str, default: int) -> int:
         return default
 
 
+def _get_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
 def _get_list(name: str) -> list[str]:
     raw = os.getenv(name, "")
     return [item.strip() for item in raw.split(",") if item.strip()]
@@ -30,17 +37,104 @@ class Settings:
         default_factory=lambda: _get_int("RATE_LIMIT_PER_MINUTE", 60)
     )
     rate_limit_per_day: int = field(default_factory=lambda: _get_int("RATE_LIMIT_PER_DAY", 1000))
+    rate_limit_chars_per_minute: int = field(
+        default_factory=lambda: _get_int("RATE_LIMIT_CHARS_PER_MINUTE", 0)
+    )
+    rate_limit_chars_per_day: int = field(
+        default_factory=lambda: _get_int("RATE_LIMIT_CHARS_PER_DAY", 0)
+    )
+    rate_limit_backend: str = field(default_factory=lambda: _get("RATE_LIMIT_BACKEND", "memory"))
+    rate_limit_path: str = field(
+        default_factory=lambda: _get("RATE_LIMIT_PATH", "ratelimit.sqlite3")
+    )
     max_concurrent_streams: int = field(
         default_factory=lambda: _get_int("MAX_CONCURRENT_STREAMS", 3)
     )
     heartbeat_ms: int = field(default_factory=lambda: _get_int("HEARTBEAT_MS", 20000))
+    request_timeout_ms: int = field(default_factory=lambda: _get_int("REQUEST_TIMEOUT_MS", 60000))
+    stream_stall_ms: int = field(default_factory=lambda: _get_int("STREAM_STALL_MS", 30000))
     model_backend: str = field(default_factory=lambda: _get("MODEL_BACKEND", "gemini"))
     prompt_version: str = field(default_factory=lambda: _get("PROMPT_VERSION", "v1"))
     cache_ttl_ms: int = field(default_factory=lambda: _get_int("CACHE_TTL_MS", 60000))
+    cache_backend: str = field(default_factory=lambda: _get("CACHE_BACKEND", "memory"))
+    cache_path: str = field(default_factory=lambda: _get("CACHE_PATH", "cache.sqlite3"))
+    cache_max_bytes: int = field(default_factory=lambda: _get_int("CACHE_MAX_BYTES", 33554432))
+    cache_compress_min_bytes: int = field(
+        default_factory=lambda: _get_int("CACHE_COMPRESS_MIN_BYTES", 1024)
+    )
+    cache_sweep_interval_ms: int = field(
+        default_factory=lambda: _get_int("CACHE_SWEEP_INTERVAL_MS", 30000)
+    )
+    cache_snapshot_path: str = field(default_factory=lambda: _get("CACHE_SNAPSHOT_PATH", ""))
+    cache_snapshot_interval_ms: int = field(
+        default_factory=lambda: _get_int("CACHE_SNAPSHOT_INTERVAL_MS", 300000)
+    )
+    segment_cache: bool = field(default_factory=lambda: _get_bool("SEGMENT_CACHE", False))
+    segment_concurrency: int = field(default_factory=lambda: _get_int("SEGMENT_CONCURRENCY", 4))
+    parallel_chunk_chars: int = field(default_factory=lambda: _get_int("PARALLEL_CHUNK_CHARS", 0))
+    parallel_chunk_concurrency: int = field(
+        default_factory=lambda: _get_int("PARALLEL_CHUNK_CONCURRENCY", 4)
+    )
+    lexicon_path: str = field(default_factory=lambda: _get("LEXICON_PATH", ""))
+    lexicon_concurrency: int = field(default_factory=lambda: _get_int("LEXICON_CONCURRENCY", 4))
     gemini_model: str = field(
         default_factory=lambda: _get("GEMINI_MODEL", "gemini-3-flash-preview")
     )
     gemini_api_keys: list[str] = field(default_factory=lambda: _get_list("GEMINI_API_KEYS"))
+    gemini_max_concurrency: int = field(
+        default_factory=lambda: _get_int("GEMINI_MAX_CONCURRENCY", 32)
+    )
+    gemini_adaptive_concurrency: bool = field(
+        default_factory=lambda: _get_bool("GEMINI_ADAPTIVE_CONCURRENCY", False)
+    )
+    gemini_min_concurrency: int = field(
+        default_factory=lambda: _get_int("GEMINI_MIN_CONCURRENCY", 2)
+    )
+    gemini_queue_wait_ms: int = field(
+        default_factory=lambda: _get_int("GEMINI_QUEUE_WAIT_MS", 2000)
+    )
+    fallback_cache_ttl_ms: int = field(
+        default_factory=lambda: _get_int("FALLBACK_CACHE_TTL_MS", 10000)
+    )
+    fallback_reserve_ms: int = field(default_factory=lambda: _get_int("FALLBACK_RESERVE_MS", 3000))
+    circuit_failure_threshold: int = field(
+        default_factory=lambda: _get_int("CIRCUIT_FAILURE_THRESHOLD", 5)
+    )
+    circuit_reset_ms: int = field(default_factory=lambda: _get_int("CIRCUIT_RESET_MS", 30000))
+    circuit_half_open_calls: int = field(
+        default_factory=lambda: _get_int("CIRCUIT_HALF_OPEN_CALLS", 1)
+    )
+    retry_max_attempts: int = field(default_factory=lambda: _get_int("RETRY_MAX_ATTEMPTS", 2))
+    retry_budget_pct: int = field(default_factory=lambda: _get_int("RETRY_BUDGET_PCT", 10))
+    retry_backoff_ms: int = field(default_factory=lambda: _get_int("RETRY_BACKOFF_MS", 100))
+    retry_backoff_max_ms: int = field(
+        default_factory=lambda: _get_int("RETRY_BACKOFF_MAX_MS", 2000)
+    )
+    gemini_endpoint: str = field(default_factory=lambda: _get("GEMINI_ENDPOINT", ""))
+    gemini_key_rpm: int = field(default_factory=lambda: _get_int("GEMINI_KEY_RPM", 0))
+    gemini_key_concurrency: int = field(
+        default_factory=lambda: _get_int("GEMINI_KEY_CONCURRENCY", 0)
+    )
+    gemini_key_cooldown_ms: int = field(
+        default_factory=lambda: _get_int("GEMINI_KEY_COOLDOWN_MS", 60000)
+    )
+    gemini_hedge: bool = field(default_factory=lambda: _get_bool("GEMINI_HEDGE", False))
+    gemini_hedge_percentile: int = field(
+        default_factory=lambda: _get_int("GEMINI_HEDGE_PERCENTILE", 95)
+    )
+    gemini_hedge_budget_pct: int = field(
+        default_factory=lambda: _get_int("GEMINI_HEDGE_BUDGET_PCT", 5)
+    )
+    gemini_key_wait_ms: int = field(default_factory=lambda: _get_int("GEMINI_KEY_WAIT_MS", 5000))
+    gemini_batch_size: int = field(default_factory=lambda: _get_int("GEMINI_BATCH_SIZE", 0))
+    gemini_batch_wait_ms: int = field(default_factory=lambda: _get_int("GEMINI_BATCH_WAIT_MS", 5))
+    gemini_batch_text_chars: int = field(
+        default_factory=lambda: _get_int("GEMINI_BATCH_TEXT_CHARS", 300)
+    )
+    gemini_edit_mode: bool = field(default_factory=lambda: _get_bool("GEMINI_EDIT_MODE", False))
+    gemini_edit_min_chars: int = field(
+        default_factory=lambda: _get_int("GEMINI_EDIT_MIN_CHARS", 500)
+    )
 
 
 def get_settings() -> Settings:
@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable
+
+from . import deadlines
+from .metrics import SINGLEFLIGHT_JOINED
+
+
+class StreamFlight:
+    """One upstream stream fanned out to any number of subscribers.
+
+    Deltas are kept for the lifetime of the flight so that a subscriber joining
+    late first receives everything produced so far, then follows live output.
+    The upstream is cancelled once the last subscriber goes away. It runs under
+    ``timeout_s``, the deadline of the subscriber that started it.
+    """
+
+    def __init__(self, source: AsyncIterator[str], timeout_s: float | None = None):
+        self.expires_at = _expiry(timeout_s)
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(
+            self._pump(source, timeout_s), context=contextvars.Context()
+        )
+
+    async def _pump(self, source: AsyncIterator[str], timeout_s: float | None) -> None:
+        try:
+            with _bound(timeout_s):
+                async for chunk in source:
+                    self.chunks.append(chunk)
+                    self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as err:  # noqa: BLE001
+            self.error = err
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    yield chunk
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Coalesce identical concurrent upstream calls keyed by ``cache_key``.
+
+    A shared call runs under ``timeout_s`` of the caller that started it, so the
+    upstream gets a real deadline (and stops when that caller's time is up). A
+    caller that joined with a later deadline and sees the call time out before
+    anything reached it starts the call again under its own deadline.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future[str]] = {}
+        self._expiries: dict[str, float | None] = {}
+        self._waiters: dict[str, int] = {}
+        self._streams: dict[str, StreamFlight] = {}
+
+    async def do(
+        self, key: str, func: Callable[[], Awaitable[str]], timeout_s: float | None = None
+    ) -> str:
+        expires_at = _expiry(timeout_s)
+        while True:
+            call = self._calls.get(key)
+            live = call is not None and not call.done()
+            call_expires_at = self._expiries[key] if live else expires_at
+            try:
+                return await self._join(key, func, expires_at)
+            except TimeoutError:
+                if not _outlives(expires_at, call_expires_at):
+                    raise
+
+    async def _join(
+        self, key: str, func: Callable[[], Awaitable[str]], expires_at: float | None
+    ) -> str:
+        call = self._calls.get(key)
+        if call is None or call.done():
+            call = asyncio.create_task(
+                _call(func, _timeout(expires_at)), context=contextvars.Context()
+            )
+            self._calls[key] = call
+            self._expiries[key] = expires_at
+            self._waiters[key] = 0
+            created = call
+            call.add_done_callback(lambda _: self._call_done(key, created))
+        else:
+            SINGLEFLIGHT_JOINED.labels(endpoint="correct").inc()
+        self._waiters[key] += 1
+        try:
+            # Shielded so one impatient caller cannot cancel the call for everyone else.
+            return await asyncio.shield(call)
+        finally:
+            if self._calls.get(key) is call:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    # Every caller gave up (deadline or disconnect): stop the upstream call.
+                    call.cancel()
+
+    def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+        timeout_s: float | None = None,
+    ) -> AsyncGenerator[str, None]:
+        expires_at = _expiry(timeout_s)
+        return self._follow(key, factory, expires_at, self._flight(key, factory, expires_at))
+
+    def _flight(
+        self, key: str, factory: Callable[[], AsyncIterator[str]], expires_at: float | None
+    ) -> StreamFlight:
+        flight = self._streams.get(key)
+        if flight is None or flight.done:
+            flight = StreamFlight(factory(), _timeout(expires_at))
+            self._streams[key] = flight
+            created = flight
+            flight.task.add_done_callback(lambda _: self._forget(self._streams, key, created))
+        else:
+            SINGLEFLIGHT_JOINED.labels(endpoint="stream").inc()
+        return flight
+
+    async def _follow(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+        expires_at: float | None,
+        flight: StreamFlight,
+    ) -> AsyncGenerator[str, None]:
+        while True:
+            delivered = False
+            subscription = flight.subscribe()
+            try:
+                async for chunk in subscription:
+                    delivered = True
+                    yield chunk
+                return
+            except TimeoutError:
+                if delivered or not _outlives(expires_at, flight.expires_at):
+                    raise
+            finally:
+                await subscription.aclose()
+            flight = self._flight(key, factory, expires_at)
+
+    def _call_done(self, key: str, call: asyncio.Future[str]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+            del self._expiries[key]
+            del self._waiters[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    @staticmethod
+    def _forget(registry: dict, key: str, value) -> None:
+        if registry.get(key) is value:
+            registry.pop(key, None)
+
+
+def _expiry(timeout_s: float | None) -> float | None:
+    return None if timeout_s is None else time.monotonic() + timeout_s
+
+
+def _timeout(expires_at: float | None) -> float | None:
+    return None if expires_at is None else max(0.0, expires_at - time.monotonic())
+
+
+def _outlives(expires_at: float | None, shared_expires_at: float | None) -> bool:
+    """Whether a caller due at ``expires_at`` still has time after a shared call's deadline."""
+    if shared_expires_at is None:
+        return False
+    if expires_at is None:
+        return True
+    return expires_at > shared_expires_at and expires_at > time.monotonic()
+
+
+def _bound(timeout_s: float | None) -> contextlib.AbstractContextManager[object]:
+    return contextlib.nullcontext() if timeout_s is None else deadlines.bind(timeout_s)
+
+
+async def _call(func: Callable[[], Awaitable[str]], timeout_s: float | None) -> str:
+    with _bound(timeout_s):
+        return await func()
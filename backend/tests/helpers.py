@@ -4,13 +4,60 @@ import socket
 import subprocess
 import sys
 import time
+from collections.abc import Callable
 from pathlib import Path
 
 import httpx
+from prometheus_client import REGISTRY
+
+from backend.models import ModelAdapter
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 
 
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RecordingAdapter(ModelAdapter):
+    """Records every text it is sent and answers ``fix(text)`` with stray padding."""
+
+    name = "recording"
+
+    def __init__(self, fix: Callable[[str], str] = str.upper):
+        self.fix = fix
+        self.seen: list[str] = []
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+        self.seen.append(text)
+        return self.fix(text) + "\n"
+
+    async def correct_stream(self, text: str, lang: str, request_id: str):  # noqa: ARG002
+        self.seen.append(text)
+        fixed = self.fix(text)
+        yield " " + fixed[:3]
+        yield fixed[3:] + " \n"
+
+
+def metric_value(name: str, labels: dict[str, str] | None = None) -> float:
+    """Current value of a sample in the default registry, 0 if never recorded."""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def scraped_metric_value(metrics_text: str, name: str, labels: list[tuple[str, str]]) -> float:
+    """Value of a sample in a ``/metrics`` response, 0 if absent."""
+    label_str = ",".join([f'{key}="{value}"' for key, value in labels])
+    prefix = f"{name}{{{label_str}}}"
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix):
+            return float(line.split()[-1])
+    return 0.0
+
+
 def free_port() -> int:
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.bind(("127.0.0.1", 0))
@@ -64,3 +111,25 @@ async def wait_ready(base_url: str, timeout_s: float = 5.0) -> None:
                 pass
             await asyncio.sleep(0.1)
     raise RuntimeError("Server did not become ready")
+
+
+def cache_worker(path: str, key: str, value: str | None, results) -> None:
+    """Process entry point: optionally write ``key`` to a shared cache, then read it back."""
+    from backend.cache import SqliteCache
+
+    cache = SqliteCache(path, ttl_ms=60000, max_bytes=1_000_000)
+    if value is not None:
+        cache.set(key, value, "mock")
+    entry = cache.get(key)
+    results.put((os.getpid(), entry.value if entry else None))
+    cache.close()
+
+
+def limiter_worker(path: str, key: str, attempts: int, per_minute: int, results) -> None:
+    """Process entry point: hammer a shared SQLite limiter and report allowed requests."""
+    from backend.rate_limit import SqliteLimiter
+
+    limiter = SqliteLimiter(path, per_minute=per_minute, per_day=per_minute * 10)
+    allowed = sum(limiter.allow(key) for _ in range(attempts))
+    results.put(allowed)
+    limiter.close()
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from backend import deadlines
+from backend.adaptive import AdaptiveLimiter, Call
+from backend.models import AdapterOverloaded
+from backend.tests.helpers import FakeClock
+
+
+def finish(
+    limiter: AdaptiveLimiter,
+    latency: float | None = None,
+    overloaded: bool = False,
+    failed: bool = False,
+    kind: str = "call",
+    succeeded: bool | None = None,
+):
+    call = Call(kind)
+    call.latency = latency
+    call.overloaded = overloaded
+    call.failed = failed
+    call.succeeded = not (overloaded or failed) if succeeded is None else succeeded
+    limiter.release(call)
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_additively_and_halves_on_429():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_limit=16, min_limit=2, clock=clock)
+    limiter._limit = 4.0
+
+    for _ in range(4):
+        await limiter.acquire()
+        finish(limiter, latency=0.1)
+    assert limiter.limit == 4
+    for _ in range(4):
+        await limiter.acquire()
+        finish(limiter, latency=0.1)
+    assert limiter.limit == 5
+
+    clock.now = 10
+    for _ in range(3):
+        await limiter.acquire()
+    # Three 429s from calls that were already in flight count as one cut.
+    for _ in range(3):
+        finish(limiter, overloaded=True)
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+    clock.now = 20
+    await limiter.acquire()
+    finish(limiter, overloaded=True)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_latency_spike_cuts_limit_after_warmup():
+    limiter = AdaptiveLimiter(max_limit=8, min_samples=5, clock=FakeClock())
+    for _ in range(5):
+        await limiter.acquire()
+        finish(limiter, latency=0.1)
+    assert limiter.limit == 8
+
+    await limiter.acquire()
+    finish(limiter, latency=0.15)
+    assert limiter.limit == 8
+    await limiter.acquire()
+    finish(limiter, latency=0.5)
+    assert limiter.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_only_successes_grow_the_limit():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_limit=16, clock=clock)
+    limiter._limit = 4.0
+
+    # Cancelled calls and errors unrelated to load (e.g. empty answers) hold.
+    for _ in range(20):
+        await limiter.acquire()
+        finish(limiter, succeeded=False)
+    assert limiter.limit == 4
+
+    # Upstream 5xx errors cut like 429s.
+    await limiter.acquire()
+    finish(limiter, failed=True)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_latency_baselines_are_kept_per_call_kind():
+    limiter = AdaptiveLimiter(max_limit=8, min_samples=5, clock=FakeClock())
+    for _ in range(40):
+        await limiter.acquire()
+        finish(limiter, latency=0.3, kind="stream")
+    # Whole non-stream calls take longer than a stream's first chunk; not a spike.
+    for _ in range(5):
+        await limiter.acquire()
+        finish(limiter, latency=1.0, kind="generate")
+    assert limiter.limit == 8
+
+    await limiter.acquire()
+    finish(limiter, latency=1.0, kind="stream")
+    assert limiter.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_excess_calls_queue_in_order_then_fail_when_wait_runs_out():
+    limiter = AdaptiveLimiter(max_limit=1, max_wait_s=0.05)
+    order: list[int] = []
+
+    async def worker(index: int) -> None:
+        async with limiter.slot() as call:
+            order.append(index)
+            await asyncio.sleep(0.01)
+            call.latency = 0.01
+
+    await asyncio.gather(*(worker(index) for index in range(3)))
+    assert order == [0, 1, 2]
+    assert limiter.queued() == 0
+
+    await limiter.acquire()
+    with pytest.raises(AdapterOverloaded):
+        await limiter.acquire()
+    assert limiter.queued() == 0
+    finish(limiter)
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_is_bounded_by_deadline():
+    limiter = AdaptiveLimiter(max_limit=1)
+    await limiter.acquire()
+    with deadlines.bind(0.02), pytest.raises(AdapterOverloaded):
+        await asyncio.wait_for(limiter.acquire(), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_a_slot():
+    limiter = AdaptiveLimiter(max_limit=1)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    finish(limiter)
+    assert limiter.in_flight == 0
+    await asyncio.wait_for(limiter.acquire(), timeout=0.1)
@@ -1,15 +1,20 @@
 import asyncio
+import contextlib
 import json
 import random
 import string
+import time
 from collections.abc import AsyncGenerator
 
 import pytest
 from httpx import ASGITransport, AsyncClient
 
+from backend import deadlines
+from backend.breaker import BreakerAdapter
 from backend.main import AppState, app
 from backend.models import ModelAdapter
 from backend.settings import Settings
+from backend.tests.helpers import scraped_metric_value
 
 
 def setup_state(**overrides):
@@ -119,7 +124,7 @@ async def test_metrics_increment_once():
     setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000)
     async with make_client() as client:
         before = await client.get("/metrics")
-        before_value = metric_value(
+        before_value = scraped_metric_value(
             before.text,
             "gec_requests_total",
             [("endpoint", "correct"), ("outcome", "ok")],
@@ -129,7 +134,7 @@ async def test_metrics_increment_once():
         assert response.status_code == 200
 
         after = await client.get("/metrics")
-        after_value = metric_value(
+        after_value = scraped_metric_value(
             after.text,
             "gec_requests_total",
             [("endpoint", "correct"), ("outcome", "ok")],
@@ -486,15 +491,6 @@ async def collect_events(response):
     return events
 
 
-def metric_value(metrics_text: str, name: str, labels: list[tuple[str, str]]) -> float:
-    label_str = ",".join([f'{key}="{value}"' for key, value in labels])
-    prefix = f"{name}{{{label_str}}}"
-    for line in metrics_text.splitlines():
-        if line.startswith(prefix):
-            return float(line.split()[-1])
-    return 0.0
-
-
 @pytest.mark.asyncio
 async def test_streaming_events():
     setup_state()
@@ -680,6 +676,76 @@ async def test_stream_error_event():
         assert 'gec_streams_total{outcome="error"}' in metrics.text
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shared_slots", [False, True])
+async def test_prefetch_failure_releases_the_stream_slot(tmp_path, shared_slots):
+    overrides = {"rate_limit_backend": "sqlite", "rate_limit_path": str(tmp_path / "rl.sqlite3")}
+    setup_state(
+        max_concurrent_streams=2,
+        rate_limit_per_minute=1000,
+        rate_limit_per_day=1000,
+        **(overrides if shared_slots else {}),
+    )
+    adapter = FailingAdapter()
+    adapter.prefetch_first_delta = True
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        for _ in range(3):
+            async with client.stream(
+                "POST", "/v1/correct/stream", json={"text": "hello", "lang": "tt"}
+            ) as response:
+                assert response.status_code == 200
+                events = await collect_events(response)
+            assert events[-1][0] == "error"
+            assert events[-1][1]["type"] == "server_error"
+    assert app.state.app_state.active_streams() == 0
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_returns_503_and_shows_on_status():
+    setup_state(circuit_failure_threshold=1, circuit_reset_ms=20000)
+    state = app.state.app_state
+    state.adapter = BreakerAdapter(FailingAdapter(), state.adapter.breaker)
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "hello", "lang": "tt"})
+        assert first.status_code == 500
+
+        response = await client.post("/v1/correct", json={"text": "again", "lang": "tt"})
+        assert response.status_code == 503
+        assert response.json()["detail"]["error"] == "unavailable"
+        assert response.headers["Retry-After"] == "20"
+
+        async with client.stream(
+            "POST", "/v1/correct/stream", json={"text": "more", "lang": "tt"}
+        ) as streamed:
+            events = await collect_events(streamed)
+        error_payload = next(payload for name, payload in events if name == "error")
+        assert error_payload["type"] == "unavailable"
+
+        status = await get_status(client)
+        assert status["circuit_breakers"]["mock"]["state"] == "open"
+
+
+@pytest.mark.asyncio
+async def test_exhausted_gemini_falls_back_to_local_backend():
+    setup_state(model_backend="gemini,local", gemini_api_keys=[], fallback_cache_ttl_ms=5000)
+    state = app.state.app_state
+    async with make_client() as client:
+        response = await client.post("/v1/correct", json={"text": "сәлам", "lang": "tt"})
+        assert response.status_code == 200
+        assert response.json()["meta"]["model_backend"] == "local"
+        entry = state.cache.get(state.cache_key("сәлам", "tt"))
+        assert entry.backend == "local"
+        assert entry.expires_at - time.time() * 1000 <= 5000
+
+        async with client.stream(
+            "POST", "/v1/correct/stream", json={"text": "исәнме", "lang": "tt"}
+        ) as streamed:
+            events = await collect_events(streamed)
+        assert events[0][1]["model_backend"] == "local"
+        assert "done" in [name for name, _ in events]
+
+
 @pytest.mark.asyncio
 async def test_correct_error_increments_counters():
     setup_state()
@@ -804,3 +870,491 @@ async def test_stream_concurrency_limit():
             headers=headers,
         )
         assert blocked.status_code == 429
+
+
+@pytest.mark.asyncio
+async def test_cache_snapshot_survives_restart(tmp_path):
+    snapshot = str(tmp_path / "cache.jsonl")
+    setup_state(cache_snapshot_path=snapshot)
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "hello", "lang": "tt"})
+        assert first.status_code == 200
+    app.state.app_state.close()
+
+    setup_state(cache_snapshot_path=snapshot)
+    async with make_client() as client:
+        restored = await client.post("/v1/correct", json={"text": "hello", "lang": "tt"})
+        assert restored.json()["meta"]["latency_ms"] == 0
+        assert app.state.app_state.total_cache_hits == 1
+    app.state.app_state.close()
+
+    setup_state(cache_snapshot_path=snapshot, gemini_model="another-model")
+    async with make_client() as client:
+        await client.post("/v1/correct", json={"text": "hello", "lang": "tt"})
+        assert app.state.app_state.total_cache_hits == 0
+
+
+class CountingAdapter(SlowAdapter):
+    name = "counting"
+
+    def __init__(self, delay: float, chunks: list[str] | None = None):
+        super().__init__(delay, chunks)
+        self.calls = 0
+        self.stream_calls = 0
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return await super().correct(text, lang, request_id)
+
+    async def correct_stream(
+        self,
+        text: str,
+        lang: str,
+        request_id: str,
+    ) -> AsyncGenerator[str, None]:
+        self.stream_calls += 1
+        async for chunk in super().correct_stream(text, lang, request_id):
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_upstream_call():
+    setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000)
+    adapter = CountingAdapter(0.05, ["fixed"])
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        responses = await asyncio.gather(
+            *(client.post("/v1/correct", json={"text": "hello", "lang": "tt"}) for _ in range(4))
+        )
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert {response.json()["corrected_text"] for response in responses} == {"fixed"}
+    assert adapter.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_streams_share_upstream_stream():
+    setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000, max_concurrent_streams=10)
+    adapter = CountingAdapter(0.02, ["a", "b", "c"])
+    app.state.app_state.adapter = adapter
+
+    async def run_stream(client: AsyncClient):
+        async with client.stream(
+            "POST", "/v1/correct/stream", json={"text": "hello", "lang": "tt"}
+        ) as response:
+            events = await collect_events(response)
+        return "".join(payload["text"] for name, payload in events if name == "delta")
+
+    async with make_client() as client:
+        texts = await asyncio.gather(*(run_stream(client) for _ in range(3)))
+
+    assert texts == ["abc"] * 3
+    assert adapter.stream_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_segment_cache_mode_reports_segment_metrics():
+    setup_state(segment_cache=True, rate_limit_per_minute=1000, rate_limit_per_day=1000)
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "Бер. Ике.", "lang": "tt"})
+        assert first.status_code == 200
+        second = await client.post("/v1/correct", json={"text": "Бер. Өч.", "lang": "tt"})
+        assert second.status_code == 200
+        assert second.json()["corrected_text"] == "Бер. Өч."
+
+        async with client.stream(
+            "POST", "/v1/correct/stream", json={"text": "Ике. Дүрт.", "lang": "tt"}
+        ) as response:
+            events = await collect_events(response)
+        streamed = "".join(payload["text"] for name, payload in events if name == "delta")
+        assert streamed == "Ике. Дүрт."
+
+        metrics = await client.get("/metrics")
+        assert 'gec_segments_total{source="cache"}' in metrics.text
+        assert "gec_segment_cache_hit_ratio_bucket" in metrics.text
+
+
+@pytest.mark.asyncio
+async def test_lexicon_filter_skips_model_for_clean_sentences(tmp_path):
+    words = tmp_path / "words.txt"
+    words.write_text("бер\nике\n", encoding="utf-8")
+    setup_state(
+        lexicon_path=str(words),
+        lexicon_concurrency=2,
+        rate_limit_per_minute=1000,
+        rate_limit_per_day=1000,
+    )
+    assert app.state.app_state.adapter._concurrency == 2
+    async with make_client() as client:
+        response = await client.post("/v1/correct", json={"text": "Бер. Ике  өч.", "lang": "tt"})
+        assert response.status_code == 200
+        assert response.json()["corrected_text"] == "Бер. Ике өч."
+
+        clean = await client.post("/v1/correct", json={"text": "Бер. Ике.", "lang": "tt"})
+        assert clean.json()["corrected_text"] == "Бер. Ике."
+        assert clean.json()["meta"]["model_backend"] == "lexicon"
+
+        metrics = await client.get("/metrics")
+        assert 'gec_lexicon_sentences_total{verdict="clean"}' in metrics.text
+
+
+@pytest.mark.asyncio
+async def test_stream_cache_hit_skips_adapter():
+    setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000)
+    adapter = CountingAdapter(0.0, ["cached ", "text"])
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "hello", "lang": "tt"})
+        assert first.status_code == 200
+        before = await client.get("/metrics")
+
+        async with client.stream(
+            "POST", "/v1/correct/stream", json={"text": "hello", "lang": "tt"}
+        ) as response:
+            assert response.status_code == 200
+            assert "text/event-stream" in response.headers.get("content-type", "")
+            events = await collect_events(response)
+
+        after = await client.get("/metrics")
+
+    names = [name for name, _ in events]
+    assert names[0] == "meta"
+    assert names[-1] == "done"
+    assert events[0][1]["model_backend"] == "counting"
+    assert events[0][1]["cached"] is True
+    assert "".join(payload["text"] for name, payload in events if name == "delta") == "cached text"
+    assert adapter.calls == 1
+    assert adapter.stream_calls == 0
+    labels = [("endpoint", "stream"), ("outcome", "cache")]
+    assert scraped_metric_value(after.text, "gec_requests_total", labels) == (
+        scraped_metric_value(before.text, "gec_requests_total", labels) + 1
+    )
+    assert app.state.app_state.total_cache_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_headers():
+    setup_state(rate_limit_per_minute=2, rate_limit_per_day=10)
+    headers = {"x-forwarded-for": "3.3.3.3"}
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "hello"}, headers=headers)
+        assert first.headers["x-ratelimit-remaining"] == "1"
+
+        cached = await client.post("/v1/correct", json={"text": "hello"}, headers=headers)
+        assert cached.json()["meta"]["latency_ms"] == 0
+        assert cached.headers["x-ratelimit-remaining"] == "0"
+
+        blocked = await client.post("/v1/correct", json={"text": "hello"}, headers=headers)
+        assert blocked.status_code == 429
+        assert blocked.headers["x-ratelimit-remaining"] == "0"
+        assert int(blocked.headers["retry-after"]) >= 1
+
+        stream_blocked = await client.post(
+            "/v1/correct/stream", json={"text": "hello"}, headers=headers
+        )
+        assert stream_blocked.status_code == 429
+        assert int(stream_blocked.headers["retry-after"]) >= 1
+
+        async with client.stream(
+            "POST",
+            "/v1/correct/stream",
+            json={"text": "hello"},
+            headers={"x-forwarded-for": "4.4.4.4"},
+        ) as response:
+            assert response.headers["x-ratelimit-remaining"] == "1"
+            await collect_events(response)
+
+
+@pytest.mark.asyncio
+async def test_char_budget_limits_heavy_clients():
+    setup_state(rate_limit_per_minute=100, rate_limit_chars_per_minute=100)
+    heavy = {"x-forwarded-for": "4.4.4.4"}
+    light = {"x-forwarded-for": "5.5.5.5"}
+    async with make_client() as client:
+        first = await client.post("/v1/correct", json={"text": "a" * 40}, headers=heavy)
+        assert first.status_code == 200
+
+        blocked = await client.post("/v1/correct", json={"text": "b" * 40}, headers=heavy)
+        assert blocked.status_code == 429
+        assert blocked.json()["detail"]["message"] == "char_budget_exceeded"
+        assert int(blocked.headers["retry-after"]) >= 1
+
+        stream_blocked = await client.post(
+            "/v1/correct/stream", json={"text": "c" * 40}, headers=heavy
+        )
+        assert stream_blocked.status_code == 429
+
+        # Cache hits cost no upstream throughput and are not charged.
+        cached = await client.post("/v1/correct", json={"text": "a" * 40}, headers=heavy)
+        assert cached.status_code == 200
+
+        for index in range(5):
+            ok = await client.post("/v1/correct", json={"text": f"hi {index}"}, headers=light)
+            assert ok.status_code == 200
+
+
+class EndlessAdapter(ModelAdapter):
+    """Streams until closed, recording how far generation got."""
+
+    name = "endless"
+
+    def __init__(self):
+        self.produced = 0
+        self.closed = asyncio.Event()
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+        return text
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                self.produced += 1
+                yield f"{self.produced} "
+        finally:
+            self.closed.set()
+
+
+async def stream_until_disconnect(spec_version: str, deltas: int) -> int:
+    """Drive the ASGI app directly and drop the connection after ``deltas`` deltas."""
+    body = json.dumps({"text": "сәлам"}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v1/correct/stream",
+        "raw_path": b"/v1/correct/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("8.8.4.4", 1234),
+        "server": ("test", 80),
+    }
+    disconnected = asyncio.Event()
+    request_sent = False
+    received = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if disconnected.is_set():
+            raise OSError("connection closed")
+        if b"event: delta" in message.get("body", b""):
+            received += 1
+            if received >= deltas:
+                disconnected.set()
+
+    # ASGI 2.4 servers surface the broken connection as an exception.
+    with contextlib.suppress(Exception):
+        await app(scope, receive, send)
+    return received
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+async def test_stream_disconnect_stops_upstream(spec_version):
+    setup_state()
+    adapter = EndlessAdapter()
+    app.state.app_state.adapter = adapter
+
+    received = await stream_until_disconnect(spec_version, deltas=3)
+
+    await asyncio.wait_for(adapter.closed.wait(), timeout=1)
+    produced = adapter.produced
+    await asyncio.sleep(0.05)
+    assert received >= 3
+    assert adapter.produced == produced
+    status = app.state.app_state
+    assert status.total_streams_cancelled == 1
+    assert status.active_streams() == 0
+
+
+class StallingAdapter(ModelAdapter):
+    """Sends one delta (or answers) after ``first_delay``, then goes quiet."""
+
+    name = "stalling"
+
+    def __init__(self, first_delay: float = 0.0):
+        self.first_delay = first_delay
+        self.cancelled = asyncio.Event()
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        return text  # pragma: no cover
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        try:
+            await asyncio.sleep(self.first_delay)
+            yield "first "
+            await asyncio.sleep(3600)
+        finally:
+            self.cancelled.set()
+
+
+@pytest.mark.asyncio
+async def test_correct_deadline_returns_504_and_cancels_upstream():
+    setup_state()
+    adapter = StallingAdapter()
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        response = await client.post("/v1/correct", json={"text": "hello", "deadline_ms": 50})
+        assert response.status_code == 504
+        assert response.json()["detail"]["error"] == "timeout"
+        await asyncio.wait_for(adapter.cancelled.wait(), timeout=1)
+
+        status = await get_status(client)
+        assert status["timeouts_total"] == 1
+        metrics = await client.get("/metrics")
+        labels = [("endpoint", "correct"), ("kind", "deadline")]
+        assert scraped_metric_value(metrics.text, "gec_timeouts_total", labels) >= 1
+
+
+class DeadlineAwareAdapter(ModelAdapter):
+    """Takes ``delay``; fails at once, like a gRPC timeout, if the deadline is shorter."""
+
+    name = "deadline-aware"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self.deadlines: list[float | None] = []
+
+    async def _wait(self) -> None:
+        self.calls += 1
+        remaining = deadlines.remaining()
+        self.deadlines.append(remaining)
+        if remaining is not None and remaining < self.delay:
+            raise deadlines.DeadlineExceeded("deadline_exceeded")
+        await asyncio.sleep(self.delay)
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+        await self._wait()
+        return text.upper()
+
+    async def correct_stream(self, text: str, lang: str, request_id: str):  # noqa: ARG002
+        await self._wait()
+        yield text.upper()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/v1/correct", "/v1/correct/stream"])
+async def test_shared_call_is_rerun_for_a_caller_with_a_later_deadline(path):
+    setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000)
+    adapter = DeadlineAwareAdapter(0.2)
+    app.state.app_state.adapter = adapter
+    adapter.prefetch_first_delta = True
+    async with make_client() as client:
+
+        async def post(body: dict) -> tuple[int, str]:
+            response = await client.post(path, json={"text": "hello", **body})
+            if response.status_code != 200 or path == "/v1/correct":
+                return response.status_code, response.json().get("corrected_text", "")
+            events = await collect_events(response)
+            return 200, "".join(data["text"] for name, data in events if name == "delta")
+
+        impatient = asyncio.create_task(post({"deadline_ms": 50}))
+        await asyncio.sleep(0.01)
+        patient = asyncio.create_task(post({}))
+
+        assert (await impatient)[0] == 504
+        assert await patient == (200, "HELLO")
+    # The shared call ran under the first caller's 50 ms deadline, then once more
+    # under the server timeout for the caller that could still wait.
+    first, second = adapter.deadlines
+    assert first is not None and first <= 0.05
+    assert second is not None and 0.05 < second <= 60
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/v1/correct", "/v1/correct/stream"])
+async def test_client_deadline_reaches_the_adapter(path):
+    setup_state(rate_limit_per_minute=1000, rate_limit_per_day=1000)
+    adapter = DeadlineAwareAdapter(0)
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        response = await client.post(path, json={"text": "hello", "deadline_ms": 2000})
+        assert response.status_code == 200
+    assert adapter.deadlines[0] is not None and 1.5 < adapter.deadlines[0] <= 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("deadline", [0, -5, "10", 1.5, True])
+async def test_invalid_deadline_rejected(deadline):
+    setup_state()
+    async with make_client() as client:
+        for path in ("/v1/correct", "/v1/correct/stream"):
+            response = await client.post(path, json={"text": "hello", "deadline_ms": deadline})
+            assert response.status_code == 400
+            assert response.json()["detail"]["message"] == "invalid_deadline"
+
+
+@pytest.mark.asyncio
+async def test_client_deadline_cannot_extend_server_timeout():
+    setup_state(request_timeout_ms=50)
+    app.state.app_state.adapter = StallingAdapter()
+    async with make_client() as client:
+        response = await client.post("/v1/correct", json={"text": "hello", "deadline_ms": 600000})
+        assert response.status_code == 504
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("settings", "body", "message"),
+    [
+        ({"stream_stall_ms": 50}, {}, "upstream_stalled"),
+        ({"stream_stall_ms": 60000}, {"deadline_ms": 80}, "deadline_exceeded"),
+    ],
+)
+async def test_stream_timeout_emits_error_event(settings, body, message):
+    setup_state(heartbeat_ms=10, **settings)
+    adapter = StallingAdapter()
+    app.state.app_state.adapter = adapter
+    async with make_client() as client:
+        response = await client.post("/v1/correct/stream", json={"text": "hello", **body})
+        events = await collect_events(response)
+        assert [event for event, _ in events][-2:] == ["delta", "error"]
+        error = events[-1][1]
+        assert error["type"] == "timeout"
+        assert error["message"] == message
+        await asyncio.wait_for(adapter.cancelled.wait(), timeout=1)
+        assert (await get_status(client))["active_streams"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_stall_before_first_delta_returns_504():
+    setup_state(stream_stall_ms=50)
+    adapter = StallingAdapter(first_delay=3600)
+    adapter.prefetch_first_delta = True
+    app.state.app_state.adapter = adapter
+    labels = [("endpoint", "stream"), ("kind", "stall")]
+    async with make_client() as client:
+        before = scraped_metric_value(
+            (await client.get("/metrics")).text, "gec_timeouts_total", labels
+        )
+        response = await client.post("/v1/correct/stream", json={"text": "hello"})
+        assert response.status_code == 504
+        await asyncio.wait_for(adapter.cancelled.wait(), timeout=1)
+        assert (await get_status(client))["active_streams"] == 0
+        metrics = await client.get("/metrics")
+        assert scraped_metric_value(metrics.text, "gec_timeouts_total", labels) == before + 1
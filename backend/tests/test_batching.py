@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from backend import deadlines
+from backend.batching import MicroBatcher
+
+
+class Recorder:
+    def __init__(self, delay: float = 0.0, error: Exception | None = None):
+        self.batches: list[list[str]] = []
+        self.budgets: list[float | None] = []
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self, texts: list[str], lang: str) -> list[str]:
+        self.batches.append(texts)
+        self.budgets.append(deadlines.remaining())
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [f"{text.upper()}:{lang}" for text in texts]
+
+
+@pytest.mark.asyncio
+async def test_batches_concurrent_texts_per_language():
+    batcher = MicroBatcher(max_size=8, max_wait_s=0.01)
+    run = Recorder()
+
+    results = await asyncio.gather(
+        batcher.submit("a", "tt", run),
+        batcher.submit("b", "tt", run),
+        batcher.submit("c", "ru", run),
+    )
+
+    assert results == ["A:tt", "B:tt", "C:ru"]
+    assert sorted(run.batches) == [["a", "b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_sent_without_waiting():
+    batcher = MicroBatcher(max_size=2, max_wait_s=10)
+    run = Recorder()
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.submit(text, "tt", run) for text in "abcd")), timeout=1
+    )
+
+    assert results == ["A:tt", "B:tt", "C:tt", "D:tt"]
+    assert run.batches == [["a", "b"], ["c", "d"]]
+
+
+@pytest.mark.asyncio
+async def test_batch_error_reaches_every_waiter():
+    batcher = MicroBatcher(max_size=3, max_wait_s=0.005)
+    run = Recorder(error=RuntimeError("boom"))
+
+    results = await asyncio.gather(
+        *(batcher.submit(text, "tt", run) for text in "ab"), return_exceptions=True
+    )
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+@pytest.mark.asyncio
+async def test_waiter_that_left_is_dropped_from_batch():
+    batcher = MicroBatcher(max_size=8, max_wait_s=0.02)
+    run = Recorder()
+
+    impatient = asyncio.create_task(batcher.submit("a", "tt", run))
+    patient = asyncio.create_task(batcher.submit("b", "tt", run))
+    await asyncio.sleep(0)
+    impatient.cancel()
+
+    assert await patient == "B:tt"
+    assert run.batches == [["b"]]
+
+
+@pytest.mark.asyncio
+async def test_batch_gets_loosest_deadline_of_its_texts():
+    batcher = MicroBatcher(max_size=2, max_wait_s=1)
+    run = Recorder()
+
+    async def submit(text: str, seconds: float) -> str:
+        with deadlines.bind(seconds):
+            return await batcher.submit(text, "tt", run)
+
+    await asyncio.gather(submit("a", 1), submit("b", 30))
+    budget = run.budgets[0]
+    assert budget is not None and 1 < budget <= 30
+
+    await asyncio.gather(submit("a", 1), batcher.submit("b", "tt", run))
+    assert run.budgets[1] is None
+
+
+def test_accepts_only_short_texts():
+    batcher = MicroBatcher(max_text_chars=5)
+    assert batcher.accepts("short")
+    assert not batcher.accepts("longer")
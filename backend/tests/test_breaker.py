@@ -0,0 +1,128 @@
+import asyncio
+import random
+from collections.abc import AsyncGenerator
+
+import pytest
+
+from backend.breaker import CLOSED, HALF_OPEN, OPEN, BreakerAdapter, CircuitBreaker, RetryBudget
+from backend.models import AdapterOverloaded, AdapterUnavailable, ModelAdapter
+from backend.tests.helpers import FakeClock
+
+
+def test_breaker_opens_after_consecutive_failures_then_half_opens():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout_s=10, clock=clock)
+
+    breaker.failed()
+    breaker.failed()
+    breaker.succeeded()
+    breaker.failed()
+    breaker.failed()
+    assert breaker.state == CLOSED
+    breaker.failed()
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+    assert breaker.retry_after() == 10
+
+    clock.now = 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is True
+    # Only one trial call at a time.
+    assert breaker.allow() is False
+    breaker.succeeded()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot() == {"state": CLOSED, "failures": 0, "retry_after_s": 0.0}
+
+
+def test_failed_trial_reopens_and_abandoned_trial_frees_its_slot():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout_s=5, clock=clock)
+    breaker.failed()
+
+    clock.now = 5
+    assert breaker.allow() is True
+    breaker.abandoned()
+    assert breaker.allow() is True
+    breaker.failed()
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 5
+
+
+def test_retry_budget_caps_attempts_and_ratio():
+    budget = RetryBudget(ratio=0.5, max_attempts=2, max_tokens=1, rng=random.Random(1))
+
+    first = budget.next_delay(0)
+    assert first is not None and 0 <= first <= 0.1
+    assert budget.next_delay(2) is None
+    # The one token is spent; two more calls earn the next one.
+    assert budget.next_delay(0) is None
+    budget.earn()
+    assert budget.next_delay(0) is None
+    budget.earn()
+    assert budget.next_delay(0) is not None
+
+
+def test_retry_backoff_grows_with_full_jitter_and_respects_deadline():
+    budget = RetryBudget(base_delay_s=1, max_delay_s=3, max_attempts=10, rng=random.Random(7))
+    delays = []
+    for attempt, cap in enumerate((1, 2, 3, 3)):
+        delay = budget.next_delay(attempt)
+        assert delay is not None and 0 <= delay <= cap
+        delays.append(delay)
+    assert len(set(delays)) == 4
+
+    assert budget.next_delay(0, time_left=0.0) is None
+
+
+class FlakyAdapter(ModelAdapter):
+    name = "flaky"
+
+    def __init__(self):
+        self.error: BaseException | None = RuntimeError("down")
+        self.calls = 0
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return text
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        yield await self.correct(text, lang, request_id)
+
+
+@pytest.mark.asyncio
+async def test_breaker_adapter_fails_fast_while_open():
+    clock = FakeClock()
+    inner = FlakyAdapter()
+    adapter = BreakerAdapter(inner, CircuitBreaker("adapter", 2, 30, clock=clock))
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await adapter.correct("a", "tt", "rid")
+    with pytest.raises(AdapterUnavailable) as info:
+        await adapter.correct("a", "tt", "rid")
+    assert info.value.retry_after == 30
+    assert inner.calls == 2
+    assert adapter.circuit_breakers()["adapter"]["state"] == OPEN
+
+    clock.now = 30
+    inner.error = None
+    assert [delta async for delta in adapter.correct_stream("b", "tt", "rid")] == ["b"]
+    assert adapter.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_breaker_adapter_ignores_quota_and_cancellation():
+    inner = FlakyAdapter()
+    inner.error = AdapterOverloaded("quota")
+    adapter = BreakerAdapter(inner, CircuitBreaker("adapter", 1))
+
+    with pytest.raises(AdapterOverloaded):
+        await adapter.correct("a", "tt", "rid")
+    inner.error = asyncio.CancelledError()
+    with pytest.raises(asyncio.CancelledError):
+        await adapter.correct("a", "tt", "rid")
+    assert adapter.breaker.state == CLOSED
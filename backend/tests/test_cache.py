@@ -1,6 +1,17 @@
+import json
+import multiprocessing
 import time
 
-from backend.cache import SimpleCache
+from backend.cache import (
+    BoundedCache,
+    CacheEntry,
+    SimpleCache,
+    SqliteCache,
+    build_cache,
+    entry_size,
+)
+from backend.settings import Settings
+from backend.tests.helpers import cache_worker
 
 
 def test_cache_expires():
@@ -11,3 +22,204 @@ def test_cache_expires():
     assert entry.value == "value"
     time.sleep(0.01)
     assert cache.get("key") is None
+
+
+def test_bounded_cache_respects_byte_budget():
+    cache = BoundedCache(ttl_ms=60000, max_bytes=entry_size("k0", "x" * 100, "mock") * 3)
+    for i in range(10):
+        cache.set(f"k{i}", "x" * 100, "mock")
+
+    assert len(cache) == 3
+    assert cache.used_bytes <= cache.max_bytes
+    assert cache.get("k9") is not None
+    assert cache.get("k0") is None
+
+
+def test_bounded_cache_rejects_oversized_value():
+    cache = BoundedCache(ttl_ms=60000, max_bytes=64)
+    cache.set("key", "x" * 1000, "mock")
+
+    assert cache.get("key") is None
+    assert cache.used_bytes == 0
+
+
+def test_bounded_cache_admission_keeps_popular_entries():
+    cache = BoundedCache(ttl_ms=60000, max_bytes=entry_size("hot", "v", "mock") * 2)
+    cache.set("hot", "v", "mock")
+    for _ in range(5):
+        assert cache.get("hot") is not None
+
+    for i in range(20):
+        key = f"one-off-{i:02d}"
+        cache.get(key)
+        cache.set(key, "v", "mock")
+
+    assert cache.get("hot") is not None
+
+
+def test_bounded_cache_replacing_a_key_is_never_rejected():
+    cache = BoundedCache(ttl_ms=60000, max_bytes=entry_size("hot", "v", "mock") * 2)
+    cache.set("hot", "v", "mock")
+    cache.set("new", "v", "mock")
+    for _ in range(5):
+        assert cache.get("hot") is not None
+
+    # Needs the hot entry's room; admission would refuse, losing the old value too.
+    cache.set("new", "vv", "mock")
+
+    entry = cache.get("new")
+    assert entry is not None and entry.value == "vv"
+    assert cache.get("hot") is None
+
+
+def test_bounded_cache_sweep_removes_expired():
+    cache = BoundedCache(ttl_ms=1, max_bytes=10_000)
+    cache.set("a", "value", "mock")
+    cache.set("b", "value", "mock")
+    time.sleep(0.01)
+
+    assert cache.sweep() == 2
+    assert len(cache) == 0
+    assert cache.used_bytes == 0
+
+
+def test_bounded_cache_background_sweeper():
+    cache = BoundedCache(ttl_ms=1, max_bytes=10_000)
+    cache.set("a", "value", "mock")
+    cache.start_sweeper(0.01)
+    try:
+        deadline = time.time() + 1
+        while len(cache) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(cache) == 0
+    finally:
+        cache.close()
+
+
+def test_sqlite_cache_roundtrip_and_expiry(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), ttl_ms=200, max_bytes=100_000)
+    cache.set("key", "value", "mock")
+    entry = cache.get("key")
+    assert entry is not None
+    assert entry.value == "value"
+    assert entry.backend == "mock"
+    time.sleep(0.25)
+    assert cache.get("key") is None
+    cache.close()
+
+
+def test_sqlite_cache_respects_byte_budget(tmp_path):
+    limit = entry_size("k0", "x" * 100, "mock") * 3
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), ttl_ms=60000, max_bytes=limit)
+    for i in range(10):
+        cache.set(f"k{i}", "x" * 100, "mock")
+        cache.get(f"k{i}")
+
+    assert cache.used_bytes <= limit
+    assert cache.get("k9") is not None
+    assert cache.get("k0") is None
+    cache.close()
+
+
+def test_sqlite_cache_shared_between_worker_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+
+    writer = ctx.Process(target=cache_worker, args=(path, "shared", "cached text", results))
+    writer.start()
+    writer.join(timeout=30)
+    assert writer.exitcode == 0
+    writer_pid, written = results.get(timeout=5)
+    assert written == "cached text"
+
+    readers = [
+        ctx.Process(target=cache_worker, args=(path, "shared", None, results)) for _ in range(3)
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join(timeout=30)
+        assert reader.exitcode == 0
+    seen = [results.get(timeout=5) for _ in readers]
+
+    assert all(pid != writer_pid for pid, _ in seen)
+    assert [value for _, value in seen] == ["cached text"] * 3
+
+
+def test_build_cache_selects_backend(tmp_path):
+    memory = build_cache(Settings(cache_backend="memory"))
+    assert isinstance(memory, BoundedCache)
+
+    shared = build_cache(Settings(cache_backend="sqlite", cache_path=str(tmp_path / "c.db")))
+    assert isinstance(shared, SqliteCache)
+    shared.close()
+
+
+def test_bounded_cache_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "snapshot.jsonl")
+    cache = BoundedCache(ttl_ms=60000, max_bytes=100_000)
+    cache.set("a", "\u04d9\u04af\u04e9", "gemini")
+    cache.set("b", "value", "mock")
+    assert cache.save_snapshot(path) == 2
+
+    restored = BoundedCache(ttl_ms=60000, max_bytes=100_000)
+    assert restored.load_snapshot(path) == 2
+    entry = restored.get("a")
+    assert entry is not None
+    assert entry.value == "\u04d9\u04af\u04e9"
+    assert entry.backend == "gemini"
+    assert restored.used_bytes == cache.used_bytes
+
+
+def test_bounded_cache_snapshot_skips_expired(tmp_path):
+    path = str(tmp_path / "snapshot.jsonl")
+    cache = BoundedCache(ttl_ms=1, max_bytes=100_000)
+    cache.set("a", "value", "mock")
+    cache.save_snapshot(path)
+    time.sleep(0.01)
+
+    restored = BoundedCache(ttl_ms=60000, max_bytes=100_000)
+    assert restored.load_snapshot(path) == 0
+    assert restored.load_snapshot(str(tmp_path / "missing.jsonl")) == 0
+
+
+def test_bounded_cache_snapshot_decompresses_outside_the_lock(tmp_path, monkeypatch):
+    cache = BoundedCache(ttl_ms=60000, max_bytes=100_000, compress_min_bytes=16)
+    cache.set("a", "\u04d9" * 200, "gemini")
+    decode = vars(CacheEntry)["json_value"].fget
+    locked: list[bool] = []
+
+    def json_value(entry: CacheEntry) -> bytes:
+        locked.append(cache._lock.locked())
+        return decode(entry)
+
+    monkeypatch.setattr(CacheEntry, "json_value", property(json_value))
+    assert cache.save_snapshot(str(tmp_path / "snapshot.jsonl")) == 1
+    assert locked == [False]
+
+
+def test_cache_entry_is_slotted_and_compresses_large_values():
+    text = "Бу җөмлә кабатлана. " * 200
+    entry = CacheEntry(text, "gemini", 0.0, compress_min_bytes=1024)
+
+    assert not hasattr(entry, "__dict__")
+    assert entry.value == text
+    assert json.loads(entry.json_value) == text
+    assert entry.payload_bytes < len(text.encode("utf-8")) // 4
+
+    small = CacheEntry("кыска", "gemini", 0.0, compress_min_bytes=1024)
+    assert small.json_value == '"кыска"'.encode()
+
+
+def test_bounded_cache_charges_compressed_size():
+    text = "Бу җөмлә кабатлана. " * 200
+    plain = BoundedCache(ttl_ms=60000, max_bytes=1_000_000)
+    packed = BoundedCache(ttl_ms=60000, max_bytes=1_000_000, compress_min_bytes=1024)
+    plain.set("key", text, "gemini")
+    packed.set("key", text, "gemini")
+
+    assert packed.used_bytes < plain.used_bytes // 4
+    entry = packed.get("key")
+    assert entry is not None
+    assert entry.value == text
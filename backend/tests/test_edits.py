@@ -0,0 +1,88 @@
+import difflib
+import json
+import random
+
+from backend.edits import Edit, apply_edits, parse_edits
+
+TEXT = "Мин бүген мәктәпкә барам. Мин китап укыйм."
+
+
+def diff_edits(before: str, after: str) -> list[dict[str, object]]:
+    """The edit list a model would answer with to turn ``before`` into ``after``."""
+    matcher = difflib.SequenceMatcher(None, before, after, autojunk=False)
+    edits: list[dict[str, object]] = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        if i1 == i2:
+            # An insertion carries a neighbouring character, as ``original`` is never empty.
+            if i1:
+                i1, j1 = i1 - 1, j1 - 1
+            else:
+                i2, j2 = i2 + 1, j2 + 1
+        edits.append({"start": i1, "original": before[i1:i2], "replacement": after[j1:j2]})
+    return edits
+
+
+def test_parse_edits_reads_plain_and_fenced_json():
+    answer = '{"edits": [{"start": 4, "original": "бүген", "replacement": "иртәгә"}]}'
+    assert parse_edits(answer) == [Edit(4, "бүген", "иртәгә")]
+    assert parse_edits(f"```json\n{answer}\n```") == [Edit(4, "бүген", "иртәгә")]
+    assert parse_edits('{"edits": []}') == []
+
+
+def test_parse_edits_rejects_malformed_output():
+    for output in (
+        "Мин бүген мәктәпкә барам.",
+        '{"edits": [{"start": 4, "original": "бүген"',
+        '["бүген"]',
+        '{"edits": {"start": 4}}',
+        '{"edits": [{"start": "4", "original": "бүген", "replacement": ""}]}',
+        '{"edits": [{"start": -1, "original": "бүген", "replacement": ""}]}',
+        '{"edits": [{"start": 4, "original": "", "replacement": "бик "}]}',
+        '{"edits": [{"start": 4, "original": "бүген"}]}',
+        '{"edits": [4]}',
+    ):
+        assert parse_edits(output) is None, output
+
+
+def test_apply_edits_checks_each_original_against_the_text():
+    assert apply_edits(TEXT, []) == TEXT
+    assert (
+        apply_edits(TEXT, [Edit(4, "бүген", "иртәгә"), Edit(0, "Мин", "Без")])
+        == "Без иртәгә мәктәпкә барам. Мин китап укыйм."
+    )
+    # A miscounted offset moves to an occurrence of the original that is unique in
+    # the text, or unique near the offset.
+    assert apply_edits(TEXT, [Edit(30, "китап", "дәфтәр")]) == (
+        "Мин бүген мәктәпкә барам. Мин дәфтәр укыйм."
+    )
+    long_text = TEXT + " Бу" * 20 + " Мин укыйм."
+    assert apply_edits(long_text, [Edit(len(long_text) - 13, "Мин", "Ә мин")]) == (
+        TEXT + " Бу" * 20 + " Ә мин укыйм."
+    )
+    # Ambiguous: both "Мин" of TEXT are within the window of this offset, and the
+    # offset is far from every "Мин" of the long text.
+    assert apply_edits(TEXT, [Edit(12, "Мин", "Без")]) is None
+    assert apply_edits(long_text, [Edit(60, "Мин", "Без")]) is None
+    assert apply_edits(TEXT, [Edit(4, "кичә", "бүген")]) is None
+    assert apply_edits(TEXT, [Edit(4, "бүген мәктәпкә", "x"), Edit(10, "мәктәпкә", "y")]) is None
+
+
+def test_diffed_edits_round_trip():
+    rng = random.Random(7)
+    for _ in range(50):
+        chars = list(TEXT)
+        for _ in range(rng.randint(1, 4)):
+            index = rng.randrange(len(chars) + 1)
+            choice = rng.random()
+            if choice < 0.3 and index < len(chars):
+                del chars[index]
+            elif choice < 0.6:
+                chars.insert(index, rng.choice("әөүҗңһ ,"))
+            elif index < len(chars):
+                chars[index] = rng.choice("әөүҗңһ")
+        corrected = "".join(chars)
+        edits = parse_edits(json.dumps({"edits": diff_edits(TEXT, corrected)}))
+        assert edits is not None
+        assert apply_edits(TEXT, edits) == corrected
@@ -0,0 +1,84 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from backend.breaker import RetryBudget
+from backend.fake_gemini import FakeGemini, FakeGeminiConfig, serve
+from backend.gemini import GeminiAdapter, GeminiKeyExhausted, GeminiKeyPool, retry_delay
+
+
+async def start(keys: list[str], **config) -> tuple[GeminiAdapter, FakeGemini]:
+    fake = FakeGemini(FakeGeminiConfig(latency_ms=0, seed=1, **config))
+    server, port = await serve(fake)
+    pool = GeminiKeyPool(keys, max_wait_s=0, failure_threshold=0)
+    adapter = GeminiAdapter(
+        keys,
+        "gemini-test",
+        pool=pool,
+        retries=RetryBudget(max_attempts=0),
+        endpoint=f"127.0.0.1:{port}",
+    )
+    adapter.fake_server = server  # type: ignore[attr-defined]
+    return adapter, fake
+
+
+@pytest.fixture
+async def running():
+    adapters: list[GeminiAdapter] = []
+
+    async def factory(keys: list[str], **config) -> tuple[GeminiAdapter, FakeGemini]:
+        adapter, fake = await start(keys, **config)
+        adapters.append(adapter)
+        return adapter, fake
+
+    yield factory
+    for adapter in adapters:
+        await adapter.fake_server.stop(None)  # type: ignore[attr-defined]
+
+
+@pytest.mark.asyncio
+async def test_real_adapter_round_trip(running):
+    adapter, fake = await running(["k1"], chunk_chars=4)
+
+    assert await adapter.correct("сәлам дөнья", "tt", "rid") == "сәлам дөнья"
+    chunks = [chunk async for chunk in adapter.correct_stream("исәнме дус", "tt", "rid")]
+    assert chunks == ["исән", "ме д", "ус"]
+    assert fake.stats["ok"] == 2
+
+
+@pytest.mark.asyncio
+async def test_per_key_rpm_returns_429_with_retry_delay(running):
+    adapter, fake = await running(["k1", "k2"], rpm=1)
+
+    assert await adapter.correct("a", "tt", "rid") == "a"
+    assert await adapter.correct("b", "tt", "rid") == "b"
+    with pytest.raises(GeminiKeyExhausted) as info:
+        await adapter.correct("c", "tt", "rid")
+    cause = info.value.__cause__
+    assert isinstance(cause, google_exceptions.ResourceExhausted)
+    delay = retry_delay(cause)
+    assert delay is not None and 59 < delay <= 60
+    assert fake.stats["rate_limited"] == 2
+
+
+@pytest.mark.asyncio
+async def test_empty_response_and_unavailable(running):
+    adapter, _ = await running(["k1"], empty_rate=1.0)
+    with pytest.raises(RuntimeError, match="empty"):
+        await adapter.correct("a", "tt", "rid")
+
+    adapter, fake = await running(["k1"], unavailable_rate=1.0)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        await adapter.correct("a", "tt", "rid")
+    assert fake.stats["unavailable"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_fails_mid_way(running):
+    adapter, fake = await running(["k1"], chunk_chars=2, stream_failure_rate=1.0)
+
+    received: list[str] = []
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        async for chunk in adapter.correct_stream("abcdef", "tt", "rid"):
+            received.append(chunk)
+    assert received == ["ab"]
+    assert fake.stats["stream_failed"] == 1
@@ -0,0 +1,119 @@
+import asyncio
+from collections.abc import AsyncGenerator
+
+import pytest
+
+from backend import deadlines
+from backend.fallback import FallbackAdapter
+from backend.models import AdapterOverloaded, AdapterUnavailable, Correction, ModelAdapter
+
+
+class TierAdapter(ModelAdapter):
+    def __init__(self, name: str, error: Exception | None = None, delay: float = 0.0):
+        self.name = name
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return f"{text}:{self.name}"
+
+    async def correct_stream(
+        self, text: str, lang: str, request_id: str
+    ) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        yield text
+        yield f":{self.name}"
+
+
+@pytest.mark.asyncio
+async def test_quota_and_open_breaker_fail_over_to_next_backend():
+    primary = TierAdapter("gemini", AdapterOverloaded("quota"))
+    secondary = TierAdapter("prompt", AdapterUnavailable("open", retry_after=5))
+    adapter = FallbackAdapter([primary, secondary, TierAdapter("local")], 1000, 1.0)
+
+    result = await adapter.correct("a", "tt", "rid")
+
+    assert result == "a:local"
+    assert isinstance(result, Correction) and result.backend == "local"
+    assert adapter.name == "gemini,prompt,local"
+    assert (primary.calls, secondary.calls) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_last_backend_error_is_raised():
+    adapter = FallbackAdapter(
+        [
+            TierAdapter("gemini", AdapterOverloaded("quota")),
+            TierAdapter("local", RuntimeError("x")),
+        ],
+        1000,
+        1.0,
+    )
+    with pytest.raises(RuntimeError):
+        await adapter.correct("a", "tt", "rid")
+
+
+@pytest.mark.asyncio
+async def test_other_errors_do_not_fail_over():
+    local = TierAdapter("local")
+    adapter = FallbackAdapter([TierAdapter("gemini", ValueError("bad")), local], 1000, 1.0)
+    with pytest.raises(ValueError):
+        await adapter.correct("a", "tt", "rid")
+    assert local.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_leaves_reserve_for_fallback():
+    slow = TierAdapter("gemini", delay=5)
+    adapter = FallbackAdapter([slow, TierAdapter("local")], 1000, reserve_s=0.2)
+
+    with deadlines.bind(0.3):
+        result = await asyncio.wait_for(adapter.correct("a", "tt", "rid"), timeout=1)
+    assert result.backend == "local"  # type: ignore[attr-defined]
+
+    # Without enough time left for the primary, it is skipped outright.
+    with deadlines.bind(0.1):
+        result = await adapter.correct("b", "tt", "rid")
+    assert result == "b:local"
+    assert slow.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_fails_over_only_before_first_delta():
+    adapter = FallbackAdapter(
+        [TierAdapter("gemini", AdapterOverloaded("quota")), TierAdapter("local")], 1000, 1.0
+    )
+    deltas = [delta async for delta in adapter.correct_stream("a", "tt", "rid")]
+    assert deltas == ["a", ":local"]
+    assert all(isinstance(delta, Correction) and delta.backend == "local" for delta in deltas)
+
+    class BreaksMidStream(TierAdapter):
+        async def correct_stream(
+            self, text: str, lang: str, request_id: str
+        ) -> AsyncGenerator[str, None]:
+            yield text
+            raise AdapterOverloaded("quota")
+
+    local = TierAdapter("local")
+    adapter = FallbackAdapter([BreaksMidStream("gemini"), local], 1000, 1.0)
+    received: list[str] = []
+    with pytest.raises(AdapterOverloaded):
+        async for delta in adapter.correct_stream("a", "tt", "rid"):
+            received.append(delta)
+    assert received == ["a"]
+    assert local.calls == 0
+
+
+def test_lower_tiers_get_the_fallback_cache_ttl():
+    adapter = FallbackAdapter([TierAdapter("gemini"), TierAdapter("local")], 1000, 1.0)
+    assert adapter.cache_ttl_ms("gemini") is None
+    assert adapter.cache_ttl_ms("local") == 1000
+    assert adapter.cache_ttl_ms("gemini+local") == 1000
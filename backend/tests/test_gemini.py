@@ -1,32 +1,145 @@
+import asyncio
+import re
+import threading
+
+import google.ai.generativelanguage as glm
 import pytest
 from google.api_core import exceptions as google_exceptions
+from google.protobuf import duration_pb2
+from google.rpc import error_details_pb2
+
+from backend import deadlines
+from backend.adaptive import AdaptiveLimiter
+from backend.batching import MicroBatcher
+from backend.breaker import RetryBudget
+from backend.deadlines import DeadlineExceeded
+from backend.gemini import (
+    GeminiAdapter,
+    GeminiClientPool,
+    GeminiKeyExhausted,
+    GeminiKeyPool,
+    Prompt,
+    avoided_chunks,
+    build_batch_prompt,
+    build_edit_prompt,
+    build_prompt,
+    build_request,
+    retry_delay,
+    split_batch,
+)
+from backend.hedging import HedgePolicy
+from backend.models import AdapterOverloaded, AdapterUnavailable
+from backend.tests.helpers import FakeClock, metric_value
+
+
+@pytest.mark.asyncio
+async def test_key_pool_spreads_load_and_cools_down():
+    clock = FakeClock()
+    pool = GeminiKeyPool(["k1", "k2", "k3"], cooldown_s=30, max_wait_s=0, clock=clock)
+
+    # Calls in flight go to the least-loaded key.
+    assert [await pool.acquire() for _ in range(3)] == ["k1", "k2", "k3"]
+    pool.release("k2")
+    assert await pool.acquire() == "k2"
+
+    assert pool.cooldown("k1") is False
+    assert pool.cooldown("k2", retry_after=5) is False
+    assert pool.cooldown("k3") is True
+
+    # Exhausted keys are not retried until their cooldown ends.
+    with pytest.raises(GeminiKeyExhausted):
+        await pool.acquire()
+
+    # k2's server-provided delay is shorter; it comes back with a single probe.
+    clock.now = 5.0
+    assert await pool.acquire() == "k2"
+    with pytest.raises(GeminiKeyExhausted):
+        await pool.acquire()
+    pool.release("k2")
+    assert [await pool.acquire() for _ in range(2)] == ["k2", "k2"]
+
+    # A failed probe doubles the cooldown.
+    clock.now = 30.0
+    assert await pool.acquire() == "k1"
+    pool.cooldown("k1")
+    clock.now = 89.0
+    assert "k1" not in {await pool.acquire() for _ in range(3)}
+    clock.now = 90.0
+    assert await pool.acquire() == "k1"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_429s_on_a_key_count_as_one_strike():
+    clock = FakeClock()
+    pool = GeminiKeyPool(["k1", "k2"], cooldown_s=60, max_wait_s=0, clock=clock)
+    keys = [await pool.acquire() for _ in range(8)]
+    assert keys.count("k1") == 4
+
+    # All four calls on k1 hit the same quota event.
+    for _ in range(4):
+        pool.cooldown("k1")
+    clock.now = 59.0
+    assert "k1" not in {await pool.acquire() for _ in range(3)}
+    clock.now = 60.0
+    assert await pool.acquire() == "k1"
+
+    # The probe fails too: that is a second episode, and the cooldown doubles.
+    pool.cooldown("k1")
+    clock.now = 179.0
+    assert "k1" not in {await pool.acquire() for _ in range(3)}
+    clock.now = 180.0
+    assert await pool.acquire() == "k1"
+
+
+@pytest.mark.asyncio
+async def test_key_pool_enforces_rpm_and_concurrency():
+    clock = FakeClock()
+    pool = GeminiKeyPool(["k1", "k2"], rpm=2, concurrency=1, max_wait_s=0, clock=clock)
 
-from backend.gemini import GeminiAdapter, GeminiKeyExhausted, GeminiKeyPool, build_prompt
+    assert {await pool.acquire(), await pool.acquire()} == {"k1", "k2"}
+    with pytest.raises(GeminiKeyExhausted, match="busy"):
+        await pool.acquire()
+    pool.release("k1")
+    pool.release("k2")
+    assert {await pool.acquire(), await pool.acquire()} == {"k1", "k2"}
+    pool.release("k1")
+    pool.release("k2")
+
+    # Both keys have used their two requests for this minute.
+    with pytest.raises(GeminiKeyExhausted, match="busy"):
+        await pool.acquire()
+    clock.now = 60.0
+    assert await pool.acquire() in {"k1", "k2"}
 
 
 @pytest.mark.asyncio
-async def test_key_pool_cycles_and_resets():
-    pool = GeminiKeyPool(["k1", "k2", "k3"])
+async def test_key_pool_waits_for_a_free_key():
+    pool = GeminiKeyPool(["k1"], concurrency=1, max_wait_s=1)
+    assert await pool.acquire() == "k1"
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    pool.release("k1")
+    assert await asyncio.wait_for(waiter, timeout=1) == "k1"
 
-    assert await pool.pick_key() == "k1"
-    assert await pool.mark_exhausted("k1") is False
-    assert await pool.pick_key() == "k2"
-    assert await pool.mark_exhausted("k2") is False
-    assert await pool.pick_key() == "k3"
-    assert await pool.mark_exhausted("k3") is True
 
-    # After all keys are exhausted, the pool resets.
-    assert await pool.pick_key() == "k1"
+def test_retry_delay_from_error():
+    info = error_details_pb2.RetryInfo(
+        retry_delay=duration_pb2.Duration(seconds=7, nanos=5 * 10**8)
+    )
+    assert retry_delay(google_exceptions.TooManyRequests("quota", details=[info])) == 7.5
+    message = "Quota exceeded. Please retry in 37.386s."
+    assert retry_delay(google_exceptions.ResourceExhausted(message)) == 37.386
+    assert retry_delay(google_exceptions.ResourceExhausted("quota")) is None
 
 
 @pytest.mark.asyncio
 async def test_key_pool_requires_keys():
     pool = GeminiKeyPool([])
-
     assert pool.has_keys() is False
     assert pool.key_count() == 0
     with pytest.raises(GeminiKeyExhausted):
-        await pool.pick_key()
+        await pool.acquire()
 
 
 class StubGeminiAdapter(GeminiAdapter):
@@ -36,19 +149,19 @@ class StubGeminiAdapter(GeminiAdapter):
         self._errors = errors
 
     async def correct(self, text: str, lang: str, request_id: str) -> str:
-        prompt = build_prompt(text, lang, request_id)
+        prompt = build_prompt(text, lang)
 
         async def call(key: str) -> str:
             return self._generate_text(key, prompt)
 
         return await self._with_key(call)
 
-    def _generate_text(self, key: str, prompt: str) -> str:  # noqa: ARG002
+    def _generate_text(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
         if key in self._errors:
             raise self._errors[key]
         return self._responses[key]
 
-    async def _stream_once(self, key: str, prompt: str):  # noqa: ARG002
+    async def _stream_once(self, key: str, prompt: Prompt):  # noqa: ARG002
         if key in self._errors:
             raise self._errors[key]
         yield self._responses[key]
@@ -105,3 +218,460 @@ async def test_stream_raises_when_all_keys_exhausted():
     with pytest.raises(GeminiKeyExhausted):
         async for _ in adapter.correct_stream("hello", "tt", "rid"):
             pass
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeCall:
+    """A streaming RPC: yields response protos until exhausted or cancelled."""
+
+    def __init__(self, chunks: list[str] | None):
+        self.chunks = chunks
+        self.reads = 0
+        self.cancelled = False
+
+    def __aiter__(self):
+        return self._read()
+
+    async def _read(self):
+        while not self.cancelled and (self.chunks is None or self.reads < len(self.chunks)):
+            text = self.chunks[self.reads] if self.chunks is not None else f"{self.reads} "
+            self.reads += 1
+            await asyncio.sleep(0.005)
+            yield glm.GenerateContentResponse(
+                candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)]))]
+            )
+
+    def cancel(self) -> bool:
+        self.cancelled = True
+        return True
+
+
+class FakeModel:
+    """Stands in for the async gapic client, recording concurrency.
+
+    ``chunks=None`` streams forever, like a generation that is never finished.
+    """
+
+    def __init__(self, chunks: list[str] | None):
+        self.chunks = chunks
+        self.calls: list[FakeCall] = []
+        self.active = 0
+        self.peak = 0
+        self.timeouts: list[float | None] = []
+
+    async def generate_content(
+        self, request: glm.GenerateContentRequest, retry=0, timeout: float | None = None
+    ):
+        assert request.model == "models/test-model"
+        assert request.system_instruction.parts[0].text
+        assert retry is None
+        self.timeouts.append(timeout)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.active -= 1
+        return FakeResponse("".join(self.chunks or []))
+
+    async def stream_generate_content(
+        self, request: glm.GenerateContentRequest, retry=0, timeout: float | None = None
+    ) -> FakeCall:
+        assert request.contents[0].parts[0].text
+        assert retry is None
+        self.timeouts.append(timeout)
+        call = FakeCall(self.chunks)
+        self.calls.append(call)
+        return call
+
+
+def make_async_adapter(model: FakeModel, max_concurrency: int) -> GeminiAdapter:
+    adapter = GeminiAdapter(["k1"], model="test-model", max_concurrency=max_concurrency)
+    adapter._clients = GeminiClientPool("test-model", factory=lambda key: model)  # noqa: ARG005
+    return adapter
+
+
+@pytest.mark.asyncio
+async def test_adapter_uses_async_api_without_threads():
+    model = FakeModel(["Сәлам, ", "дөнья!"])
+    adapter = make_async_adapter(model, max_concurrency=3)
+    threads = threading.active_count()
+
+    results = await asyncio.gather(*(adapter.correct("x", "tt", "rid") for _ in range(10)))
+    assert results == ["Сәлам, дөнья!"] * 10
+    assert model.peak == 3
+
+    chunks = [chunk async for chunk in adapter.correct_stream("x", "tt", "rid")]
+    assert chunks == ["Сәлам, ", "дөнья!"]
+    assert threading.active_count() == threads
+
+
+@pytest.mark.asyncio
+async def test_request_deadline_becomes_grpc_timeout():
+    model = FakeModel(["ok"])
+    adapter = make_async_adapter(model, max_concurrency=1)
+
+    await adapter.correct("x", "tt", "rid")
+    with deadlines.bind(5):
+        await adapter.correct("x", "tt", "rid")
+        assert [chunk async for chunk in adapter.correct_stream("x", "tt", "rid")] == ["ok"]
+    with deadlines.bind(0), pytest.raises(DeadlineExceeded):
+        await adapter.correct("x", "tt", "rid")
+
+    assert model.timeouts[0] is None
+    assert all(timeout is not None and 0 < timeout <= 5 for timeout in model.timeouts[1:])
+    assert len(model.timeouts) == 3
+
+
+@pytest.mark.asyncio
+async def test_closing_stream_cancels_upstream_call():
+    model = FakeModel(None)
+    adapter = make_async_adapter(model, max_concurrency=1)
+    cancelled = metric_value("gec_upstream_streams_cancelled_total")
+    avoided = metric_value("gec_upstream_chunks_avoided_total")
+
+    stream = adapter.correct_stream("x" * 100, "tt", "rid")
+    received = [await stream.__anext__() for _ in range(3)]
+    await stream.aclose()
+
+    call = model.calls[0]
+    assert call.cancelled is True
+    reads = call.reads
+    await asyncio.sleep(0.05)
+    assert call.reads == reads
+    assert "".join(received) == "0 1 2 "
+    assert metric_value("gec_upstream_streams_cancelled_total") == cancelled + 1
+    # 94 characters still expected at 2 characters per chunk.
+    assert metric_value("gec_upstream_chunks_avoided_total") == avoided + 47
+    # The upstream slot is released for the next call.
+    assert adapter._limiter.in_flight == 0
+
+
+def test_avoided_chunks_estimate():
+    assert avoided_chunks(expected_chars=100, emitted_chars=100, chunks=4) == 0
+    assert avoided_chunks(expected_chars=100, emitted_chars=20, chunks=2) == 8
+    assert avoided_chunks(expected_chars=128, emitted_chars=0, chunks=0) == 2
+
+
+@pytest.mark.asyncio
+async def test_client_pool_builds_each_key_once():
+    built: list[str] = []
+
+    def factory(key: str) -> object:
+        built.append(key)
+        return object()
+
+    pool = GeminiClientPool("test-model", factory=factory)
+
+    async def get(key: str) -> object:
+        await asyncio.sleep(0)
+        return pool.get(key)
+
+    models = await asyncio.gather(*(get(key) for key in ["k1", "k2"] * 25))
+
+    assert sorted(built) == ["k1", "k2"]
+    assert len(pool) == 2
+    assert all(model is models[0] for model in models[::2])
+    assert models[0] is not models[1]
+
+
+@pytest.mark.asyncio
+async def test_client_pool_gives_each_key_its_own_client():
+    pool = GeminiClientPool("test-model")
+    first = pool.get("k1")
+    second = pool.get("k2")
+    assert isinstance(first.service, glm.GenerativeServiceAsyncClient)
+    assert first.model == second.model == "models/test-model"
+    assert first.service is not second.service
+    assert pool.get("k1").service is first.service
+
+
+class DelayedAdapter(GeminiAdapter):
+    """Answers with the key's name after a per-key delay."""
+
+    def __init__(self, delays: dict[str, float], hedging: HedgePolicy):
+        super().__init__(list(delays), model="test-model", hedging=hedging)
+        self.delays = delays
+        self.cancelled: list[str] = []
+
+    async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+        try:
+            await asyncio.sleep(self.delays[key])
+        except asyncio.CancelledError:
+            self.cancelled.append(key)
+            raise
+        return key
+
+
+def warmed_policy(seconds: float, **options) -> HedgePolicy:
+    policy = HedgePolicy(min_samples=1, **options)
+    policy.record(seconds)
+    return policy
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_over_slow_key_and_cancels_it():
+    adapter = DelayedAdapter({"slow": 1.0, "fast": 0.01}, warmed_policy(0.02, budget=1.0))
+    fired = metric_value("gec_hedges_fired_total")
+    won = metric_value("gec_hedges_won_total")
+
+    assert await asyncio.wait_for(adapter.correct("x", "tt", "rid"), timeout=0.5) == "fast"
+    assert adapter.cancelled == ["slow"]
+    assert metric_value("gec_hedges_fired_total") == fired + 1
+    assert metric_value("gec_hedges_won_total") == won + 1
+    assert all(slot.in_flight == 0 for slot in adapter._pool._slots)
+
+
+@pytest.mark.asyncio
+async def test_hedge_respects_budget():
+    policy = warmed_policy(0.01, budget=0.0)
+    adapter = DelayedAdapter({"slow": 0.05, "fast": 0.01}, policy)
+    skipped = metric_value("gec_hedges_skipped_total", {"reason": "budget"})
+
+    assert await adapter.correct("x", "tt", "rid") == "slow"
+    assert adapter.cancelled == []
+    assert metric_value("gec_hedges_skipped_total", {"reason": "budget"}) == skipped + 1
+    # The slow call still counts towards the latency percentile.
+    assert max(policy._samples) >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_unhedged_slow_call_is_sampled_when_no_key_is_free():
+    policy = warmed_policy(0.01, budget=1.0)
+    policy.earn()
+    adapter = DelayedAdapter({"slow": 0.05}, policy)
+
+    assert await adapter.correct("x", "tt", "rid") == "slow"
+    assert len(policy._samples) == 2
+    assert policy._samples[-1] >= 0.05
+
+
+class EchoBatchAdapter(GeminiAdapter):
+    """Upper-cases each framed text, or answers unframed when ``malformed``."""
+
+    def __init__(self, malformed: bool = False):
+        batcher = MicroBatcher(max_size=8, max_wait_s=0.01, max_text_chars=50)
+        super().__init__(["k1"], model="test-model", batcher=batcher)
+        self.malformed = malformed
+        self.prompts: list[Prompt] = []
+
+    async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+        self.prompts.append(prompt)
+        if "<text id=" not in prompt.system:
+            return prompt.text.upper()
+        if self.malformed:
+            return "Here are the corrections: ..."
+        return re.sub(r">\n(.*?)\n<", lambda m: f">\n{m.group(1).upper()}\n<", prompt.text)
+
+
+@pytest.mark.asyncio
+async def test_batcher_packs_short_texts_into_one_call():
+    adapter = EchoBatchAdapter()
+    texts = ["сәлам", "дөнья", "x" * 60, "<text> kebek"]
+
+    results = await asyncio.gather(*(adapter.correct(text, "tt", "rid") for text in texts))
+
+    assert results == [text.upper() for text in texts]
+    # One batch for the two short texts; the long and the tag-like one go alone.
+    assert len(adapter.prompts) == 3
+    assert sum('<text id="1">' in prompt.text for prompt in adapter.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_split_failure_falls_back_to_single_calls():
+    adapter = EchoBatchAdapter(malformed=True)
+    failures = metric_value("gec_batch_split_failures_total")
+
+    results = await asyncio.gather(*(adapter.correct(t, "tt", "rid") for t in ["a", "b"]))
+
+    assert results == ["A", "B"]
+    assert len(adapter.prompts) == 3
+    assert metric_value("gec_batch_split_failures_total") == failures + 1
+
+
+def test_split_batch_rejects_malformed_output():
+    framed = build_batch_prompt(["бер", "ике\nюл"], "tt").text
+    assert split_batch(framed, 2) == ["бер", "ике\nюл"]
+    assert split_batch("Sure!\n" + framed + "\n", 2) == ["бер", "ике\nюл"]
+
+    assert split_batch(framed, 3) is None
+    assert split_batch('<text id="2">\nике\n</text>\n<text id="1">\nбер\n</text>', 2) is None
+    assert split_batch('<text id="1">\n\n</text>\n<text id="2">\nике\n</text>', 2) is None
+
+
+def test_prompt_keeps_instructions_stable_and_text_separate():
+    first = build_request("models/test-model", build_prompt("бер", "tt"))
+    second = build_request("models/test-model", build_prompt("ике", "tt"))
+
+    assert first.system_instruction == second.system_instruction
+    assert [part.text for part in first.contents[0].parts] == ["бер"]
+    assert "Request-ID" not in first.system_instruction.parts[0].text
+    assert build_prompt("бер", "tt", "v1") == build_prompt("бер", "tt")
+    with pytest.raises(ValueError):
+        GeminiAdapter(["k1"], model="test-model", prompt_version="nope")
+
+
+class EditListAdapter(GeminiAdapter):
+    """Answers edit prompts with ``answer`` and full-text prompts with ``FIXED``."""
+
+    def __init__(self, answer: str):
+        super().__init__(["k1"], model="test-model", edit_min_chars=20)
+        self.answer = answer
+        self.prompts: list[Prompt] = []
+
+    async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+        self.prompts.append(prompt)
+        return self.answer if prompt.json else FIXED
+
+    async def _stream_once(self, key: str, prompt: Prompt):  # noqa: ARG002
+        self.prompts.append(prompt)
+        yield FIXED[:10]
+        yield FIXED[10:]
+
+
+TYPO = "Мин бүген мәктәпкә барам, китап укыйм."
+FIXED = "Мин бүген мәктәпкә барам һәм китап укыйм."
+
+
+@pytest.mark.asyncio
+async def test_edit_mode_applies_edits_on_both_paths():
+    answer = '{"edits": [{"start": 24, "original": ",", "replacement": " һәм"}]}'
+    adapter = EditListAdapter(answer)
+    applied = metric_value("gec_edit_mode_total", {"outcome": "applied"})
+
+    assert await adapter.correct(TYPO, "tt", "rid") == FIXED
+    assert [delta async for delta in adapter.correct_stream(TYPO, "tt", "rid")] == [FIXED]
+    assert [prompt.json for prompt in adapter.prompts] == [True, True]
+    assert metric_value("gec_edit_mode_total", {"outcome": "applied"}) == applied + 2
+
+    # Short texts are cheap to send back whole.
+    assert await adapter.correct("Мин барам.", "tt", "rid") == FIXED
+    assert not adapter.prompts[-1].json
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("answer", "outcome"),
+    [
+        (FIXED, "malformed"),
+        ('{"edits": [{"start": 24, "original": ";", "replacement": " һәм"}]}', "mismatch"),
+    ],
+)
+async def test_edit_mode_falls_back_to_full_text(answer: str, outcome: str):
+    adapter = EditListAdapter(answer)
+    before = metric_value("gec_edit_mode_total", {"outcome": outcome})
+
+    assert await adapter.correct(TYPO, "tt", "rid") == FIXED
+    assert "".join([d async for d in adapter.correct_stream(TYPO, "tt", "rid")]) == FIXED
+    assert [prompt.json for prompt in adapter.prompts] == [True, False, True, False]
+    assert metric_value("gec_edit_mode_total", {"outcome": outcome}) == before + 2
+
+
+def test_edit_prompt_asks_for_json():
+    request = build_request("models/test-model", build_edit_prompt(TYPO, "tt"))
+    assert request.generation_config.response_mime_type == "application/json"
+    assert '"edits"' in request.system_instruction.parts[0].text
+    assert [part.text for part in request.contents[0].parts] == [TYPO]
+    assert not build_request("models/test-model", build_prompt(TYPO, "tt")).generation_config
+
+
+@pytest.mark.asyncio
+async def test_upstream_429_cuts_adaptive_limit():
+    class QuotaModel(FakeModel):
+        async def generate_content(self, request, retry=None, timeout=None):  # noqa: ARG002
+            raise google_exceptions.TooManyRequests("quota")
+
+    limiter = AdaptiveLimiter(max_limit=8, min_limit=1)
+    adapter = GeminiAdapter(["k1"], model="test-model", limiter=limiter)
+    adapter._clients = GeminiClientPool("test-model", factory=lambda key: QuotaModel(["x"]))  # noqa: ARG005
+
+    with pytest.raises(AdapterOverloaded):
+        await adapter.correct("x", "tt", "rid")
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_transient_error_is_retried_on_another_key():
+    adapter = StubGeminiAdapter(
+        ["k1", "k2"],
+        responses={"k2": "ok"},
+        errors={"k1": google_exceptions.ServiceUnavailable("down")},
+    )
+
+    assert await adapter.correct("hello", "tt", "rid") == "ok"
+    assert [chunk async for chunk in adapter.correct_stream("hello", "tt", "rid")] == ["ok"]
+    assert adapter._pool.circuit_breakers()["gemini_key_0"]["failures"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_retry_avoids_the_failed_key_even_if_it_is_less_loaded():
+    adapter = StubGeminiAdapter(
+        ["k1", "k2"],
+        responses={"k2": "ok"},
+        errors={"k1": google_exceptions.ServiceUnavailable("down")},
+    )
+    adapter._retries = RetryBudget(max_attempts=1, base_delay_s=0)
+    for _ in range(3):
+        assert adapter._pool.try_acquire(exclude=["k1"]) == "k2"
+        adapter._pool.release("k2")
+
+    assert await adapter.correct("hello", "tt", "rid") == "ok"
+    assert [chunk async for chunk in adapter.correct_stream("hello", "tt", "rid")] == ["ok"]
+
+
+@pytest.mark.asyncio
+async def test_acquire_falls_back_to_an_avoided_key():
+    pool = GeminiKeyPool(["k1", "k2"], max_wait_s=0)
+    assert await pool.acquire(avoid=["k1"]) == "k2"
+    assert await pool.acquire(avoid=["k1", "k2"]) == "k1"
+
+
+@pytest.mark.asyncio
+async def test_retries_stop_at_max_attempts():
+    adapter = StubGeminiAdapter(
+        ["k1"], responses={}, errors={"k1": google_exceptions.InternalServerError("boom")}
+    )
+    adapter._retries = RetryBudget(max_attempts=2, base_delay_s=0)
+    calls = 0
+    generate = adapter._generate_text
+
+    def counting(key: str, prompt: Prompt) -> str:
+        nonlocal calls
+        calls += 1
+        return generate(key, prompt)
+
+    adapter._generate_text = counting  # type: ignore[method-assign]
+    with pytest.raises(google_exceptions.InternalServerError):
+        await adapter.correct("hello", "tt", "rid")
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_key_breaker_takes_failing_key_out_of_rotation():
+    clock = FakeClock()
+    pool = GeminiKeyPool(["k1", "k2"], failure_threshold=2, reset_timeout_s=30, clock=clock)
+    for _ in range(2):
+        assert await pool.acquire() == "k1"
+        pool.fail("k1")
+        assert await pool.acquire() == "k2"
+        pool.release("k2")
+    assert pool.circuit_breakers()["gemini_key_0"]["state"] == "open"
+    assert {await pool.acquire() for _ in range(3)} == {"k2"}
+    for _ in range(3):
+        pool.release("k2")
+
+    pool.fail(await pool.acquire())
+    pool.fail(await pool.acquire())
+    with pytest.raises(AdapterUnavailable) as info:
+        await pool.acquire()
+    assert info.value.retry_after == 30
+
+    clock.now = 30
+    assert await pool.acquire() == "k1"
+    pool.release("k1")
+    assert pool.circuit_breakers()["gemini_key_0"]["state"] == "closed"
@@ -0,0 +1,29 @@
+from backend.hedging import HedgePolicy
+
+
+def test_hedge_delay_is_a_latency_percentile():
+    policy = HedgePolicy(percentile=90, min_samples=10)
+    for ms in range(1, 10):
+        policy.record(ms / 1000)
+    assert policy.delay() is None
+
+    policy.record(0.5)
+    assert policy.delay() == 0.009
+    for _ in range(40):
+        policy.record(0.5)
+    assert policy.delay() == 0.5
+
+
+def test_hedge_budget_limits_extra_calls():
+    policy = HedgePolicy(budget=0.05, max_tokens=2)
+    hedges = 0
+    for _ in range(1000):
+        policy.earn()
+        hedges += policy.try_spend()
+    assert hedges == 50
+
+    # Unused budget only accumulates up to max_tokens.
+    idle = HedgePolicy(budget=0.05, max_tokens=2)
+    for _ in range(1000):
+        idle.earn()
+    assert [idle.try_spend() for _ in range(3)] == [True, True, False]
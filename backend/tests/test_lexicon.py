@@ -0,0 +1,99 @@
+import gzip
+
+import pytest
+
+from backend.fallback import FallbackAdapter
+from backend.lexicon import LexiconFilterAdapter, is_clean, load_lexicon
+from backend.models import MockAdapter, backend_of
+from backend.tests.helpers import RecordingAdapter
+
+LEXICON = frozenset(
+    {"мин", "бүген", "мәктәпкә", "барам", "китап", "укыйм", "кара", "каршы", "тр", "сәлам"}
+)
+
+
+def test_load_lexicon_reads_plain_and_gzipped_lists(tmp_path):
+    plain = tmp_path / "words.txt"
+    plain.write_text("# Tatar word forms\nМин\n\nкитап \n", encoding="utf-8")
+    packed = tmp_path / "words.txt.gz"
+    with gzip.open(packed, "wt", encoding="utf-8") as handle:
+        handle.write("мин\nкитап\n")
+
+    assert load_lexicon(str(plain)) == frozenset({"мин", "китап"})
+    assert load_lexicon(str(packed)) == frozenset({"мин", "китап"})
+    # Loaded once per process and shared.
+    assert load_lexicon(str(plain)) is load_lexicon(str(plain))
+
+
+@pytest.mark.parametrize(
+    "sentence",
+    [
+        "Мин бүген мәктәпкә барам.",
+        "«Сәлам!» ",
+        "Мин 2 китап укыйм, кара-каршы.",
+        "ТР мәктәпкә барам?",
+    ],
+)
+def test_clean_sentences(sentence: str):
+    assert is_clean(sentence, LEXICON)
+
+
+@pytest.mark.parametrize(
+    "sentence",
+    [
+        "Мин бүген мәктәпкә бардм.",  # unknown word form
+        "мин бүген мәктәпкә барам.",  # lowercase start
+        "Мин бүген мәктәпкә барам",  # no terminal punctuation
+        "Мин бүген  мәктәпкә барам.",  # doubled space
+        "Мин бүген мәктәпкә барам , китап укыйм.",  # space before a comma
+        "Мин,китап укыйм.",  # comma glued to the next word
+        "Мин мин китап укыйм.",  # doubled word
+        "Мин кИтап укыйм.",  # broken casing
+        "Мин китaп укыйм.",  # Latin "a" in a Cyrillic word
+        "123.",  # no words
+    ],
+)
+def test_suspicious_sentences(sentence: str):
+    assert not is_clean(sentence, LEXICON)
+
+
+def fix(text: str) -> str:
+    return text.replace("бардм", "барам")
+
+
+@pytest.mark.asyncio
+async def test_filter_sends_only_suspicious_runs_to_the_model():
+    inner = RecordingAdapter(fix)
+    adapter = LexiconFilterAdapter(inner, LEXICON)
+    text = "Сәлам! Мин бүген мәктәпкә бардм. мин китап укыйм.\n\nМин китап укыйм. "
+    expected = "Сәлам! Мин бүген мәктәпкә барам. мин китап укыйм.\n\nМин китап укыйм. "
+
+    assert await adapter.correct(text, "tt", "rid") == expected
+    # The two suspicious sentences in a row go as one call, with their context.
+    assert inner.seen == ["Мин бүген мәктәпкә бардм. мин китап укыйм."]
+
+    streamed = "".join([delta async for delta in adapter.correct_stream(text, "tt", "rid")])
+    assert streamed == expected
+    assert len(inner.seen) == 2
+
+
+@pytest.mark.asyncio
+async def test_filter_skips_the_model_for_clean_text():
+    inner = RecordingAdapter(fix)
+    adapter = LexiconFilterAdapter(inner, LEXICON)
+    text = "Сәлам! Мин бүген мәктәпкә барам.\n"
+
+    corrected = await adapter.correct(text, "tt", "rid")
+    assert corrected == text
+    assert backend_of(corrected, adapter.name) == "lexicon"
+    deltas = [delta async for delta in adapter.correct_stream(text, "tt", "rid")]
+    assert "".join(deltas) == text
+    assert backend_of(deltas[0], adapter.name) == "lexicon"
+    assert inner.seen == []
+    # The default TTL, not the one the fallback chain gives backends it does not lead.
+    fallback = FallbackAdapter(
+        [MockAdapter(), RecordingAdapter()], fallback_ttl_ms=1000, reserve_s=0
+    )
+    adapter = LexiconFilterAdapter(fallback, LEXICON)
+    assert adapter.cache_ttl_ms("lexicon") is None
+    assert adapter.cache_ttl_ms("recording") == 1000
@@ -0,0 +1,881 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import client as genai_client
+
+from backend.adaptive import AdaptiveLimiter
+from backend.batching import MicroBatcher
+from backend.breaker import RetryBudget
+from backend.cache import BoundedCache, SimpleCache
+from backend.fake_gemini import CHARS_PER_TOKEN, FakeGemini, FakeGeminiConfig, serve
+from backend.gemini import (
+    GeminiAdapter,
+    GeminiClientPool,
+    GeminiKeyExhausted,
+    GeminiKeyPool,
+    Prompt,
+    build_prompt,
+)
+from backend.hedging import HedgePolicy
+from backend.lexicon import LexiconFilterAdapter, is_clean
+from backend.main import cached_response_body
+from backend.models import AdapterUnavailable, ModelAdapter
+from backend.rate_limit import SlidingLimiter, SqliteLimiter
+from backend.segments import ParallelChunkAdapter
+from backend.tests.helpers import limiter_worker
+
+pytestmark = [
+    pytest.mark.perf,
+    pytest.mark.skipif(os.getenv("RUN_PERF") != "1", reason="perf benchmarks disabled"),
+]
+
+WORDS = [
+    "мин",
+    "син",
+    "ул",
+    "без",
+    "сез",
+    "алар",
+    "мәктәп",
+    "китап",
+    "укучы",
+    "укытучы",
+    "бүген",
+    "иртәгә",
+    "яхшы",
+    "матур",
+    "татар",
+    "теле",
+    "сөйләшә",
+    "яза",
+    "укый",
+    "бара",
+    "килә",
+    "өй",
+    "шәһәр",
+    "авыл",
+    "дус",
+    "әни",
+    "әти",
+    "бала",
+]
+
+
+def tatar_text(rng: random.Random, length: int) -> str:
+    words: list[str] = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def measure_memory(cache, count: int) -> int:
+    """Bytes retained after caching ``count`` freshly produced 5000-char corrections."""
+    rng = random.Random(0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(count):
+        cache.set(f"{index:064x}", tatar_text(rng, 5000), "gemini")
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def test_cache_entry_memory_vs_simple_cache():
+    count = 500
+    simple = measure_memory(SimpleCache(ttl_ms=60000), count)
+    plain = measure_memory(BoundedCache(ttl_ms=60000, max_bytes=1 << 30), count)
+    compact = measure_memory(
+        BoundedCache(ttl_ms=60000, max_bytes=1 << 30, compress_min_bytes=1024), count
+    )
+
+    print(f"\nSimpleCache: {simple / count:.0f} B/entry")
+    print(f"BoundedCache (uncompressed): {plain / count:.0f} B/entry")
+    print(f"BoundedCache (zlib): {compact / count:.0f} B/entry")
+    assert plain < simple
+    assert compact < simple / 2
+
+
+def test_cache_hit_latency_vs_simple_cache():
+    rng = random.Random(1)
+    text = tatar_text(rng, 5000)
+    rounds = 20000
+
+    simple = SimpleCache(ttl_ms=60000)
+    simple.set("key", text, "gemini")
+    started = time.perf_counter()
+    for _ in range(rounds):
+        entry = simple.get("key")
+        assert entry is not None
+        json.dumps(
+            {
+                "request_id": "rid",
+                "corrected_text": entry.value,
+                "meta": {"model_backend": entry.backend, "latency_ms": 0},
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+    simple_us = (time.perf_counter() - started) / rounds * 1e6
+
+    results = {}
+    for label, threshold in (("plain", 0), ("zlib", 1024)):
+        cache = BoundedCache(ttl_ms=60000, max_bytes=1 << 30, compress_min_bytes=threshold)
+        cache.set("key", text, "gemini")
+        started = time.perf_counter()
+        for _ in range(rounds):
+            hit = cache.get("key")
+            assert hit is not None
+            cached_response_body("rid", hit)
+        results[label] = (time.perf_counter() - started) / rounds * 1e6
+
+    print(f"\nSimpleCache + json.dumps: {simple_us:.1f} us/hit")
+    for label, value in results.items():
+        print(f"BoundedCache pre-encoded ({label}): {value:.1f} us/hit")
+    assert results["plain"] < simple_us
+
+
+def test_rate_limiter_100k_distinct_ips(monkeypatch):
+    current = 1_000_000.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(100_000)]
+
+    limiter = SlidingLimiter(per_minute=60, per_day=1000)
+    started = time.perf_counter()
+    for _ in range(3):
+        for ip in ips:
+            current += 0.0001
+            limiter.check(ip)
+    elapsed = time.perf_counter() - started
+    decisions = 3 * len(ips)
+
+    limiter = SlidingLimiter(per_minute=60, per_day=1000)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for ip in ips:
+        limiter.check(ip)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print(f"\n{decisions / elapsed:,.0f} decisions/s, {elapsed / decisions * 1e6:.2f} us/decision")
+    print(f"{retained / len(ips):.0f} B/key retained for {len(ips):,} keys")
+
+    current += 2 * 86400
+    started = time.perf_counter()
+    limiter.check("fresh")
+    gc_check = time.perf_counter() - started
+    removed = len(ips) + 1 - len(limiter.keys)
+    print(f"decision with idle-key GC due: {gc_check * 1e3:.2f} ms, removed {removed:,} keys")
+    assert removed == limiter.gc_batch
+    assert gc_check < 0.05
+    started = time.perf_counter()
+    removed += limiter.collect()
+    print(f"idle-key GC removed the other keys in {time.perf_counter() - started:.3f}s")
+    assert removed == len(ips)
+    assert retained / len(ips) < 1024
+
+
+def test_sqlite_limiter_decision_latency(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    memory = SlidingLimiter(per_minute=10**9, per_day=10**9)
+    shared = SqliteLimiter(path, per_minute=10**9, per_day=10**9)
+    keys = [f"10.0.{i >> 8 & 255}.{i & 255}" for i in range(1000)]
+
+    results = {}
+    for label, limiter in (("memory", memory), ("sqlite", shared)):
+        samples = []
+        for _ in range(5):
+            for key in keys:
+                started = time.perf_counter()
+                limiter.check(key)
+                samples.append(time.perf_counter() - started)
+        samples.sort()
+        results[label] = (
+            samples[len(samples) // 2] * 1e6,
+            samples[int(len(samples) * 0.99)] * 1e6,
+        )
+    shared.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=limiter_worker, args=(path, "hot", 2000, 10**6, queue)) for _ in range(4)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+    contended = time.perf_counter() - started
+    allowed = sum(queue.get(timeout=5) for _ in workers)
+
+    print()
+    for label, (p50, p99) in results.items():
+        print(f"{label} limiter: p50 {p50:.1f} us, p99 {p99:.1f} us per decision")
+    print(f"4 processes on one key: {allowed / contended:,.0f} decisions/s (incl. startup)")
+    assert allowed == 8000
+    # Decisions must stay well below upstream model latency (hundreds of ms).
+    assert results["sqlite"][1] < 5000
+
+
+def test_gemini_call_setup_at_50_concurrent_requests():
+    keys = ["key-a", "key-b", "key-c"]
+    lock = threading.Lock()
+
+    def legacy_setup(key: str):
+        # What every call used to do: reconfigure globally, build a model, and let
+        # generate_content create a fresh client from the new configuration.
+        with lock:
+            genai.configure(api_key=key)
+            model = genai.GenerativeModel("gemini-1.5-flash")
+        model._client = genai_client.get_default_generative_client()
+        return model
+
+    def measure_threads(setup) -> tuple[float, float]:
+        samples: list[float] = []
+
+        def one(key: str) -> None:
+            started = time.perf_counter()
+            setup(key)
+            samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            for _ in range(10):
+                list(executor.map(one, [keys[i % len(keys)] for i in range(50)]))
+        wall = time.perf_counter() - started
+        samples.sort()
+        return samples[len(samples) // 2] * 1e6, wall / 10 * 1e3
+
+    async def measure_pool(pool: GeminiClientPool) -> tuple[float, float]:
+        samples: list[float] = []
+
+        async def one(key: str) -> None:
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            pool.get(key)
+            samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(10):
+            await asyncio.gather(*(one(keys[i % len(keys)]) for i in range(50)))
+        wall = time.perf_counter() - started
+        samples.sort()
+        return samples[len(samples) // 2] * 1e6, wall / 10 * 1e3
+
+    pool = GeminiClientPool("gemini-1.5-flash")
+    legacy = measure_threads(legacy_setup)
+    pooled = asyncio.run(measure_pool(pool))
+    print()
+    print(f"configure + model per call: p50 {legacy[0]:.1f} us, {legacy[1]:.1f} ms per 50 calls")
+    print(f"per-key client pool:        p50 {pooled[0]:.1f} us, {pooled[1]:.1f} ms per 50 calls")
+    assert len(pool) == len(keys)
+    assert pooled[0] < legacy[0]
+
+
+def test_gemini_upstream_concurrency_async_vs_default_executor():
+    latency = 0.05
+    calls = 128
+
+    def blocking_call() -> str:
+        time.sleep(latency)
+        return "ok"
+
+    class SlowModel:
+        async def generate_content(self, request, retry=None, timeout=None):  # noqa: ARG002
+            await asyncio.sleep(latency)
+            return type("Response", (), {"text": "ok"})()
+
+    async def via_default_executor() -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(asyncio.to_thread(blocking_call) for _ in range(calls)))
+        return time.perf_counter() - started
+
+    async def via_async_adapter() -> tuple[float, int]:
+        adapter = GeminiAdapter(["k1"], "test-model", max_concurrency=calls)
+        adapter._clients = GeminiClientPool("test-model", factory=lambda key: SlowModel())  # noqa: ARG005
+        threads = threading.active_count()
+        started = time.perf_counter()
+        await asyncio.gather(*(adapter.correct("x", "tt", "rid") for _ in range(calls)))
+        return time.perf_counter() - started, threading.active_count() - threads
+
+    executor_wall = asyncio.run(via_default_executor())
+    async_wall, extra_threads = asyncio.run(via_async_adapter())
+    print()
+    print(f"{calls} calls of {latency * 1000:.0f} ms via asyncio.to_thread: {executor_wall:.2f}s")
+    print(f"{calls} calls via async adapter: {async_wall:.2f}s, {extra_threads} extra threads")
+    assert async_wall < executor_wall
+    assert extra_threads == 0
+
+
+def test_gemini_key_scheduler_sustains_sum_of_quotas():
+    keys = ["key-a", "key-b", "key-c"]
+    quota = 20  # requests per key per (scaled) one-second minute
+    window = 1.0
+    duration = 3.0
+
+    class QuotaAdapter(GeminiAdapter):
+        """Upstream enforcing each key's quota with 429s, like the real API."""
+
+        def __init__(self, pool: GeminiKeyPool):
+            super().__init__(keys, "test-model", max_concurrency=64, pool=pool)
+            self.sent: dict[str, list[float]] = {key: [] for key in keys}
+            self.rejected = 0
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            now = time.monotonic()
+            recent = [t for t in self.sent[key] if t > now - window]
+            self.sent[key] = recent
+            if len(recent) >= quota:
+                self.rejected += 1
+                raise google_exceptions.TooManyRequests("Please retry in 0.2s.")
+            recent.append(now)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+    async def run(pool: GeminiKeyPool) -> tuple[int, int, int]:
+        adapter = QuotaAdapter(pool)
+        ok = failed = 0
+        stop = time.monotonic() + duration
+
+        async def client() -> None:
+            nonlocal ok, failed
+            while time.monotonic() < stop:
+                try:
+                    await adapter.correct("x", "tt", "rid")
+                    ok += 1
+                except GeminiKeyExhausted:
+                    failed += 1
+                    await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(client() for _ in range(16)))
+        return ok, failed, adapter.rejected
+
+    capacity = int(len(keys) * quota * duration / window)
+    unpaced = asyncio.run(run(GeminiKeyPool(keys, cooldown_s=0.2, window_s=window)))
+    paced = asyncio.run(
+        run(GeminiKeyPool(keys, rpm=quota, cooldown_s=0.2, max_wait_s=1.0, window_s=window))
+    )
+    print()
+    print(f"capacity (sum of key quotas): {capacity}")
+    for label, (ok, failed, rejected) in (("cooldown only", unpaced), ("rpm pacing", paced)):
+        print(f"{label:>13}: {ok} ok, {failed} client errors, {rejected} upstream 429s")
+    assert paced[0] >= 0.9 * capacity
+    assert paced[2] <= unpaced[2]
+
+
+def test_hedging_cuts_tail_latency_within_budget():
+    rng = random.Random(7)
+    keys = ["key-a", "key-b", "key-c"]
+
+    class SimulatedAdapter(GeminiAdapter):
+        """Mostly ~20 ms responses, with 3% stalling for 300 ms."""
+
+        def __init__(self, hedging: HedgePolicy | None):
+            super().__init__(keys, "test-model", hedging=hedging)
+            self.calls = 0
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            self.calls += 1
+            slow = rng.random() < 0.03
+            await asyncio.sleep(0.3 if slow else rng.uniform(0.015, 0.025))
+            return "ok"
+
+    async def run(hedging: HedgePolicy | None) -> tuple[float, float, int]:
+        adapter = SimulatedAdapter(hedging)
+        latencies = []
+
+        async def one() -> None:
+            started = time.perf_counter()
+            await adapter.correct("x", "tt", "rid")
+            latencies.append(time.perf_counter() - started)
+
+        for _ in range(25):
+            await asyncio.gather(*(one() for _ in range(20)))
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        return p50, p99, adapter.calls - len(latencies)
+
+    plain = asyncio.run(run(None))
+    hedged = asyncio.run(run(HedgePolicy(percentile=95, budget=0.05)))
+    print()
+    for label, (p50, p99, extra) in (("no hedging", plain), ("hedging", hedged)):
+        print(f"{label:>10}: p50 {p50:.0f} ms, p99 {p99:.0f} ms, {extra} extra calls / 500")
+    assert hedged[1] < plain[1]
+    assert hedged[2] <= 0.05 * 500 + 10
+
+
+def test_micro_batching_cuts_upstream_calls():
+    texts = [" ".join(random.sample(WORDS, 6)) + "." for _ in range(400)]
+
+    class BatchingAdapter(GeminiAdapter):
+        """Every call takes ~40 ms, and a key serves at most 4 calls at once."""
+
+        def __init__(self, batcher: MicroBatcher | None):
+            pool = GeminiKeyPool(["key-a"], concurrency=4, max_wait_s=30)
+            super().__init__(["key-a"], "test-model", pool=pool, batcher=batcher)
+            self.calls = 0
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            self.calls += 1
+            await asyncio.sleep(0.04)
+            return prompt.text
+
+    async def run(batcher: MicroBatcher | None) -> tuple[float, int]:
+        adapter = BatchingAdapter(batcher)
+        queue = list(texts)
+
+        async def client() -> None:
+            while queue:
+                text = queue.pop()
+                assert await adapter.correct(text, "tt", "rid") == text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(40)))
+        return time.perf_counter() - started, adapter.calls
+
+    single = asyncio.run(run(None))
+    batched = asyncio.run(run(MicroBatcher(max_size=8, max_wait_s=0.005)))
+    print()
+    for label, (wall, calls) in (("one per call", single), ("batched x8", batched)):
+        print(f"{label:>12}: {len(texts)} texts in {wall:.2f}s, {calls} upstream calls")
+    assert batched[1] <= single[1] / 4
+    assert batched[0] < single[0]
+
+
+def test_prompt_tokens_with_stable_system_instruction():
+    texts = [" ".join(random.sample(WORDS, 8)) + "." for _ in range(200)]
+    # A rough subword count; the real tokenizer differs but splits text similarly.
+    piece = re.compile(r"\w{1,4}|[^\w\s]")
+
+    def tokens(text: str) -> int:
+        return len(piece.findall(text))
+
+    def legacy_prompt(text: str) -> str:
+        # The previous single user message, with instructions and a fresh request ID.
+        system = build_prompt(text, "tt").system
+        return f"{system}\nRequest-ID: {os.urandom(16).hex()}\n\nText:\n{text}"
+
+    def current_prompt(text: str) -> str:
+        prompt = build_prompt(text, "tt")
+        return f"{prompt.system}\n{prompt.text}"
+
+    def measure(render) -> tuple[float, float]:
+        sent = uncached = 0
+        previous = ""
+        for text in texts:
+            prompt = render(text)
+            shared = os.path.commonprefix([previous, prompt])
+            sent += tokens(prompt)
+            uncached += tokens(prompt) - tokens(shared)
+            previous = prompt
+        return sent / len(texts), uncached / len(texts)
+
+    legacy = measure(legacy_prompt)
+    current = measure(current_prompt)
+    print()
+    for label, (sent, uncached) in (("request id in prompt", legacy), ("system instr.", current)):
+        print(f"{label:>20}: {sent:.0f} input tokens/request, {uncached:.0f} after shared prefix")
+    assert current[0] < legacy[0]
+    assert current[1] < legacy[1]
+
+
+def test_parallel_chunks_cut_long_text_latency():
+    paragraphs = [
+        " ".join(random.sample(WORDS, 10)).capitalize() + ". " + " ".join(random.sample(WORDS, 10))
+        for _ in range(40)
+    ]
+    text = ".\n\n".join(paragraphs) + "."
+
+    class GeneratingAdapter(ModelAdapter):
+        """Emits output in 40-character chunks, 10 ms each, like token generation."""
+
+        name = "generating"
+
+        async def correct(self, text: str, lang: str, request_id: str) -> str:
+            return "".join([delta async for delta in self.correct_stream(text, lang, request_id)])
+
+        async def correct_stream(self, text: str, lang: str, request_id: str):  # noqa: ARG002
+            for start in range(0, len(text), 40):
+                await asyncio.sleep(0.01)
+                yield text[start : start + 40]
+
+    async def run(adapter: ModelAdapter) -> tuple[float, float, float]:
+        started = time.perf_counter()
+        assert await adapter.correct(text, "tt", "rid") == text
+        whole = time.perf_counter() - started
+        started = time.perf_counter()
+        first = None
+        async for _ in adapter.correct_stream(text, "tt", "rid"):
+            if first is None:
+                first = time.perf_counter() - started
+        assert first is not None
+        return whole, first, time.perf_counter() - started
+
+    single = asyncio.run(run(GeneratingAdapter()))
+    parallel = asyncio.run(run(ParallelChunkAdapter(GeneratingAdapter(), 1000, concurrency=4)))
+    print()
+    print(f"{len(text)} chars")
+    for label, (whole, first, stream) in (("one prompt", single), ("4 parallel", parallel)):
+        print(
+            f"{label:>10}: correct {whole * 1000:.0f} ms, "
+            f"stream first delta {first * 1000:.0f} ms, done {stream * 1000:.0f} ms"
+        )
+    assert parallel[0] < single[0] / 2
+    assert parallel[2] < single[2] / 2
+
+
+def test_edit_mode_cuts_output_tokens_and_latency():
+    expected = tatar_text(random.Random(11), 5000)
+    text = expected.replace("китап", "китп", 3)
+    tokens_per_s = 1000
+
+    def fix(text: str) -> str:
+        return text.replace("китп", "китап")
+
+    class GeneratingGemini(GeminiAdapter):
+        """First token after 50 ms, then output at 1000 tokens/s; fixes the typos."""
+
+        def __init__(self, edit_min_chars: int | None):
+            super().__init__(["k1"], "test-model", edit_min_chars=edit_min_chars)
+            self.output_chars = 0
+
+        def answer(self, prompt: Prompt) -> str:
+            if prompt.json:
+                edits = [
+                    {"start": typo.start(), "original": "китп", "replacement": "китап"}
+                    for typo in re.finditer("китп", prompt.text)
+                ]
+                output = json.dumps({"edits": edits}, ensure_ascii=False)
+            else:
+                output = fix(prompt.text)
+            self.output_chars += len(output)
+            return output
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            output = self.answer(prompt)
+            await asyncio.sleep(0.05 + len(output) / CHARS_PER_TOKEN / tokens_per_s)
+            return output
+
+        async def _stream_once(self, key: str, prompt: Prompt):  # noqa: ARG002
+            output = self.answer(prompt)
+            await asyncio.sleep(0.05)
+            for start in range(0, len(output), 40):
+                await asyncio.sleep(40 / CHARS_PER_TOKEN / tokens_per_s)
+                yield output[start : start + 40]
+
+    async def run(adapter: GeneratingGemini) -> tuple[float, float, float, float]:
+        started = time.perf_counter()
+        assert await adapter.correct(text, "tt", "rid") == expected
+        whole = time.perf_counter() - started
+        tokens = adapter.output_chars / CHARS_PER_TOKEN
+        started = time.perf_counter()
+        first = None
+        deltas = []
+        async for delta in adapter.correct_stream(text, "tt", "rid"):
+            if first is None:
+                first = time.perf_counter() - started
+            deltas.append(delta)
+        assert first is not None
+        assert "".join(deltas) == expected
+        return tokens, whole, first, time.perf_counter() - started
+
+    full = asyncio.run(run(GeneratingGemini(None)))
+    edits = asyncio.run(run(GeneratingGemini(500)))
+    print()
+    print(f"{len(text)} chars, 3 typos, {tokens_per_s} output tokens/s")
+    for label, (tokens, whole, first, stream) in (("full text", full), ("edit list", edits)):
+        print(
+            f"{label:>9}: ~{tokens:.0f} output tokens, correct {whole * 1000:.0f} ms, "
+            f"stream first delta {first * 1000:.0f} ms, done {stream * 1000:.0f} ms"
+        )
+    assert edits[0] < full[0] / 20
+    assert edits[1] < full[1] / 4
+    assert edits[3] < full[3] / 4
+
+
+def test_lexicon_filter_skip_and_false_skip_rates():
+    rng = random.Random(5)
+    suffixes = ["", "лар", "ны", "га", "да", "дан", "ның", "ләр", "не", "гә", "дә", "дән", "нең"]
+    tracemalloc.start()
+    forms = {word + suffix for word in WORDS for suffix in suffixes}
+    # Pad to the size of a real word-form list with forms no sentence will use.
+    letters = "абвгдеәжзийклмнңоөпрстуүфхһчшыэюя"
+    while len(forms) < 300_000:
+        forms.add("".join(rng.choices(letters, k=rng.randint(6, 12))))
+    started = time.perf_counter()
+    lexicon = frozenset(forms)
+    build = time.perf_counter() - started
+    del forms
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    def sentence() -> list[str]:
+        # Distinct words, since a doubled word is itself flagged.
+        return [word + rng.choice(suffixes) for word in rng.sample(WORDS, rng.randint(4, 10))]
+
+    def render(words: list[str]) -> str:
+        return " ".join(words).capitalize() + "."
+
+    def typo(words: list[str]) -> str:
+        # A dropped letter that leaves a non-word ("китапдан" -> "китапан").
+        index = rng.randrange(len(words))
+        word = words[index]
+        while True:
+            cut = rng.randrange(len(word))
+            misspelled = word[:cut] + word[cut + 1 :]
+            if misspelled and misspelled not in lexicon:
+                break
+        words[index] = misspelled
+        return render(words)
+
+    def real_word(words: list[str]) -> str:
+        # Another existing form in place of the right one: the lexicon cannot tell.
+        index = rng.randrange(len(words))
+        words[index] = rng.choice(WORDS) + rng.choice(suffixes)
+        return render(words)
+
+    errors = {
+        "typo": typo,
+        "lowercase start": lambda words: render(words)[0].lower() + render(words)[1:],
+        "no final period": lambda words: render(words)[:-1],
+        "space before comma": lambda words: render([words[0] + " ,", *words[1:]]),
+        "real-word error": real_word,
+    }
+    correct = [render(sentence()) for _ in range(3000)]
+    wrong = {name: [make(sentence()) for _ in range(400)] for name, make in errors.items()}
+
+    started = time.perf_counter()
+    skipped = sum(is_clean(text, lexicon) for text in correct)
+    check = (time.perf_counter() - started) / len(correct)
+    false_skips = {name: sum(is_clean(t, lexicon) for t in texts) for name, texts in wrong.items()}
+
+    class CountingAdapter(ModelAdapter):
+        name = "counting"
+
+        def __init__(self):
+            self.chars = 0
+            self.calls = 0
+
+        async def correct(self, text: str, lang: str, request_id: str) -> str:  # noqa: ARG002
+            self.calls += 1
+            self.chars += len(text)
+            return text
+
+    # Texts of five sentences, one in five sentences with an error.
+    pool = correct + [text for texts in wrong.values() for text in texts]
+    texts = [" ".join(rng.choice(pool) for _ in range(5)) for _ in range(500)]
+    inner = CountingAdapter()
+    filtered = LexiconFilterAdapter(inner, lexicon)
+
+    async def run() -> None:
+        for text in texts:
+            await filtered.correct(text, "tt", "rid")
+
+    asyncio.run(run())
+    sent = sum(len(text) for text in texts)
+    print()
+    print(
+        f"lexicon: {len(lexicon)} forms, built in {build * 1000:.0f} ms, "
+        f"~{memory / 2**20:.0f} MiB; check {check * 1e6:.1f} µs/sentence"
+    )
+    print(f"correct sentences skipped: {skipped / len(correct):.1%}")
+    for name, count in false_skips.items():
+        print(f"{name:>18}: {count / len(wrong[name]):.1%} falsely skipped")
+    total_wrong = sum(len(texts) for texts in wrong.values())
+    print(f"{'all errors':>18}: {sum(false_skips.values()) / total_wrong:.1%} falsely skipped")
+    print(
+        f"{len(texts)} texts: {inner.calls} model calls, "
+        f"{inner.chars / sent:.0%} of the characters sent upstream"
+    )
+    assert skipped == len(correct)
+    assert all(count == 0 for name, count in false_skips.items() if name != "real-word error")
+    assert inner.chars < sent * 0.9
+    assert check < 50e-6
+
+
+def test_adaptive_concurrency_avoids_quota_errors():
+    keys = ["key-a", "key-b"]
+    capacity = 8
+
+    class QuotaAdapter(GeminiAdapter):
+        """Upstream serves 8 calls at once in 20 ms; any call beyond that gets a 429."""
+
+        def __init__(self, limiter: AdaptiveLimiter | None):
+            pool = GeminiKeyPool(keys, cooldown_s=0.05, max_wait_s=0.5)
+            super().__init__(keys, "test-model", max_concurrency=32, pool=pool, limiter=limiter)
+            self.active = 0
+            self.rejected = 0
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            async with self._upstream_slot("generate") as slot:
+                if self.active >= capacity:
+                    self.rejected += 1
+                    raise google_exceptions.TooManyRequests("quota")
+                self.active += 1
+                try:
+                    await asyncio.sleep(0.02)
+                finally:
+                    self.active -= 1
+                slot.latency = 0.02
+            return "ok"
+
+    async def run(limiter: AdaptiveLimiter | None) -> tuple[int, int, int]:
+        adapter = QuotaAdapter(limiter)
+        ok = failed = 0
+        stop = time.perf_counter() + 2.0
+
+        async def client() -> None:
+            nonlocal ok, failed
+            while time.perf_counter() < stop:
+                try:
+                    await adapter.correct("x", "tt", "rid")
+                    ok += 1
+                except GeminiKeyExhausted:
+                    failed += 1
+                    await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(client() for _ in range(48)))
+        return ok, failed, adapter.rejected
+
+    fixed = asyncio.run(run(None))
+    adaptive = asyncio.run(
+        run(AdaptiveLimiter(32, min_limit=2, max_wait_s=2.0, decrease_interval_s=0.05))
+    )
+    print()
+    for label, (ok, failed, rejected) in (("fixed 32", fixed), ("adaptive", adaptive)):
+        print(f"{label:>8}: {ok} ok, {failed} client 429s, {rejected} upstream 429s")
+    assert adaptive[1] < fixed[1]
+    assert adaptive[0] > fixed[0]
+
+
+def test_key_breaker_and_retry_budget_during_partial_and_full_outage():
+    keys = ["key-a", "key-b", "key-c"]
+
+    class OutageAdapter(GeminiAdapter):
+        """Every call takes 5 ms; calls on a key listed in ``down`` fail with a 503."""
+
+        def __init__(self, protected: bool):
+            pool = GeminiKeyPool(keys, failure_threshold=5 if protected else 0)
+            retries = RetryBudget(max_attempts=2 if protected else 0, base_delay_s=0.005)
+            super().__init__(keys, "test-model", pool=pool, retries=retries)
+            self.down: set[str] = set()
+            self.upstream_calls = 0
+
+        async def _generate_once(self, key: str, prompt: Prompt) -> str:  # noqa: ARG002
+            self.upstream_calls += 1
+            await asyncio.sleep(0.005)
+            if key in self.down:
+                raise google_exceptions.ServiceUnavailable("down")
+            return "ok"
+
+    async def run(protected: bool, down: list[str]) -> tuple[int, int, int]:
+        adapter = OutageAdapter(protected)
+        adapter.down.update(down)
+        ok = failed = 0
+
+        async def client() -> None:
+            nonlocal ok, failed
+            for _ in range(50):
+                try:
+                    await adapter.correct("x", "tt", "rid")
+                    ok += 1
+                except (google_exceptions.ServiceUnavailable, AdapterUnavailable):
+                    failed += 1
+
+        await asyncio.gather(*(client() for _ in range(10)))
+        return ok, failed, adapter.upstream_calls
+
+    print()
+    results = {}
+    for outage, down in (("one key down", keys[:1]), ("all keys down", keys)):
+        for label, protected in (("unprotected", False), ("breaker+retry", True)):
+            ok, failed, calls = results[outage, protected] = asyncio.run(run(protected, down))
+            print(f"{outage:>13} {label:>13}: {ok} ok, {failed} failed, {calls} upstream calls")
+    # One bad key: retries land on healthy keys and its breaker keeps traffic away.
+    assert results["one key down", True][1] < results["one key down", False][1] / 5
+    # Full outage: open breakers shed load instead of multiplying it with retries.
+    assert results["all keys down", True][2] < results["all keys down", False][2] / 2
+
+
+def test_real_adapter_against_fake_gemini_server():
+    keys = ["key-a", "key-b", "key-c", "key-d"]
+    quota = 40  # requests per key per (scaled) one-second minute
+    duration = 3.0
+    config = FakeGeminiConfig(
+        rpm=quota,
+        window_s=1.0,
+        latency_ms=30,
+        latency_sigma=0.5,
+        tokens_per_s=2000,
+        chunk_chars=20,
+        unavailable_rate=0.02,
+        stream_failure_rate=0.02,
+        empty_rate=0.01,
+        seed=3,
+    )
+    text = " ".join(WORDS[:12])
+
+    async def run() -> tuple[Counter[str], list[float], Counter[str]]:
+        fake = FakeGemini(config)
+        server, port = await serve(fake)
+        pool = GeminiKeyPool(keys, rpm=quota, max_wait_s=0.5, window_s=1.0)
+        adapter = GeminiAdapter(keys, "gemini-test", pool=pool, endpoint=f"127.0.0.1:{port}")
+        outcomes: Counter[str] = Counter()
+        latencies: list[float] = []
+        stop = time.perf_counter() + duration
+
+        async def client(index: int) -> None:
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                try:
+                    if index % 2:
+                        assert await adapter.correct(text, "tt", "rid") == text
+                    else:
+                        chunks = [c async for c in adapter.correct_stream(text, "tt", "rid")]
+                        assert "".join(chunks) == text
+                    outcomes["ok"] += 1
+                    latencies.append(time.perf_counter() - started)
+                except GeminiKeyExhausted:
+                    outcomes["client 429"] += 1
+                    await asyncio.sleep(0.05)
+                except (google_exceptions.ServiceUnavailable, RuntimeError) as err:
+                    outcomes[type(err).__name__] += 1
+
+        try:
+            await asyncio.gather(*(client(index) for index in range(32)))
+        finally:
+            await server.stop(None)
+        return outcomes, latencies, fake.stats
+
+    outcomes, latencies, upstream = asyncio.run(run())
+    latencies.sort()
+    capacity = int(len(keys) * quota * duration)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print()
+    print(f"capacity (sum of key quotas): {capacity}")
+    print(f"client: {dict(outcomes)}, p50 {p50 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+    print(f"fake server: {dict(upstream)}")
+    assert outcomes["ok"] >= 0.8 * capacity
+    # Each injected failure surfaces as one client error, never as a crash or a hang.
+    injected = upstream["unavailable"] + upstream["empty"] + upstream["stream_failed"]
+    assert outcomes["RuntimeError"] + outcomes["ServiceUnavailable"] <= injected
@@ -1,6 +1,19 @@
+import multiprocessing
+import subprocess
+import sys
 import time
 
-from backend.rate_limit import SlidingLimiter
+from backend.rate_limit import (
+    CostBudget,
+    SlidingLimiter,
+    SqliteLimiter,
+    SqliteStreamSlots,
+    build_cost_budget,
+    build_limiter,
+    build_stream_slots,
+)
+from backend.settings import Settings
+from backend.tests.helpers import REPO_ROOT, limiter_worker
 
 
 def test_rate_limit_per_minute(monkeypatch):
@@ -62,3 +75,219 @@ def test_rate_limit_reset_boundaries(monkeypatch):
 
     current = 86400.001
     assert limiter.allow("ip") is True
+
+
+def test_rate_limit_remaining_and_retry_after(monkeypatch):
+    current = 30.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SlidingLimiter(per_minute=3, per_day=100)
+
+    assert [limiter.check("ip").remaining for _ in range(3)] == [2, 1, 0]
+    blocked = limiter.check("ip")
+    assert blocked.allowed is False
+    assert blocked.remaining == 0
+    # All three requests fall in the [0, 60) window, which only starts to decay at t=60.
+    assert blocked.retry_after == 31
+
+    current = 30.0 + blocked.retry_after - 2
+    assert limiter.check("ip").allowed is False
+
+    current = 30.0 + blocked.retry_after
+    assert limiter.check("ip").allowed is True
+
+
+def test_rate_limit_state_is_constant_per_key(monkeypatch):
+    current = 0.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SlidingLimiter(per_minute=1000, per_day=1000)
+    for _ in range(500):
+        current += 0.01
+        limiter.allow("ip")
+
+    state = limiter.keys["ip"]
+    assert len(state.counts) == 2
+    assert not hasattr(state, "__dict__")
+
+
+def test_rate_limit_collects_idle_keys(monkeypatch):
+    current = 0.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SlidingLimiter(per_minute=10, per_day=100, gc_interval_s=60)
+    for index in range(50):
+        limiter.allow(f"10.0.0.{index}")
+    assert len(limiter.keys) == 50
+
+    current = 86400.0
+    limiter.allow("fresh")
+    assert len(limiter.keys) == 51
+
+    current = 2 * 86400.0
+    limiter.allow("fresh")
+    assert list(limiter.keys) == ["fresh"]
+
+
+def test_rate_limit_collects_idle_keys_in_bounded_batches(monkeypatch):
+    current = 0.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SlidingLimiter(per_minute=10, per_day=100, gc_interval_s=60, gc_batch=20)
+    for index in range(50):
+        limiter.allow(f"10.0.0.{index}")
+    current = 86400.0
+    limiter.allow("10.0.0.0")
+
+    # Only "10.0.0.0" was used since; the other 49 drain one batch per decision.
+    current = 2 * 86400.0
+    limiter.allow("fresh")
+    assert len(limiter.keys) == 31
+    limiter.allow("fresh")
+    assert len(limiter.keys) == 11
+    limiter.allow("fresh")
+    assert list(limiter.keys) == ["10.0.0.0", "fresh"]
+    # Caught up: the next collection waits for the interval again.
+    limiter.allow("other")
+    assert len(limiter.keys) == 3
+
+
+def test_sqlite_limiter_matches_memory_limiter(monkeypatch, tmp_path):
+    current = 30.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SqliteLimiter(str(tmp_path / "rl.sqlite3"), per_minute=3, per_day=100)
+
+    assert [limiter.check("ip").remaining for _ in range(3)] == [2, 1, 0]
+    blocked = limiter.check("ip")
+    assert blocked.allowed is False
+    assert blocked.retry_after == 31
+
+    current = 30.0 + blocked.retry_after
+    assert limiter.check("ip").allowed is True
+
+    current = 3 * 86400.0
+    assert limiter.collect() == 1
+    limiter.close()
+
+
+def test_sqlite_limiter_is_exact_across_processes(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=limiter_worker, args=(path, "ip", 40, 50, results)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    assert sum(results.get(timeout=5) for _ in workers) == 50
+
+
+def test_sqlite_stream_slots_are_shared_and_reaped(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    ours = SqliteStreamSlots(path)
+    assert ours.acquire("ip", 2) is True
+
+    # Another worker process that exits while still holding a slot.
+    code = (
+        "import sys; from backend.rate_limit import SqliteStreamSlots; "
+        "assert SqliteStreamSlots(sys.argv[1]).acquire('ip', 2)"
+    )
+    subprocess.run([sys.executable, "-c", code, path], check=True, cwd=REPO_ROOT)
+
+    assert ours.total() == 2
+    assert ours.acquire("ip", 2) is False
+    assert ours.reap() == 1
+    assert ours.acquire("ip", 2) is True
+    ours.release("ip")
+    ours.release("ip")
+    assert ours.total() == 0
+    ours.close()
+
+
+def test_build_limiter_selects_backend(tmp_path):
+    memory = Settings(rate_limit_backend="memory")
+    assert isinstance(build_limiter(memory), SlidingLimiter)
+    assert build_stream_slots(memory) is None
+
+    shared = Settings(rate_limit_backend="sqlite", rate_limit_path=str(tmp_path / "rl.sqlite3"))
+    limiter = build_limiter(shared)
+    slots = build_stream_slots(shared)
+    assert isinstance(limiter, SqliteLimiter)
+    assert isinstance(slots, SqliteStreamSlots)
+    limiter.close()
+    slots.close()
+
+
+def test_cost_budget_settles_actual_cost(monkeypatch):
+    current = 0.0
+
+    def fake_time():
+        return current
+
+    monkeypatch.setattr(time, "time", fake_time)
+    limiter = SlidingLimiter(per_minute=100, per_day=1000)
+    budget = CostBudget(limiter)
+
+    decision, charged = budget.charge("ip", "x" * 30)
+    assert decision.allowed is True
+    assert charged == 60
+    # The correction came back much shorter than estimated: refund the difference.
+    budget.settle("ip", charged, actual=35)
+    assert limiter.keys["ip"].counts == [35, 35]
+
+    decision, charged = budget.charge("ip", "x" * 30)
+    assert decision.allowed is True
+    budget.settle("ip", charged, actual=80)
+    assert limiter.keys["ip"].counts == [115, 115]
+    assert budget.charge("ip", "x")[0].allowed is False
+
+    current = 121.0
+    # Longer than the whole minute budget: capped, so it still runs when idle.
+    decision, charged = budget.charge("ip", "x" * 500)
+    assert decision.allowed is True
+    assert charged == 100
+
+
+def test_sqlite_cost_budget_is_namespaced(tmp_path):
+    settings = Settings(
+        rate_limit_backend="sqlite",
+        rate_limit_path=str(tmp_path / "rl.sqlite3"),
+        rate_limit_per_minute=1,
+        rate_limit_chars_per_minute=100,
+    )
+    requests = build_limiter(settings)
+    budget = build_cost_budget(settings)
+    assert budget is not None
+
+    assert requests.check("ip").allowed is True
+    decision, charged = budget.charge("ip", "x" * 10)
+    assert decision.allowed is True
+    budget.settle("ip", charged, actual=15)
+    assert budget.charge("ip", "x" * 40)[0].remaining == 5
+    assert requests.check("ip").allowed is False
+    requests.close()
+    budget.close()
+
+
+def test_cost_budget_disabled_by_default():
+    assert build_cost_budget(Settings()) is None
@@ -0,0 +1,224 @@
+import asyncio
+import functools
+
+import pytest
+
+from backend.cache import BoundedCache
+from backend.models import MockAdapter, ModelAdapter, cache_key
+from backend.segments import (
+    ParallelChunkAdapter,
+    SegmentCacheAdapter,
+    group_segments,
+    merge_ordered,
+    split_padding,
+    split_segments,
+)
+from backend.tests.helpers import RecordingAdapter
+
+
+def test_split_segments_roundtrip_and_boundaries():
+    text = "Сәлам, дус! Ничек яшисең? Әйбәт.\n\nЯңа абзац  монда.  "
+    segments = split_segments(text)
+
+    assert "".join(segments) == text
+    assert [segment.strip() for segment in segments] == [
+        "Сәлам, дус!",
+        "Ничек яшисең?",
+        "Әйбәт.",
+        "Яңа абзац  монда.",
+    ]
+
+
+def test_split_segments_keeps_abbreviations_and_initials():
+    text = "Г. Тукай 1886 елда туган. Китаплар, дәфтәрләр һ.б. Әйберләр бар."
+    segments = split_segments(text)
+
+    assert [segment.strip() for segment in segments] == [
+        "Г. Тукай 1886 елда туган.",
+        "Китаплар, дәфтәрләр һ.б. Әйберләр бар.",
+    ]
+
+
+def test_split_segments_requires_capital_after_period():
+    assert split_segments("1.5 литр. сөт алдым") == ["1.5 литр. сөт алдым"]
+
+
+def test_split_padding():
+    assert split_padding("  текст \n") == ("  ", "текст", " \n")
+    assert split_padding("\n\n") == ("\n\n", "", "")
+
+
+def make_adapter(inner: ModelAdapter) -> SegmentCacheAdapter:
+    cache = BoundedCache(ttl_ms=60000, max_bytes=1_000_000)
+
+    def key_fn(text: str, lang: str) -> str:
+        return cache_key(text, lang, inner.name, "model", "v1")
+
+    return SegmentCacheAdapter(inner, cache, key_fn)
+
+
+@pytest.mark.asyncio
+async def test_segment_cache_only_sends_uncached_sentences():
+    inner = RecordingAdapter()
+    adapter = make_adapter(inner)
+
+    first = await adapter.correct("Бер җөмлә. Ике җөмлә.\n\nӨч.", "tt", "rid")
+    assert first == "БЕР ҖӨМЛӘ. ИКЕ ҖӨМЛӘ.\n\nӨЧ."
+    # A cold text is one call; its sentences are still cached one by one.
+    assert inner.seen == ["Бер җөмлә. Ике җөмлә.\n\nӨч."]
+
+    inner.seen.clear()
+    second = await adapter.correct("Бер җөмлә. Үзгәргән җөмлә.\n\nӨч.", "tt", "rid")
+    assert second == "БЕР ҖӨМЛӘ. ҮЗГӘРГӘН ҖӨМЛӘ.\n\nӨЧ."
+    assert inner.seen == ["Үзгәргән җөмлә."]
+
+
+@pytest.mark.asyncio
+async def test_segment_cache_stream_matches_non_stream():
+    inner = RecordingAdapter()
+    adapter = make_adapter(inner)
+    text = "Бер җөмлә. Ике җөмлә.\n\nӨч."
+
+    await adapter.correct("Бер җөмлә.", "tt", "rid")
+    inner.seen.clear()
+    streamed = "".join([chunk async for chunk in adapter.correct_stream(text, "tt", "rid")])
+
+    assert streamed == "БЕР ҖӨМЛӘ. ИКЕ ҖӨМЛӘ.\n\nӨЧ."
+    assert inner.seen == ["Ике җөмлә.\n\nӨч."]
+    assert await adapter.correct(text, "tt", "rid") == streamed
+    assert inner.seen == ["Ике җөмлә.\n\nӨч."]
+
+
+@pytest.mark.asyncio
+async def test_segment_cache_skips_runs_whose_sentences_do_not_match():
+    class MergingAdapter(RecordingAdapter):
+        async def correct(self, text: str, lang: str, request_id: str) -> str:
+            self.seen.append(text)
+            return text.replace(". ", ", ").lower()
+
+    inner = MergingAdapter()
+    adapter = make_adapter(inner)
+    text = "Бер җөмлә. Ике җөмлә."
+
+    assert await adapter.correct(text, "tt", "rid") == "бер җөмлә, ике җөмлә."
+    assert await adapter.correct("Бер җөмлә.", "tt", "rid") == "бер җөмлә."
+    assert inner.seen == [text, "Бер җөмлә."]
+
+
+@pytest.mark.asyncio
+async def test_segment_cache_wraps_mock_adapter_name():
+    adapter = make_adapter(MockAdapter())
+    assert adapter.name == "mock"
+    assert adapter.prefetch_first_delta is False
+
+
+def test_group_segments_packs_sentences_and_prefers_paragraphs():
+    text = "Бер җөмлә. Ике җөмлә. Өч җөмлә.\n\nДүрт. Биш җөмлә бу.\n\nАлты."
+    chunks = group_segments(split_segments(text), 24)
+
+    assert "".join(chunks) == text
+    assert chunks == [
+        "Бер җөмлә. Ике җөмлә. ",
+        "Өч җөмлә.\n\nДүрт. ",
+        # Ends at the paragraph although "Алты." would still fit.
+        "Биш җөмлә бу.\n\n",
+        "Алты.",
+    ]
+    assert group_segments(["озын " * 10], 8) == ["озын " * 10]
+
+
+class ParagraphAdapter(ModelAdapter):
+    """Streams each text in two halves; the first text seen is the slowest."""
+
+    name = "paragraphs"
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+
+    async def correct(self, text: str, lang: str, request_id: str) -> str:
+        return "".join([delta async for delta in self.correct_stream(text, lang, request_id)])
+
+    async def correct_stream(self, text: str, lang: str, request_id: str):  # noqa: ARG002
+        delay = 0.03 if self.calls == 0 else 0.005
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            half = len(text) // 2
+            await asyncio.sleep(delay)
+            yield text[:half].upper()
+            await asyncio.sleep(delay)
+            yield text[half:].upper() + "\n"
+        finally:
+            self.active -= 1
+
+
+LONG_TEXT = "Бер җөмлә.\n\nИке җөмлә.\n\nӨч җөмлә.\n\nДүрт җөмлә."
+
+
+@pytest.mark.asyncio
+async def test_parallel_chunks_correct_concurrently_in_order():
+    inner = ParagraphAdapter()
+    adapter = ParallelChunkAdapter(inner, chunk_chars=12, concurrency=2)
+
+    assert await adapter.correct(LONG_TEXT, "tt", "rid") == LONG_TEXT.upper()
+    assert inner.calls == 4
+    assert inner.peak == 2
+
+    inner.calls = 0
+    assert await adapter.correct("Кыска.", "tt", "rid") == "КЫСКА.\n"
+    assert inner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_parallel_chunk_stream_merges_in_order():
+    inner = ParagraphAdapter()
+    adapter = ParallelChunkAdapter(inner, chunk_chars=12, concurrency=4)
+
+    deltas = [delta async for delta in adapter.correct_stream(LONG_TEXT, "tt", "rid")]
+
+    assert "".join(deltas) == LONG_TEXT.upper()
+    assert deltas[0] == "БЕР Җ"
+    assert inner.peak == 4
+
+
+@pytest.mark.asyncio
+async def test_merge_ordered_streams_first_source_live_and_cancels_on_close():
+    started: list[int] = []
+    closed: list[int] = []
+    release = asyncio.Event()
+
+    async def source(index: int):
+        started.append(index)
+        try:
+            if index == 0:
+                yield "first"
+            await release.wait()
+            yield f"{index}"
+        finally:
+            closed.append(index)
+
+    merged = merge_ordered([functools.partial(source, i) for i in range(3)], concurrency=2)
+    assert await asyncio.wait_for(merged.__anext__(), timeout=1) == "first"
+    assert started == [0, 1]
+    await merged.aclose()
+    assert sorted(closed) == [0, 1]
+    assert started == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_merge_ordered_reports_errors_in_turn():
+    async def ok():
+        yield "ok"
+
+    async def broken():
+        raise RuntimeError("boom")
+        yield ""  # pragma: no cover
+
+    seen: list[str] = []
+    with pytest.raises(RuntimeError):
+        async for delta in merge_ordered([ok, broken], concurrency=2):
+            seen.append(delta)
+    assert seen == ["ok"]
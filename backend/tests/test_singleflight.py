@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+
+from backend import deadlines
+from backend.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_do_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = 0
+
+    async def upstream() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "corrected"
+
+    results = await asyncio.gather(*(flights.do("key", upstream) for _ in range(5)))
+
+    assert results == ["corrected"] * 5
+    assert calls == 1
+    assert flights.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_do_propagates_errors_to_every_waiter():
+    flights = SingleFlight()
+
+    async def upstream() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(
+        *(flights.do("key", upstream) for _ in range(3)), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_do_survives_one_waiter_cancelling():
+    flights = SingleFlight()
+
+    async def upstream() -> str:
+        await asyncio.sleep(0.02)
+        return "corrected"
+
+    impatient = asyncio.create_task(flights.do("key", upstream))
+    patient = asyncio.create_task(flights.do("key", upstream))
+    await asyncio.sleep(0)
+    impatient.cancel()
+
+    assert await patient == "corrected"
+
+
+async def chunks(items: list[str], delay: float, started: list[int]):
+    started.append(1)
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+async def collect(stream) -> list[str]:
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_stream_fans_out_one_upstream():
+    flights = SingleFlight()
+    started: list[int] = []
+
+    def factory():
+        return chunks(["a", "b", "c"], 0.01, started)
+
+    results = await asyncio.gather(*(collect(flights.stream("key", factory)) for _ in range(3)))
+
+    assert results == [["a", "b", "c"]] * 3
+    assert len(started) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_late_joiner_gets_replay():
+    flights = SingleFlight()
+    started: list[int] = []
+
+    def factory():
+        return chunks(["a", "b", "c"], 0.02, started)
+
+    first = flights.stream("key", factory)
+    assert await first.__anext__() == "a"
+    assert await first.__anext__() == "b"
+
+    late = await collect(flights.stream("key", factory))
+    rest = await collect(first)
+
+    assert late == ["a", "b", "c"]
+    assert rest == ["c"]
+    assert len(started) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_cancels_upstream_when_last_subscriber_leaves():
+    flights = SingleFlight()
+    produced: list[str] = []
+
+    async def upstream():
+        for item in ["a", "b", "c", "d"]:
+            await asyncio.sleep(0.01)
+            produced.append(item)
+            yield item
+
+    stream = flights.stream("key", upstream)
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+    await asyncio.sleep(0.05)
+
+    assert len(produced) < 4
+    assert flights.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_do_cancels_call_when_every_waiter_leaves():
+    flights = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def upstream() -> str:
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "corrected"  # pragma: no cover
+
+    waiters = [asyncio.create_task(flights.do("key", upstream)) for _ in range(2)]
+    await asyncio.sleep(0)
+    for waiter in waiters:
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(waiter, 0.01)
+
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert flights.in_flight() == 0
+
+
+async def deadline_bound() -> str:
+    """Answer in 20 ms, or time out at the deadline like a gRPC call."""
+    remaining = deadlines.remaining()
+    if remaining is not None and remaining < 0.02:
+        await asyncio.sleep(remaining)
+        raise deadlines.DeadlineExceeded("deadline_exceeded")
+    await asyncio.sleep(0.02)
+    return "corrected"
+
+
+@pytest.mark.asyncio
+async def test_do_runs_under_the_first_deadline_and_reruns_for_a_later_one():
+    flights = SingleFlight()
+    seen: list[float | None] = []
+
+    async def upstream() -> str:
+        seen.append(deadlines.remaining())
+        return await deadline_bound()
+
+    impatient = asyncio.create_task(flights.do("key", upstream, 0.01))
+    await asyncio.sleep(0)
+    patient = asyncio.create_task(flights.do("key", upstream, 1))
+    earlier = asyncio.create_task(flights.do("key", upstream, 0.005))
+
+    with pytest.raises(deadlines.DeadlineExceeded):
+        await impatient
+    with pytest.raises(deadlines.DeadlineExceeded):
+        await earlier
+    assert await patient == "corrected"
+    assert len(seen) == 2
+    assert seen[0] is not None and seen[0] <= 0.01
+    assert seen[1] is not None and seen[1] > 0.9
+
+
+@pytest.mark.asyncio
+async def test_stream_reruns_for_a_later_deadline_before_any_chunk():
+    flights = SingleFlight()
+    started: list[int] = []
+
+    async def upstream():
+        started.append(1)
+        yield await deadline_bound()
+
+    impatient = flights.stream("key", upstream, 0.01)
+    patient = flights.stream("key", upstream, 1)
+    results = await asyncio.gather(collect(impatient), collect(patient), return_exceptions=True)
+
+    assert isinstance(results[0], deadlines.DeadlineExceeded)
+    assert results[1] == ["corrected"]
+    assert len(started) == 2
@@ -1,10 +1,12 @@
+import json
 import string
 
 import pytest
 from fastapi import HTTPException
 from starlette.requests import Request
 
-from backend.main import client_ip, sse_event, validate_text
+from backend.cache import CacheEntry
+from backend.main import cached_response_body, client_ip, sse_event, validate_text
 from backend.models import cache_key, request_id
 
 
@@ -41,13 +43,21 @@ def test_validate_text_rejects_too_long():
 
 
 def test_cache_key_deterministic():
-    key1 = cache_key("text", "tt")
-    key2 = cache_key("text", "tt")
-    key3 = cache_key("text", "ru")
+    key1 = cache_key("text", "tt", "gemini", "model-a", "v1")
+    key2 = cache_key("text", "tt", "gemini", "model-a", "v1")
+    key3 = cache_key("text", "ru", "gemini", "model-a", "v1")
     assert key1 == key2
     assert key1 != key3
 
 
+def test_cache_key_versioned_by_backend_model_and_prompt():
+    base = cache_key("text", "tt", "gemini", "model-a", "v1")
+    assert cache_key("text", "tt", "local", "model-a", "v1") != base
+    assert cache_key("text", "tt", "gemini", "model-b", "v1") != base
+    assert cache_key("text", "tt", "gemini", "model-a", "v2") != base
+    assert cache_key("textt", "t", "gemini", "model-a", "v1") != base
+
+
 def test_request_id_hex():
     rid = request_id()
     assert len(rid) == 32
@@ -62,3 +72,14 @@ def test_client_ip_parses_forwarded_for():
     }
     request = Request(scope)
     assert client_ip(request) == "1.2.3.4"
+
+
+def test_cached_response_body_matches_json_response():
+    entry = CacheEntry('әүө "quoted"\n', "gemini", 0.0, compress_min_bytes=8)
+    body = json.loads(cached_response_body("rid", entry))
+
+    assert body == {
+        "request_id": "rid",
+        "corrected_text": 'әүө "quoted"\n',
+        "meta": {"model_backend": "gemini", "latency_ms": 0},
+    }